@@ -0,0 +1,192 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Tuple
+import database as db
+from retrieval import CandidateRetriever
+from tracing import traced
+
+# movies_enriched columns that are derived by rules here rather than by the LLM
+RULE_COLUMNS = ['genre_diversity', 'release_era', 'budget_tier', 'revenue_tier', 'production_effectiveness']
+
+UNKNOWN = 'Unknown'
+# (exclusive upper bound, label): a genre count or release year below the bound gets the label.
+# These are the buckets prompts/enrich_v2.txt used to ask the LLM for.
+GENRE_DIVERSITY_BINS = [(2, 'Single-Genre'), (4, 'Multi-Genre'), (np.inf, 'Genre-Blend')]
+RELEASE_ERA_BINS = [(1980, 'Classic'), (2000, '80s-90s'), (2010, '2000s'), (np.inf, 'Modern')]
+
+TIER_LABELS = ['low', 'medium', 'high']
+# Catalog quantiles separating low/medium and medium/high, for metrics without fixed thresholds
+TIER_QUANTILES = (1 / 3, 2 / 3)
+TIERED_METRICS = ('budget', 'revenue', 'roi', 'weighted_rating')
+
+_CATALOG_QUERY = """
+    SELECT m.movieId, m.genres, m.releaseDate, m.budget, m.revenue, s.rating_count, s.rating_mean
+    FROM movies AS m
+    LEFT JOIN ratings_db.movie_rating_stats AS s ON s.movieId = m.movieId
+"""
+
+def _bin(values: pd.Series, bins: List[Tuple[float, str]]) -> pd.Series:
+    """Labels each value by the first bin whose upper bound it is below; missing values are Unknown."""
+    bounds = np.array([bound for bound, _ in bins[:-1]], dtype=float)
+    labels = np.array([label for _, label in bins] + [UNKNOWN], dtype=object)
+    values = values.to_numpy(dtype=float)
+    positions = np.where(np.isnan(values), len(bins), np.searchsorted(bounds, values, side='right'))
+    return pd.Series(labels[positions], dtype=object)
+
+def _metrics(movies: pd.DataFrame) -> pd.DataFrame:
+    """Numeric inputs of the tiered attributes. Budget/revenue of 0 mean unknown, as in the catalog."""
+    budget = pd.to_numeric(movies['budget'], errors='coerce').astype(float)
+    revenue = pd.to_numeric(movies['revenue'], errors='coerce').astype(float)
+    budget, revenue = budget.where(budget > 0), revenue.where(revenue > 0)
+    count = pd.to_numeric(movies['rating_count'], errors='coerce').fillna(0).astype(float)
+    mean = pd.to_numeric(movies['rating_mean'], errors='coerce').fillna(0).astype(float)
+    prior_count, prior_mean = CandidateRetriever.RATING_PRIOR_COUNT, CandidateRetriever.RATING_PRIOR_MEAN
+    weighted = (mean * count + prior_mean * prior_count) / (count + prior_count)
+    return pd.DataFrame({
+        'budget': budget,
+        'revenue': revenue,
+        'roi': (revenue - budget) / budget,
+        'weighted_rating': weighted.where(count > 0),
+    })
+
+class RuleAttributeEngine:
+    """
+    Computes the rule-defined enrichment attributes for whole DataFrames at once:
+
+        genre_diversity          genre count buckets (GENRE_DIVERSITY_BINS)
+        release_era              release year bins (RELEASE_ERA_BINS)
+        budget_tier/revenue_tier low/medium/high against catalog thresholds
+        production_effectiveness the average of the ROI tier and the weighted rating tier
+
+    Tier thresholds are (low/medium, medium/high) boundaries per metric. Any
+    metric not given in `thresholds` gets the TIER_QUANTILES of the whole
+    catalog, so a movie's tier does not depend on which batch it was enriched
+    in. A full fit saves those cut points in the database, and later runs load
+    them instead of scanning the catalog (see ensure_fitted). Unknown inputs
+    give a NULL tier.
+    """
+
+    def __init__(self, thresholds: Optional[Dict[str, Tuple[float, float]]] = None, quantiles: Sequence[float] = TIER_QUANTILES):
+        self.fixed_thresholds = dict(thresholds or {})
+        self.quantiles = list(quantiles)
+        self.thresholds: Dict[str, Tuple[float, float]] = {}
+        # The quantile thresholds of the last fit, before fixed_thresholds are applied
+        self.fitted_thresholds: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def fit(self, catalog: Optional[pd.DataFrame] = None) -> 'RuleAttributeEngine':
+        """Sets the quantile thresholds from the catalog (loaded from the database if not given)."""
+        with self._lock:
+            self._fit(catalog)
+        return self
+
+    def _fit(self, catalog: Optional[pd.DataFrame]):
+        if catalog is None:
+            catalog = load_catalog()
+        metrics = _metrics(catalog)
+        self.fitted_thresholds = {}
+        for metric in TIERED_METRICS:
+            values = metrics[metric].dropna()
+            self.fitted_thresholds[metric] = tuple(values.quantile(self.quantiles)) if len(values) else (np.inf, np.inf)
+        self.thresholds = {**self.fitted_thresholds, **self.fixed_thresholds}
+
+    def save(self):
+        """Saves the fitted cut points for later runs (only for the default TIER_QUANTILES)."""
+        if self.fitted_thresholds and self.quantiles == list(TIER_QUANTILES):
+            db.save_rule_thresholds(self.fitted_thresholds)
+
+    def ensure_fitted(self):
+        """
+        Loads the cut points saved by the last full fit, so enriching a few movies
+        does not read the whole catalog; if none are saved, fits on the catalog
+        once and saves them. Rerun `build-index attributes` to refit.
+        """
+        with self._lock:
+            if self.thresholds:
+                return
+            saved = db.get_rule_thresholds() if self.quantiles == list(TIER_QUANTILES) else {}
+            if all(metric in saved for metric in TIERED_METRICS):
+                self.thresholds = {**{metric: saved[metric] for metric in TIERED_METRICS}, **self.fixed_thresholds}
+                return
+            self._fit(None)
+        self.save()
+
+    def _tier_points(self, values: pd.Series, metric: str) -> np.ndarray:
+        """0 (low), 1 (medium) or 2 (high) per value, NaN where the value is unknown."""
+        values = values.to_numpy(dtype=float)
+        points = np.searchsorted(np.asarray(self.thresholds[metric], dtype=float), values, side='right').astype(float)
+        points[np.isnan(values)] = np.nan
+        return points
+
+    @staticmethod
+    def _tier_labels(points: np.ndarray) -> pd.Series:
+        labels = np.array(TIER_LABELS + [None], dtype=object)
+        # Halves round up, so a low and a medium tier average to medium
+        positions = np.where(np.isnan(points), len(TIER_LABELS), np.floor(points + 0.5)).astype(int)
+        return pd.Series(labels[positions], dtype=object)
+
+    @traced('attributes.compute', rows=len)
+    def compute(self, movies: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns movieId plus RULE_COLUMNS for every row of `movies` (movies table
+        columns, optionally with rating_count and rating_mean already joined).
+        """
+        if not self.thresholds:
+            self.ensure_fitted()
+        if movies.empty:
+            return pd.DataFrame(columns=['movieId'] + RULE_COLUMNS)
+        movies = movies.reset_index(drop=True)
+        if 'rating_count' not in movies.columns:
+            stats = db.get_movie_rating_stats(movies['movieId'].tolist())[['movieId', 'rating_count', 'rating_mean']]
+            movies = movies.merge(stats, on='movieId', how='left')
+
+        metrics = _metrics(movies)
+        genre_count = movies['genres'].map(lambda genres: len(db.parse_genres(genres)))
+        release_year = pd.to_numeric(movies['releaseDate'].astype(str).str[:4], errors='coerce')
+        # Effectiveness averages whichever of the ROI and rating tiers are known
+        points = np.vstack([
+            self._tier_points(metrics['roi'], 'roi'),
+            self._tier_points(metrics['weighted_rating'], 'weighted_rating'),
+        ])
+        known = (~np.isnan(points)).sum(axis=0)
+        effectiveness = np.where(known > 0, np.nansum(points, axis=0) / np.maximum(known, 1), np.nan)
+
+        return pd.DataFrame({
+            'movieId': movies['movieId'].astype(int),
+            'genre_diversity': _bin(genre_count.where(genre_count > 0), GENRE_DIVERSITY_BINS),
+            'release_era': _bin(release_year, RELEASE_ERA_BINS),
+            'budget_tier': self._tier_labels(self._tier_points(metrics['budget'], 'budget')),
+            'revenue_tier': self._tier_labels(self._tier_points(metrics['revenue'], 'revenue')),
+            'production_effectiveness': self._tier_labels(effectiveness),
+        })
+
+    def compute_for_movies(self, movies: List[Dict]) -> Dict[int, Dict]:
+        """compute() for a list of movie dicts, as {movieId: {column: value}}."""
+        if not movies:
+            return {}
+        attributes = self.compute(pd.DataFrame(movies))
+        return {int(row['movieId']): {c: row[c] for c in RULE_COLUMNS} for row in attributes.to_dict('records')}
+
+def load_catalog() -> pd.DataFrame:
+    """The columns the rules need for every movie, with its rating stats joined, in one query."""
+    return pd.read_sql_query(_CATALOG_QUERY, db.get_catalog_connection())
+
+def build_rule_attributes(engine: Optional[RuleAttributeEngine] = None) -> int:
+    """
+    Recomputes the rule attributes of every movie in one pass and upserts them
+    into movies_enriched, leaving the LLM attributes untouched. The refitted tier
+    cut points are saved for later enrich runs. Returns the number of movies.
+    """
+    start = time.perf_counter()
+    catalog = load_catalog()
+    engine = (engine or RuleAttributeEngine()).fit(catalog)
+    engine.save()
+    attributes = engine.compute(catalog)
+    rows = attributes.astype(object).where(attributes.notna(), None).to_dict('records')
+    db.upsert_enriched_rows(rows, columns=['movieId'] + RULE_COLUMNS)
+    print(f"Computed rule attributes for {len(rows)} movie(s) in {time.perf_counter() - start:.1f}s")
+    for metric, (low, high) in engine.thresholds.items():
+        print(f"  {metric} tiers: low < {low:,.2f} <= medium < {high:,.2f} <= high")
+    return len(rows)
@@ -0,0 +1,78 @@
+import threading
+from typing import Dict, Iterable, Iterator, List
+from prompts import Prompts, ENRICHMENT_COLUMNS, OVERVIEW_CHARS, estimate_tokens, format_table
+
+class TokenBatchPlanner:
+    """
+    Packs movies into enrichment batches by estimated tokens instead of a fixed
+    count: a batch grows until either its input (prompt) or its expected output
+    would pass the budget, or it reaches max_batch_size movies.
+
+    The budgets adapt from feedback passed to record(): a failed batch halves
+    them, a slow one shrinks them, and fast successful batches grow them back
+    towards the configured maximum. batches() reads the current budget every
+    time it closes a batch, so consuming it lazily applies feedback immediately.
+    """
+
+    def __init__(
+        self,
+        max_input_tokens: int = 4000,
+        max_output_tokens: int = 2000,
+        max_batch_size: int = 25,
+        output_tokens_per_movie: int = 25,
+        target_latency: float = 30.0,
+        min_scale: float = 0.1,
+    ):
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_batch_size = max_batch_size
+        self.output_tokens_per_movie = output_tokens_per_movie
+        self.target_latency = target_latency
+        self.min_scale = min_scale
+        self.scale = 1.0
+        self._lock = threading.Lock()
+        # Instructions and output format cost the same for every batch
+        self.prompt_overhead = estimate_tokens(
+            Prompts.get_batch_enrichment_system_message() + Prompts.build_batch_enrichment_prompt([])
+        )
+
+    def estimate_movie_tokens(self, movie: Dict) -> int:
+        """Estimated input tokens for one movie's row in the enrichment table."""
+        row = format_table([movie], ENRICHMENT_COLUMNS, OVERVIEW_CHARS['enrichment']).split('\n', 1)[1]
+        return estimate_tokens(row) + 1
+
+    def current_limits(self):
+        """Returns (input token budget, output token budget, max movies) at the current scale."""
+        with self._lock:
+            scale = self.scale
+        input_budget = self.prompt_overhead + int((self.max_input_tokens - self.prompt_overhead) * scale)
+        output_budget = int(self.max_output_tokens * scale)
+        max_movies = max(1, int(self.max_batch_size * scale))
+        return input_budget, output_budget, max_movies
+
+    def batches(self, movies: Iterable[Dict]) -> Iterator[List[Dict]]:
+        """Greedily packs movies, in order, into batches that fit the current budgets."""
+        batch: List[Dict] = []
+        input_used = self.prompt_overhead
+        input_budget, output_budget, max_movies = self.current_limits()
+        for movie in movies:
+            cost = self.estimate_movie_tokens(movie)
+            output_used = (len(batch) + 1) * self.output_tokens_per_movie
+            if batch and (len(batch) >= max_movies or input_used + cost > input_budget or output_used > output_budget):
+                yield batch
+                batch, input_used = [], self.prompt_overhead
+                input_budget, output_budget, max_movies = self.current_limits()
+            batch.append(movie)
+            input_used += cost
+        if batch:
+            yield batch
+
+    def record(self, batch_size: int, latency: float, ok: bool):
+        """Feeds back the outcome of one batch to adapt the budgets."""
+        with self._lock:
+            if not ok:
+                self.scale = max(self.min_scale, self.scale * 0.5)
+            elif latency > self.target_latency:
+                self.scale = max(self.min_scale, self.scale * 0.8)
+            else:
+                self.scale = min(1.0, self.scale + 0.1)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Set
+from database import NotFoundError
+
+# Task types and the field each one needs, e.g.
+#   {"id": "q1", "type": "recommend", "query": "uplifting space adventure"}
+#   {"id": "u7", "type": "summarize", "user_id": 7}
+#   {"id": "c1", "type": "compare", "movie_ids": [1, 2, 3]}    (add "no_llm": true for metrics only)
+TASK_FIELDS = {'recommend': 'query', 'summarize': 'user_id', 'compare': 'movie_ids'}
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def validate_task(task: Dict):
+    """Raises ValueError if the task has an unknown type or lacks (or mistypes) the fields its type needs."""
+    task_type = task.get('type')
+    if task_type not in TASK_FIELDS:
+        raise ValueError(f"Unknown task type '{task_type}'. Expected one of {list(TASK_FIELDS)}")
+    field = TASK_FIELDS[task_type]
+    if field not in task:
+        raise ValueError(f"'{task_type}' task is missing '{field}'")
+    value = task[field]
+    if task_type == 'recommend' and not (isinstance(value, str) and value.strip()):
+        raise ValueError("'query' must be a non-empty string")
+    if task_type == 'summarize' and not _is_int(value):
+        raise ValueError("'user_id' must be an integer")
+    if task_type == 'compare':
+        if not (isinstance(value, list) and all(_is_int(movie_id) for movie_id in value)):
+            raise ValueError("'movie_ids' must be a list of integers")
+        if len(set(value)) < 2:
+            raise ValueError("'movie_ids' must contain at least two different movie IDs")
+        if not isinstance(task.get('no_llm', False), bool):
+            raise ValueError("'no_llm' must be true or false")
+
+def load_tasks(input_path: str) -> Iterator[Dict]:
+    """
+    Yields tasks from a JSONL file. A task without an "id" gets "line-<n>", so
+    re-running the same file can still be matched against earlier output.
+    A line that is not a JSON object is yielded as {"id": "line-<n>", "parse_error": ...}
+    so the run can record it and carry on.
+    """
+    with open(input_path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                task = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {'id': f"line-{line_num}", 'parse_error': f"Invalid JSON on line {line_num}: {e}"}
+                continue
+            if not isinstance(task, dict):
+                yield {'id': f"line-{line_num}", 'parse_error': f"Line {line_num} is not a JSON object"}
+                continue
+            task.setdefault('id', f"line-{line_num}")
+            yield task
+
+def completed_task_ids(output_path: str) -> Set[str]:
+    """Ids of tasks that already finished successfully in an existing output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            if result.get('status') == 'ok':
+                done.add(str(result['id']))
+    return done
+
+class BatchRunner:
+    """
+    Runs recommend / summarize / compare tasks from a JSONL file in one process,
+    sharing one warm LLM client and database connections (created when a task first needs them). Up to `parallel`
+    tasks run at once and each result is appended to the output JSONL as soon
+    as it completes, so a rerun with the same output file skips finished tasks.
+    """
+
+    def __init__(self, parallel: int = 8):
+        self.parallel = max(1, parallel)
+        # Services are created on first use, so e.g. metrics-only compare batches need no LLM client or API key
+        self._services: Dict[str, object] = {}
+        self._services_lock = threading.Lock()
+        self.handlers = {
+            'recommend': lambda task: self._service('recommender').recommend(task['query']),
+            'summarize': lambda task: self._service('summarizer').summarize(task['user_id']),
+            'compare': self._compare,
+        }
+
+    def _service(self, name: str):
+        """Returns the shared Recommender, Summarizer or Comparator, creating it on first use."""
+        with self._services_lock:
+            if name not in self._services:
+                if name == 'recommender':
+                    from recommender import Recommender
+                    self._services[name] = Recommender()
+                elif name == 'summarizer':
+                    from summarizer import Summarizer
+                    self._services[name] = Summarizer()
+                else:
+                    from comparator import Comparator
+                    self._services[name] = Comparator()
+            return self._services[name]
+
+    def _compare(self, task: Dict):
+        comparator = self._service('comparator')
+        if task.get('no_llm', False):
+            # Metrics-only comparisons return records; format_report's text is for the CLI
+            return comparator.analysis_records(comparator.analyze(task['movie_ids']))
+        return comparator.compare(task['movie_ids'])
+
+    def run_task(self, task: Dict) -> Dict:
+        """
+        Runs one task and returns its result record; errors are reported in the
+        record, not raised. A failed record's error_type is 'invalid' (bad task
+        fields), 'not_found' (unknown user or movies, or nothing to recommend from)
+        or 'internal'.
+        """
+        start = time.perf_counter()
+        result = {'id': task.get('id'), 'type': task.get('type')}
+        try:
+            validate_task(task)
+        except ValueError as e:
+            result.update(status='error', error_type='invalid', error=str(e), elapsed=0.0)
+            return result
+        try:
+            output = self.handlers[task['type']](task)
+            try:
+                output = json.loads(output)
+            except (TypeError, json.JSONDecodeError):
+                pass  # already records, or plain text
+            result.update(status='ok', result=output)
+        except NotFoundError as e:
+            result.update(status='error', error_type='not_found', error=str(e))
+        except Exception as e:
+            result.update(status='error', error_type='internal', error=f"{type(e).__name__}: {e}")
+        result['elapsed'] = round(time.perf_counter() - start, 3)
+        return result
+
+    def run(self, input_path: str, output_path: str) -> Dict[str, int]:
+        """Runs every task not already completed in output_path and returns counts by status."""
+        done = completed_task_ids(output_path)
+        counts = {'ok': 0, 'error': 0, 'skipped': 0}
+        start = time.perf_counter()
+        print(f"Running tasks from {input_path} with {self.parallel} in parallel -> {output_path}"
+              + (f" ({len(done)} already completed)" if done else ""))
+
+        write_lock = threading.Lock()
+        # At most 2x parallel tasks queued, so huge inputs are never loaded at once
+        slots = threading.BoundedSemaphore(self.parallel * 2)
+        with open(output_path, 'a') as out, ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            def write(result: Dict):
+                with write_lock:
+                    out.write(json.dumps(result, default=str) + '\n')
+                    out.flush()
+                    counts[result['status']] += 1
+                print(f"[{result['status']}] {result['type']} {result['id']} ({result['elapsed']:.1f}s)")
+
+            def on_done(future):
+                # Runs on the worker thread as soon as the task finishes, so a crash loses no completed result
+                try:
+                    write(future.result())
+                finally:
+                    slots.release()
+
+            for task in load_tasks(input_path):
+                if str(task['id']) in done:
+                    counts['skipped'] += 1
+                    continue
+                if 'parse_error' in task:
+                    write({'id': task['id'], 'type': None, 'status': 'error', 'error_type': 'invalid',
+                           'error': task['parse_error'], 'elapsed': 0.0})
+                    continue
+                slots.acquire()
+                executor.submit(self.run_task, task).add_done_callback(on_done)
+
+        elapsed = time.perf_counter() - start
+        completed = counts['ok'] + counts['error']
+        print(f"Batch finished in {elapsed:.1f}s: {counts['ok']} ok, {counts['error']} failed, "
+              f"{counts['skipped']} skipped ({completed / elapsed if elapsed else 0.0:.2f} tasks/sec)")
+        return counts
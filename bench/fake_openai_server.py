@@ -0,0 +1,144 @@
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+# A local stand-in for the OpenAI chat completions endpoint, so enrichment and
+# the LLM commands can be benchmarked without calling (or paying for) the real API.
+# Point the client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+SENTIMENTS = ['positive', 'neutral', 'negative']
+AGE_CATEGORIES = ['kid', 'teen', 'adult']
+
+# Rows of the pipe-delimited movie tables the prompts send: "<movieId>|..."
+_MOVIE_ROW_RE = re.compile(r'^(\d+)\|', re.M)
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def default_response(system_message: str, prompt: str) -> Dict:
+    """A plausible JSON answer for each prompt type the project sends."""
+    movie_ids = [int(m) for m in _MOVIE_ROW_RE.findall(prompt)]
+    if 'enriched_movies' in prompt:
+        return {'enriched_movies': [
+            {'movieId': movie_id, 'sentiment': random.choice(SENTIMENTS), 'age_category': random.choice(AGE_CATEGORIES)}
+            for movie_id in movie_ids
+        ]}
+    if 'recommendation' in system_message.lower():
+        return {'recommendations': [
+            {'movieId': movie_id, 'reason': 'Matches the requested genres and tone.'} for movie_id in movie_ids[:5]
+        ]}
+    if 'compar' in system_message.lower():
+        return {'summary': 'The first movie leads on ROI; the second on audience rating.', 'verdict': 'It depends on the viewer.'}
+    return {'summary': 'Prefers well-reviewed dramas and thrillers from the 1990s.', 'favorite_genres': ['Drama', 'Thriller']}
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    Answers POST /v1/chat/completions after `latency` +/- `jitter` seconds.
+    A fraction `error_rate` of requests fail with HTTP 500. `responses` maps a
+    substring of the prompt to a canned JSON answer; the first match wins and
+    anything else gets default_response().
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.2, jitter: float = 0.05, error_rate: float = 0.0,
+                 responses: Optional[Dict[str, Dict]] = None):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.responses = responses or {}
+        self.counts = {'requests': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self._lock = threading.Lock()
+
+    def count(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self.counts[key] += delta
+
+    def answer(self, system_message: str, prompt: str) -> Dict:
+        for marker, response in self.responses.items():
+            if marker in prompt:
+                return response
+        return default_response(system_message, prompt)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+            return
+
+        server: FakeOpenAIServer = self.server
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        if random.random() < server.error_rate:
+            server.count(requests=1, errors=1)
+            self._send_json(500, {'error': {'message': 'Injected failure', 'type': 'server_error'}})
+            return
+
+        messages = body.get('messages', [])
+        system_message = ' '.join(m['content'] for m in messages if m.get('role') == 'system')
+        prompt = messages[-1]['content'] if messages else ''
+        content = json.dumps(server.answer(system_message, prompt))
+        prompt_tokens, completion_tokens = estimate_tokens(system_message + prompt), estimate_tokens(content)
+        server.count(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self._send_json(200, {
+            'id': f"chatcmpl-bench-{random.getrandbits(32):08x}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port: int = 0, **options) -> FakeOpenAIServer:
+    """Starts the server on a background thread (port 0 picks a free port) and returns it."""
+    server = FakeOpenAIServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completions server for benchmarks")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform +/- seconds added to the latency")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--responses", type=str, help="JSON file mapping a prompt substring to a canned JSON response")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+    server = FakeOpenAIServer(('127.0.0.1', args.port), latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, responses=responses)
+    print(f"Fake OpenAI server on http://127.0.0.1:{args.port}/v1 "
+          f"(latency {args.latency}s +/- {args.jitter}s, error rate {args.error_rate:.0%}). Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stopped. {server.counts}")
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import numpy as np
+
+# Builds a synthetic movies_attributes_v2.db (same movies schema as the real one)
+# and a matching ratings.db, so the benchmarks can run at any catalog size
+# without the real data. Run as a script; the database paths are passed to the
+# project through MOVIES_DB_PATH / RATINGS_DB_PATH, which are set before
+# `database` is imported.
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+GENRES = [
+    (28, 'Action'), (12, 'Adventure'), (16, 'Animation'), (35, 'Comedy'), (80, 'Crime'), (99, 'Documentary'),
+    (18, 'Drama'), (10751, 'Family'), (14, 'Fantasy'), (27, 'Horror'), (9648, 'Mystery'), (10749, 'Romance'),
+    (878, 'Science Fiction'), (53, 'Thriller'), (10752, 'War'), (37, 'Western'),
+]
+WORDS = (
+    "a young detective uncovers a conspiracy in a small town while a family struggles to survive the war "
+    "two friends plan a heist across the city as a haunted house hides a dark secret and a robot learns to love "
+    "an unlikely crew journeys through space to find home before revenge tears the kingdom apart"
+).split()
+TITLE_WORDS = ['Night', 'City', 'Dark', 'Love', 'Journey', 'Return', 'Last', 'Heist', 'Storm', 'Secret', 'Star', 'River']
+LANGUAGES = ['en', 'en', 'en', 'fr', 'es', 'de', 'ja', 'ko', 'it']
+RATING_VALUES = np.arange(1, 11) / 2
+# Skewed towards 3-4 stars, like real ratings
+RATING_WEIGHTS = np.array([1, 3, 2, 7, 4, 20, 10, 29, 8, 15], dtype=float) / 99
+
+MOVIES_SCHEMA = """
+    CREATE TABLE movies (
+        movieId INTEGER, imdbId TEXT, title TEXT, overview TEXT, productionCompanies TEXT,
+        releaseDate TEXT, budget INTEGER, revenue INTEGER, runtime REAL, language TEXT, genres TEXT, status TEXT
+    )
+"""
+RATINGS_SCHEMA = """
+    CREATE TABLE ratings (
+        ratingId INTEGER PRIMARY KEY, userId INTEGER NOT NULL, movieId INTEGER NOT NULL,
+        rating REAL NOT NULL, timestamp INTEGER NOT NULL
+    )
+"""
+
+def _movie_rows(n_movies: int, rng: np.random.Generator, chunk_size: int = 50000):
+    """
+    Yields movies table rows, drawing each column for a whole chunk at once.
+    About half the movies have no budget and fewer have revenue, as in the real catalog.
+    """
+    words, title_words = np.array(WORDS), np.array(TITLE_WORDS)
+    genre_json = [json.dumps({'id': genre_id, 'name': name}) for genre_id, name in GENRES]
+    for first in range(1, n_movies + 1, chunk_size):
+        n = min(chunk_size, n_movies + 1 - first)
+        genre_order = rng.random((n, len(GENRES))).argsort(axis=1)
+        genre_counts = rng.integers(0, 5, size=n)
+        budgets = np.where(rng.random(n) < 0.5, rng.lognormal(16.5, 1.2, size=n), 0).astype(np.int64)
+        revenues = np.where((budgets > 0) & (rng.random(n) < 0.8), budgets * rng.lognormal(0.6, 1.0, size=n), 0).astype(np.int64)
+        dates = [f"{y}-{m:02d}-{d:02d}" for y, m, d in zip(
+            rng.integers(1920, 2018, size=n), rng.integers(1, 13, size=n), rng.integers(1, 29, size=n))]
+        has_date = rng.random(n) < 0.95
+        overview_words = words[rng.integers(0, len(words), size=(n, 70))]
+        overview_lengths = rng.integers(15, 71, size=n)
+        titles = title_words[rng.integers(0, len(title_words), size=(n, 3))]
+        title_lengths = rng.integers(1, 4, size=n)
+        runtimes = rng.integers(70, 190, size=n).astype(float)
+        languages = rng.choice(LANGUAGES, size=n)
+        for i in range(n):
+            movie_id = first + i
+            yield (
+                movie_id,
+                f"tt{movie_id:07d}",
+                f"{' '.join(titles[i, :title_lengths[i]])} {movie_id}",
+                ' '.join(overview_words[i, :overview_lengths[i]]).capitalize() + '.',
+                'Studio A|Studio B',
+                dates[i] if has_date[i] else None,
+                int(budgets[i]),
+                int(revenues[i]),
+                runtimes[i],
+                str(languages[i]),
+                '[' + ', '.join(genre_json[g] for g in genre_order[i, :genre_counts[i]]) + ']',
+                'Released',
+            )
+
+def make_movies_db(path: str, n_movies: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    conn.execute(MOVIES_SCHEMA)
+    conn.executemany("INSERT INTO movies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _movie_rows(n_movies, rng))
+    conn.commit()
+    conn.close()
+
+def make_ratings_db(path: str, n_movies: int, light_users: int, heavy_users: int,
+                    light_ratings: int = 20, heavy_ratings: int = 1500, seed: int = 0):
+    """
+    Users 1..light_users rate about `light_ratings` movies each and the next
+    heavy_users about `heavy_ratings`. Popular movies (low ids) are rated far more often.
+    """
+    rng = np.random.default_rng(seed + 1)
+    popularity = 1.0 / np.arange(1, n_movies + 1) ** 0.8
+    popularity /= popularity.sum()
+    conn = sqlite3.connect(path)
+    conn.execute(RATINGS_SCHEMA)
+    for user_id in range(1, light_users + heavy_users + 1):
+        mean_count = light_ratings if user_id <= light_users else heavy_ratings
+        count = int(min(n_movies, max(1, rng.normal(mean_count, mean_count * 0.2))))
+        movie_ids = rng.choice(n_movies, size=count, replace=False, p=popularity) + 1
+        ratings = rng.choice(RATING_VALUES, size=count, p=RATING_WEIGHTS)
+        timestamps = rng.integers(789652009, 1476640644, size=count)
+        conn.executemany(
+            "INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)",
+            zip([user_id] * count, movie_ids.tolist(), ratings.tolist(), timestamps.tolist())
+        )
+    conn.commit()
+    conn.close()
+
+def fill_enrichment(enriched_fraction: float, seed: int = 0) -> int:
+    """
+    Gives the first enriched_fraction of movies random LLM attributes, then
+    computes the rule attributes for all of them, as a finished enrichment run would.
+    """
+    import database as db
+    from attributes import build_rule_attributes
+    rng = np.random.default_rng(seed + 2)
+    n_movies = db.get_read_connection(db.MOVIES_DB_PATH).execute("SELECT COUNT(*) FROM movies").fetchone()[0]
+    n_enriched = int(n_movies * enriched_fraction)
+    rows = [
+        {'movieId': movie_id, 'sentiment': str(rng.choice(['positive', 'neutral', 'negative'])),
+         'age_category': str(rng.choice(['kid', 'teen', 'adult']))}
+        for movie_id in range(1, n_enriched + 1)
+    ]
+    db.upsert_enriched_rows(rows, columns=['movieId', 'sentiment', 'age_category'])
+    build_rule_attributes()
+    return n_enriched
+
+def generate(out_dir: str, n_movies: int, light_users: int, heavy_users: int, enriched_fraction: float, seed: int = 0):
+    """Writes movies_attributes_v2.db and ratings.db into out_dir, replacing any previous ones."""
+    start = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    movies_path = os.path.join(out_dir, 'movies_attributes_v2.db')
+    ratings_path = os.path.join(out_dir, 'ratings.db')
+    for path in [movies_path, ratings_path]:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    make_movies_db(movies_path, n_movies, seed)
+    make_ratings_db(ratings_path, n_movies, light_users, heavy_users, seed=seed)
+    print(f"Wrote {n_movies} movies and {light_users + heavy_users} users' ratings in {time.perf_counter() - start:.1f}s")
+
+    os.environ['MOVIES_DB_PATH'] = movies_path
+    os.environ['RATINGS_DB_PATH'] = ratings_path
+    import database as db
+    db.ensure_schema()
+    n_enriched = fill_enrichment(enriched_fraction, seed)
+    db.connections.close_all()
+    print(f"Synthetic databases ready in {out_dir} ({n_enriched} movies enriched) in {time.perf_counter() - start:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic movies and ratings databases for benchmarks")
+    parser.add_argument("out_dir", type=str, help="Directory for movies_attributes_v2.db and ratings.db")
+    parser.add_argument("--movies", type=int, default=10000, help="Number of movies")
+    parser.add_argument("--light_users", type=int, default=450, help="Users with about 20 ratings")
+    parser.add_argument("--heavy_users", type=int, default=50, help="Users with about 1500 ratings")
+    parser.add_argument("--enriched_fraction", type=float, default=1.0, help="Share of movies given LLM attributes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.movies, args.light_users, args.heavy_users, args.enriched_fraction, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# End-to-end benchmarks against synthetic catalogs and the fake OpenAI server.
+# The parent process generates (or reuses) the catalogs, starts the fake server
+# and runs every scenario in its own child process, so each one starts cold and
+# reports its own peak RSS. Example:
+#
+#   python bench/run_bench.py --sizes 1000,10000,100000 --output bench/data/results.json
+#   python bench/run_bench.py --scenarios recommend --sizes 1000000 --baseline bench/data/results.json
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(bench_dir)
+sys.path.insert(0, project_root)
+
+SCENARIOS = ('enrich', 'recommend', 'summarize', 'compare')
+RECOMMEND_QUERIES = [
+    'uplifting space adventure for the family',
+    'dark crime thriller from the 90s',
+    'romantic comedy with a happy ending',
+    'high budget action movie that flopped',
+    'classic war drama',
+    'animated movie for kids',
+    'haunted house horror',
+    'heist movie with a clever plan',
+]
+# Percentage change against --baseline above which a result is flagged
+REGRESSION_THRESHOLD = 10.0
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {'p50': round(float(p50), 1), 'p95': round(float(p95), 1), 'p99': round(float(p99), 1)}
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# --- Child process: runs one scenario against the catalog in MOVIES_DB_PATH/RATINGS_DB_PATH ---
+
+def _ensure_indexes():
+    """Builds the semantic and similarity indexes for this catalog if they are missing."""
+    from semantic_index import SemanticIndex
+    from similarity import SimilarityIndex
+    if not SemanticIndex.exists():
+        SemanticIndex.build()
+    if not SimilarityIndex.exists():
+        SimilarityIndex.build()
+
+def bench_enrich(spec: Dict) -> Dict:
+    """Streams every movie of the enrich catalog through the pipeline, timing each LLM batch."""
+    import database as db
+    from enricher import MovieEnricher
+    from pipeline import EnrichmentPipeline
+    from batch_planner import TokenBatchPlanner
+    from llm_client import get_llm_client
+
+    latencies = []
+
+    class TimedEnricher(MovieEnricher):
+        def enrich_batch(self, movies_batch, prompt=None):
+            start = time.perf_counter()
+            try:
+                return super().enrich_batch(movies_batch, prompt)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    # Clear the LLM attributes so every movie is pending again
+    with db.write_connection(db.MOVIES_DB_PATH) as conn:
+        conn.execute("UPDATE movies_enriched SET sentiment = NULL, age_category = NULL")
+    pipeline = EnrichmentPipeline(
+        TimedEnricher(get_llm_client()),
+        planner=TokenBatchPlanner(max_batch_size=spec['batch_size']),
+        concurrency=spec['concurrency'],
+    )
+    start = time.perf_counter()
+    stats = pipeline.run()
+    elapsed = time.perf_counter() - start
+    return {
+        'count': len(latencies),
+        'errors': stats['failed'],
+        'elapsed': elapsed,
+        'throughput': stats['enriched'] / elapsed,
+        'unit': 'movies/s',
+        'latencies': latencies,
+    }
+
+def _tasks(spec: Dict) -> List[Dict]:
+    rng = random.Random(spec['seed'])
+    n, kind = spec['requests'], spec['scenario']
+    if kind == 'recommend':
+        return [{'type': 'recommend', 'query': RECOMMEND_QUERIES[i % len(RECOMMEND_QUERIES)]} for i in range(n)]
+    if kind == 'summarize':
+        first, last = spec['user_range']
+        return [{'type': 'summarize', 'user_id': rng.randint(first, last)} for _ in range(n)]
+    popular = min(spec['movies'], 1000)
+    return [
+        {'type': 'compare', 'movie_ids': rng.sample(range(1, popular + 1), 3), 'no_llm': spec.get('no_llm', False)}
+        for _ in range(n)
+    ]
+
+def bench_tasks(spec: Dict) -> Dict:
+    """Runs recommend/summarize/compare tasks through one warm BatchRunner, `clients` at a time."""
+    from batch_runner import BatchRunner
+    if spec['indexes']:
+        _ensure_indexes()
+    runner = BatchRunner()
+    tasks = _tasks(spec)
+    runner.run_task(tasks[0])  # warm-up: loads indexes and opens connections
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=spec['clients']) as executor:
+        results = list(executor.map(runner.run_task, tasks))
+    elapsed = time.perf_counter() - start
+    return {
+        'count': len(results),
+        'errors': sum(r['status'] != 'ok' for r in results),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed,
+        'unit': 'req/s',
+        'latencies': [r['elapsed'] for r in results],
+    }
+
+def run_child(spec: Dict):
+    result = bench_enrich(spec) if spec['scenario'] == 'enrich' else bench_tasks(spec)
+    result['peak_rss_mb'] = peak_rss_mb()
+    with open(spec['result_path'], 'w') as f:
+        json.dump(result, f)
+
+# --- Parent process ---
+
+def ensure_catalog(data_dir: str, name: str, n_movies: int, light_users: int, heavy_users: int, enriched_fraction: float) -> Dict:
+    """Generates a synthetic catalog with make_synthetic_db.py unless an identical one exists."""
+    catalog_dir = os.path.join(data_dir, name)
+    meta = {'movies': n_movies, 'light_users': light_users, 'heavy_users': heavy_users, 'enriched_fraction': enriched_fraction}
+    meta_path = os.path.join(catalog_dir, 'catalog.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return {'dir': catalog_dir, **meta}
+
+    print(f"Generating {name}...")
+    subprocess.run([
+        sys.executable, os.path.join(bench_dir, 'make_synthetic_db.py'), catalog_dir,
+        '--movies', str(n_movies), '--light_users', str(light_users), '--heavy_users', str(heavy_users),
+        '--enriched_fraction', str(enriched_fraction),
+    ], check=True, cwd=project_root)
+    # Indexes built for a previous catalog in this directory are stale
+    for index in ['semantic_index', 'similarity_index']:
+        shutil.rmtree(os.path.join(catalog_dir, index), ignore_errors=True)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return {'dir': catalog_dir, **meta}
+
+def run_scenario(name: str, spec: Dict, catalog: Dict, base_url: str) -> Dict:
+    """Runs one scenario in a child process and returns its summary row."""
+    env = {
+        **os.environ,
+        'MOVIES_DB_PATH': os.path.join(catalog['dir'], 'movies_attributes_v2.db'),
+        'RATINGS_DB_PATH': os.path.join(catalog['dir'], 'ratings.db'),
+        'SEMANTIC_INDEX_DIR': os.path.join(catalog['dir'], 'semantic_index'),
+        'SIMILARITY_INDEX_DIR': os.path.join(catalog['dir'], 'similarity_index'),
+        'OPENAI_BASE_URL': base_url,
+        'OPENAI_API_KEY': 'bench',
+        'LLM_CACHE_MODE': 'bypass',
+    }
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        result_path = f.name
+    spec = {**spec, 'movies': catalog['movies'], 'result_path': result_path}
+    try:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                               env=env, cwd=project_root, capture_output=True, text=True)
+        if child.returncode != 0:
+            print(f"{name} failed:\n{child.stdout[-2000:]}{child.stderr[-2000:]}")
+            return {'name': name, 'failed': True}
+        with open(result_path) as f:
+            result = json.load(f)
+    finally:
+        os.remove(result_path)
+
+    latencies = result.pop('latencies')
+    row = {'name': name, **result, **percentiles(latencies)}
+    row['elapsed'] = round(row['elapsed'], 2)
+    row['throughput'] = round(row['throughput'], 2)
+    print(format_row(row))
+    return row
+
+HEADER = f"{'scenario':<34} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'throughput':>16} {'peak RSS':>10}"
+
+def format_row(row: Dict) -> str:
+    if row.get('failed'):
+        return f"{row['name']:<34} failed"
+    return (f"{row['name']:<34} {row['count']:>5} {row['errors']:>4} {row['p50']:>9} {row['p95']:>9} {row['p99']:>9} "
+            f"{str(row['throughput']) + ' ' + row['unit']:>16} {str(row['peak_rss_mb']) + ' MB':>10}")
+
+def compare_with_baseline(rows: List[Dict], baseline_path: str):
+    """Prints the change in p95, throughput and peak RSS against a previous --output file."""
+    with open(baseline_path) as f:
+        baseline = {row['name']: row for row in json.load(f)['results'] if not row.get('failed')}
+    print(f"\nChange against {baseline_path} (flagged when worse by more than {REGRESSION_THRESHOLD:.0f}%):")
+    for row in rows:
+        before = baseline.get(row['name'])
+        if row.get('failed') or not before:
+            continue
+        changes = []
+        for key, higher_is_worse in [('p95', True), ('throughput', False), ('peak_rss_mb', True)]:
+            if not before.get(key) or row.get(key) is None:
+                continue
+            change = (row[key] - before[key]) / before[key] * 100
+            worse = change > REGRESSION_THRESHOLD if higher_is_worse else change < -REGRESSION_THRESHOLD
+            changes.append(f"{key} {change:+.1f}%{' REGRESSION' if worse else ''}")
+        print(f"  {row['name']:<34} {', '.join(changes)}")
+
+def parse_ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks on synthetic catalogs with a fake OpenAI server")
+    parser.add_argument("--scenarios", type=str, default=','.join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--sizes", type=str, default="1000,10000,100000", help="Catalog sizes (movies) for recommend/summarize/compare")
+    parser.add_argument("--requests", type=int, default=30, help="Requests per recommend/summarize/compare scenario")
+    parser.add_argument("--clients", type=int, default=1, help="Requests in flight at once")
+    parser.add_argument("--no_indexes", action="store_true", help="Do not build or use the semantic and similarity indexes")
+    parser.add_argument("--light_users", type=int, default=450, help="Users with about 20 ratings per catalog")
+    parser.add_argument("--heavy_users", type=int, default=50, help="Users with about 1500 ratings per catalog")
+    parser.add_argument("--enrich_movies", type=int, default=1000, help="Movies enriched per enrich scenario")
+    parser.add_argument("--batch_sizes", type=str, default="10,25,50", help="Enrichment batch sizes to try")
+    parser.add_argument("--concurrency", type=str, default="1,8", help="Enrichment concurrency levels to try")
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake LLM seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Fake LLM +/- seconds added to the latency")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of fake LLM requests that fail with HTTP 500")
+    parser.add_argument("--data_dir", type=str, default=os.path.join(bench_dir, 'data'), help="Where synthetic catalogs are kept")
+    parser.add_argument("--output", type=str, help="Write the results as JSON, e.g. for a later --baseline")
+    parser.add_argument("--baseline", type=str, help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    from fake_openai_server import start_server
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s) {', '.join(sorted(unknown))}. Expected some of {', '.join(SCENARIOS)}")
+
+    server = start_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    print(f"Fake OpenAI server on {base_url} (latency {args.latency}s +/- {args.jitter}s, error rate {args.error_rate:.0%})")
+
+    rows = []
+    print(HEADER)
+    if 'enrich' in scenarios:
+        catalog = ensure_catalog(args.data_dir, f"enrich_{args.enrich_movies}", args.enrich_movies, 50, 5, 0.0)
+        for batch_size in parse_ints(args.batch_sizes):
+            for concurrency in parse_ints(args.concurrency):
+                spec = {'scenario': 'enrich', 'batch_size': batch_size, 'concurrency': concurrency}
+                rows.append(run_scenario(f"enrich batch={batch_size} conc={concurrency}", spec, catalog, base_url))
+
+    for size in parse_ints(args.sizes):
+        if not set(scenarios) & {'recommend', 'summarize', 'compare'}:
+            break
+        catalog = ensure_catalog(args.data_dir, f"catalog_{size}", size, args.light_users, args.heavy_users, 1.0)
+        base = {'requests': args.requests, 'clients': args.clients, 'indexes': not args.no_indexes, 'seed': args.seed}
+        if 'recommend' in scenarios:
+            rows.append(run_scenario(f"recommend {size}", {**base, 'scenario': 'recommend'}, catalog, base_url))
+        if 'summarize' in scenarios:
+            light, heavy = (1, args.light_users), (args.light_users + 1, args.light_users + args.heavy_users)
+            for label, user_range in [('light', light), ('heavy', heavy)]:
+                spec = {**base, 'scenario': 'summarize', 'user_range': user_range}
+                rows.append(run_scenario(f"summarize {label} users {size}", spec, catalog, base_url))
+        if 'compare' in scenarios:
+            for no_llm in [False, True]:
+                spec = {**base, 'scenario': 'compare', 'no_llm': no_llm}
+                rows.append(run_scenario(f"compare{' --no_llm' if no_llm else ''} {size}", spec, catalog, base_url))
+
+    server.shutdown()
+    print(f"\nFake LLM: {server.counts['requests']} request(s), {server.counts['errors']} injected error(s), "
+          f"{server.counts['prompt_tokens']} prompt / {server.counts['completion_tokens']} completion tokens")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args), 'results': rows}, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        compare_with_baseline(rows, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,198 @@
+import json
+import numpy as np
 import pandas as pd
-from llm_client import LLMClient
+from typing import Dict, List, Optional
+from llm_client import LLMClient, get_llm_client
 from prompts import Prompts
-# Import the specific path and the connection function
-from database import get_db_connection, MOVIES_DB_PATH
+from database import NotFoundError, get_movies_by_ids, get_movie_rating_stats, get_enriched_attributes, parse_genres
+from retrieval import CandidateRetriever
+from tracing import span, traced
+
+# Per-movie metrics, in report order
+METRIC_COLUMNS = [
+    'movieId', 'title', 'year', 'genres', 'sentiment', 'budget', 'revenue', 'profit', 'roi',
+    'runtime', 'runtime_delta', 'avg_rating', 'rating_std', 'rating_count', 'pct_high', 'pct_low',
+    'weighted_rating', 'overall_rank',
+]
+
+# Histogram buckets counted as a high (4-5 stars) or low (0.5-2 stars) rating
+HIGH_RATING_BUCKETS = ['hist_40', 'hist_45', 'hist_50']
+LOW_RATING_BUCKETS = ['hist_05', 'hist_10', 'hist_15', 'hist_20']
+
+def _ratio_matrix(values: np.ndarray) -> np.ndarray:
+    """values[i] / values[j], NaN where the denominator is 0."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = values[:, None] / values[None, :]
+    ratio[~np.isfinite(ratio)] = np.nan
+    return ratio
 
 class Comparator:
-    def __init__(self):
-        self.llm_client = LLMClient()
+    def __init__(self, llm_client: Optional[LLMClient] = None):
+        # The LLM client is only created when a narrative is requested
+        self._llm_client = llm_client
         self.prompts = Prompts()
 
+    @property
+    def llm_client(self) -> LLMClient:
+        if self._llm_client is None:
+            self._llm_client = get_llm_client()
+        return self._llm_client
+
     def get_movie_details(self, movie_ids):
         """Fetches details for a list of movies from the movies database."""
-        if not movie_ids:
-            return pd.DataFrame()
-        
-        conn = get_db_connection(MOVIES_DB_PATH)
-        # The movie_ids list needs to be converted to a tuple for the query
-        query = f"SELECT * FROM movies WHERE movieId IN ({','.join(['?']*len(movie_ids))})"
-        df = pd.read_sql_query(query, conn, params=tuple(movie_ids))
-        conn.close()
-        return df
-
-    def compare(self, movie_ids):
-        """Generates a comparison of two or more movies."""
-        if len(movie_ids) < 2:
-            return "Please provide at least two movie IDs to compare."
+        return get_movies_by_ids(movie_ids)
+
+    @traced('comparator.metrics', rows=len)
+    def compute_metrics(self, movie_details: pd.DataFrame) -> pd.DataFrame:
+        """
+        Per-movie financial, runtime and audience metrics, computed column-wise
+        for any number of movies. ROI is (revenue - budget) / budget and is left
+        empty when either figure is unknown (0 in the catalog).
+        """
+        ids = movie_details['movieId'].tolist()
+        metrics = movie_details[['movieId', 'title', 'genres', 'budget', 'revenue', 'runtime', 'releaseDate']].copy()
+        metrics = metrics.merge(get_movie_rating_stats(ids), on='movieId', how='left')
+        metrics = metrics.merge(get_enriched_attributes(ids)[['movieId', 'sentiment']], on='movieId', how='left')
+
+        metrics['year'] = pd.to_numeric(metrics['releaseDate'].astype(str).str[:4], errors='coerce').astype('Int64')
+        budget = metrics['budget'].astype(float).where(metrics['budget'] > 0)
+        revenue = metrics['revenue'].astype(float).where(metrics['revenue'] > 0)
+        metrics['profit'] = revenue - budget
+        metrics['roi'] = (metrics['profit'] / budget).round(2)
+        runtime = metrics['runtime'].astype(float).where(metrics['runtime'] > 0)
+        metrics['runtime_delta'] = (runtime - runtime.median()).round(0)
+
+        count = metrics['rating_count'].fillna(0)
+        metrics['rating_count'] = count.astype(int)
+        metrics['avg_rating'] = metrics['rating_mean'].round(2)
+        metrics['rating_std'] = np.sqrt(metrics['rating_variance'].clip(lower=0)).round(2)
+        safe_count = count.where(count > 0)
+        metrics['pct_high'] = (metrics[HIGH_RATING_BUCKETS].sum(axis=1) / safe_count * 100).round(0)
+        metrics['pct_low'] = (metrics[LOW_RATING_BUCKETS].sum(axis=1) / safe_count * 100).round(0)
+
+        # Bayesian average, as in recommendation ranking, so a few votes do not dominate
+        prior_count, prior_mean = CandidateRetriever.RATING_PRIOR_COUNT, CandidateRetriever.RATING_PRIOR_MEAN
+        rating_sum = metrics['rating_mean'].fillna(0) * count
+        metrics['weighted_rating'] = ((rating_sum + prior_mean * prior_count) / (count + prior_count)).round(2)
+
+        # Overall: average rank over ROI, revenue and weighted rating (unknowns rank last)
+        ranks = pd.concat([
+            metrics['roi'].rank(ascending=False, na_option='bottom'),
+            metrics['revenue'].where(metrics['revenue'] > 0).rank(ascending=False, na_option='bottom'),
+            metrics['weighted_rating'].rank(ascending=False),
+        ], axis=1)
+        metrics['overall_rank'] = ranks.mean(axis=1).rank(method='min').astype(int)
+        metrics['genres'] = metrics['genres'].map(lambda value: ', '.join(parse_genres(value)))
+        return metrics[METRIC_COLUMNS].sort_values('overall_rank').reset_index(drop=True)
+
+    @traced('comparator.pairwise')
+    def compute_pairwise(self, metrics: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """
+        N x N matrices over the movies in `metrics`: revenue ratio (row / column),
+        runtime difference in minutes (row - column), rating difference and genre
+        overlap (Jaccard index of the two genre sets).
+        """
+        labels = metrics['movieId'].astype(str).tolist()
+        genre_sets = [set(filter(None, g.split(', '))) for g in metrics['genres']]
+        all_genres = sorted(set().union(*genre_sets))
+        membership = np.array([[genre in genres for genre in all_genres] for genres in genre_sets], dtype=np.float32)
+        if not all_genres:
+            membership = np.zeros((len(genre_sets), 1), dtype=np.float32)
+        shared = membership @ membership.T
+        sizes = membership.sum(axis=1)
+        union = sizes[:, None] + sizes[None, :] - shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jaccard = np.where(union > 0, shared / union, 0.0)
+
+        revenue = metrics['revenue'].astype(float).where(metrics['revenue'] > 0).to_numpy()
+        runtime = metrics['runtime'].astype(float).where(metrics['runtime'] > 0).to_numpy()
+        rating = metrics['weighted_rating'].to_numpy(dtype=float)
+        matrices = {
+            'revenue_ratio': _ratio_matrix(revenue).round(2),
+            'runtime_delta': (runtime[:, None] - runtime[None, :]).round(0),
+            'rating_delta': (rating[:, None] - rating[None, :]).round(2),
+            'genre_overlap': jaccard.round(2),
+        }
+        return {name: pd.DataFrame(matrix, index=labels, columns=labels) for name, matrix in matrices.items()}
+
+    def analyze(self, movie_ids: List[int]) -> Dict:
+        """
+        Computes the metrics table, pairwise matrices and per-dimension leaders.
+        Raises ValueError for fewer than two IDs and NotFoundError for unknown ones.
+        """
+        if len(set(movie_ids)) < 2:
+            raise ValueError("Please provide at least two movie IDs to compare.")
 
         movie_details = self.get_movie_details(movie_ids)
-        if len(movie_details) < len(movie_ids):
+        if len(movie_details) < len(set(movie_ids)):
             found_ids = movie_details['movieId'].tolist()
             missing_ids = set(movie_ids) - set(found_ids)
-            return f"Could not find movie details for all provided IDs. Missing: {missing_ids}"
+            raise NotFoundError(f"Could not find movie details for all provided IDs. Missing: {missing_ids}")
+
+        metrics = self.compute_metrics(movie_details)
+        leaders = {}
+        for column, label in [('roi', 'best_roi'), ('revenue', 'highest_revenue'), ('budget', 'highest_budget'),
+                              ('weighted_rating', 'best_rated'), ('rating_count', 'most_rated'), ('runtime', 'longest')]:
+            values = metrics[column].where(metrics[column] > 0) if column in ('revenue', 'budget', 'runtime') else metrics[column]
+            if values.notna().any():
+                leader = metrics.loc[values.idxmax()]
+                value = leader[column]
+                leaders[label] = {'movieId': int(leader['movieId']), 'title': leader['title'], 'value': value.item() if hasattr(value, 'item') else value}
+        winner = metrics.iloc[0]
+        leaders['overall'] = {'movieId': int(winner['movieId']), 'title': winner['title']}
+        return {'metrics': metrics, 'pairwise': self.compute_pairwise(metrics), 'leaders': leaders}
+
+    def format_report(self, analysis: Dict) -> str:
+        """Plain text report of an analysis, for the CLI's --no-llm output."""
+        lines = ["Movie metrics (overall_rank averages the ROI, revenue and weighted rating ranks):"]
+        lines.append(analysis['metrics'].to_string(index=False))
+        for name, matrix in analysis['pairwise'].items():
+            lines.append(f"\n{name} (row vs column):")
+            lines.append(matrix.to_string())
+        lines.append("\nLeaders:")
+        for label, leader in analysis['leaders'].items():
+            value = f" ({leader['value']:,})" if 'value' in leader else ''
+            lines.append(f"  {label}: {leader['title']} [{leader['movieId']}]{value}")
+        return '\n'.join(lines)
+
+    def analysis_records(self, analysis: Dict) -> Dict:
+        """
+        An analysis as JSON-ready records, for API callers: the metrics rows,
+        the leaders and each pairwise matrix as rows keyed by movieId.
+        """
+        return {
+            'metrics': json.loads(analysis['metrics'].to_json(orient='records')),
+            'leaders': analysis['leaders'],
+            'pairwise': {
+                name: json.loads(matrix.rename_axis('movieId').reset_index().to_json(orient='records'))
+                for name, matrix in analysis['pairwise'].items()
+            },
+        }
 
-        movies_data = movie_details.to_dict('records')
+    @traced('comparator.compare')
+    def compare(self, movie_ids, use_llm: bool = True):
+        """
+        Compares two or more movies. The metrics are always computed locally;
+        with use_llm the LLM only writes a narrative over the computed table.
+        """
+        analysis = self.analyze(movie_ids)
+        if not use_llm:
+            return self.format_report(analysis)
 
-        prompt = self.prompts.build_comparison_prompt(movies_data)
+        with span('comparator.metric_records', rows=len(analysis['metrics'])):
+            metrics_rows = analysis['metrics'].to_dict('records')
+        prompt = self.prompts.build_comparison_prompt(metrics_rows, analysis['leaders'], analysis['pairwise']['genre_overlap'])
         system_message = self.prompts.get_comparison_system_message()
 
-        comparison = self.llm_client.generate(prompt, system_message, json_mode=True)
-        return comparison
+        response = self.llm_client.generate(prompt, system_message, json_mode=True)
+        with span('comparator.serialize', rows=len(metrics_rows)):
+            return json.dumps({**self.analysis_records(analysis), 'narrative': json.loads(response)}, indent=2, default=str)
 
 if __name__ == '__main__':
     # Example usage:
     comparator = Comparator()
     # Replace with actual movie IDs from your database
-    test_movie_ids = [1, 2] 
+    test_movie_ids = [1, 2]
     comparison = comparator.compare(test_movie_ids)
     print(f"Comparison for movie IDs: {test_movie_ids}")
     print(comparison)
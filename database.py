@@ -1,81 +1,827 @@
+import os
+import json
+import time
+import queue
 import sqlite3
-import pandas as pd
-from typing import List
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Set, Tuple
+from tracing import span, traced
 
-# Setting the final, correct database paths.
-MOVIES_DB_PATH = 'db/movies_attributes_v2.db'
-RATINGS_DB_PATH = 'db/ratings.db'
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pandas is imported inside the functions that return DataFrames, so commands that
+# only need SQLite (schema checks, job queue status, index lookups) start quickly.
+
+# Setting the final, correct database paths. MOVIES_DB_PATH / RATINGS_DB_PATH in the
+# environment point every command at other files (e.g. the synthetic databases in bench/).
+MOVIES_DB_PATH = os.getenv('MOVIES_DB_PATH', 'db/movies_attributes_v2.db')
+RATINGS_DB_PATH = os.getenv('RATINGS_DB_PATH', 'db/ratings.db')
+
+# Columns of the movies_enriched table, in storage order.
+ENRICHED_COLUMNS = [
+    'movieId',
+    'sentiment',
+    'budget_tier',
+    'revenue_tier',
+    'production_effectiveness',
+    'age_category',
+    'genre_diversity',
+    'release_era',
+]
+
+class NotFoundError(LookupError):
+    """A requested user or movie is not in the databases (HTTP 404 in server mode)."""
 
 def get_db_connection(db_path):
-    """Establishes a connection to a specified SQLite database."""
+    """
+    Establishes a new, caller-owned connection to a specified SQLite database.
+    Prefer get_read_connection()/write_connection() for anything called repeatedly.
+    """
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     return conn
 
+def parse_genres(genres) -> List[str]:
+    """
+    Returns the genre names of a movies.genres value. Handles both the JSON form
+    ('[{"id": 18, "name": "Drama"}]' or '["Drama"]') and the pipe-separated form ('Action|Drama').
+    """
+    if genres is None or (isinstance(genres, float) and genres != genres):
+        return []
+    text = str(genres).strip()
+    if not text:
+        return []
+    if text.startswith('['):
+        try:
+            items = json.loads(text)
+            return [item['name'] if isinstance(item, dict) else str(item) for item in items]
+        except (ValueError, KeyError, TypeError):
+            pass
+    return [part.strip() for part in text.split('|') if part.strip()]
+
+# --- Connection management ---
+
+# Pragmas applied to every managed connection. cache_size is negative, so it is in KiB.
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+class ConnectionManager:
+    """
+    Hands out long-lived SQLite connections so helpers do not pay for an
+    open/close on every query:
+      - reads use one connection per (thread, database), created on first use
+      - writes share one connection per database, serialized by a lock
+    Databases are switched to WAL so readers never block on the writer.
+    Each connection keeps its own prepared-statement cache (`cached_statements`).
+    """
+
+    def __init__(self, pragmas: Dict = None, cached_statements: int = 256):
+        self.pragmas = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_conns: Dict[str, sqlite3.Connection] = {}
+        self._write_locks: Dict[str, threading.Lock] = {}
+        # Read connections by owning thread, so connections of finished threads can be closed.
+        self._reader_conns: Dict[threading.Thread, List[sqlite3.Connection]] = {}
+
+    def _connect(self, db_path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            # Read-only files cannot change journal mode; they are still readable.
+            pass
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _register_reader(self, conn: sqlite3.Connection):
+        with self._lock:
+            for thread in [t for t in self._reader_conns if not t.is_alive()]:
+                for stale in self._reader_conns.pop(thread):
+                    stale.close()
+            self._reader_conns.setdefault(threading.current_thread(), []).append(conn)
+
+    def reader(self, db_path: str, attach: Dict[str, str] = None) -> sqlite3.Connection:
+        """
+        Returns this thread's read connection for db_path. Do not close it.
+        `attach` maps schema aliases to other database files to ATTACH on that connection.
+        """
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        key = (db_path, tuple(sorted((attach or {}).items())))
+        conn = conns.get(key)
+        if conn is None:
+            conn = self._connect(db_path)
+            for alias, attached_path in (attach or {}).items():
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (attached_path,))
+            conns[key] = conn
+            self._register_reader(conn)
+        return conn
+
+    @contextmanager
+    def writer(self, db_path: str) -> Iterator[sqlite3.Connection]:
+        """Yields the shared write connection for db_path inside a single transaction."""
+        with self._lock:
+            if db_path not in self._write_locks:
+                self._write_locks[db_path] = threading.Lock()
+            write_lock = self._write_locks[db_path]
+        with write_lock:
+            conn = self._write_conns.get(db_path)
+            if conn is None:
+                conn = self._write_conns[db_path] = self._connect(db_path)
+            with conn:
+                yield conn
+
+    def close_all(self):
+        """Closes every connection handed out so far (e.g. at process exit)."""
+        with self._lock:
+            for conns in self._reader_conns.values():
+                for conn in conns:
+                    conn.close()
+            self._reader_conns.clear()
+            for conn in self._write_conns.values():
+                conn.close()
+            self._write_conns.clear()
+            self._local = threading.local()
+
+connections = ConnectionManager()
+
+def get_read_connection(db_path) -> sqlite3.Connection:
+    """Returns the calling thread's reusable read connection for db_path."""
+    return connections.reader(db_path)
+
+def get_catalog_connection() -> sqlite3.Connection:
+    """
+    Returns the calling thread's read connection to the movies database with the
+    ratings database attached as `ratings_db`, for queries that join across both.
+    """
+    return connections.reader(MOVIES_DB_PATH, attach={'ratings_db': RATINGS_DB_PATH})
+
+def write_connection(db_path):
+    """Context manager yielding the shared write connection for db_path in a transaction."""
+    return connections.writer(db_path)
+
+# --- Schema management ---
+# Each database carries its schema version in PRAGMA user_version. Migrations are
+# applied in order on startup by ensure_schema(); every migration is idempotent so
+# re-running one against a partially migrated database is safe.
+
+def _table_exists(conn, table_name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+def _table_columns(conn, table_name: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+
+def _primary_key_columns(conn, table_name: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})") if row[5]]
+
+def _create_movies_enriched_table(conn, table_name: str = 'movies_enriched'):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            movieId INTEGER PRIMARY KEY,
+            sentiment TEXT,
+            budget_tier TEXT,
+            revenue_tier TEXT,
+            production_effectiveness TEXT,
+            age_category TEXT,
+            genre_diversity TEXT,
+            release_era TEXT
+        )
+    """)
+
+def _migrate_ratings_indexes(conn):
+    """Covering index for per-movie rating aggregates and an index for per-user lookups."""
+    if not _table_exists(conn, 'ratings'):
+        return
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ratings_movie_rating ON ratings (movieId, rating)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ratings_user_movie ON ratings (userId, movieId)")
+
+def _migrate_user_profiles(conn):
+    """Precomputed per-user taste profiles (see user_profiles.py)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            userId INTEGER PRIMARY KEY,
+            rating_count INTEGER NOT NULL,
+            rating_mean REAL,
+            rating_variance REAL,
+            source_count INTEGER NOT NULL,
+            source_sum REAL NOT NULL,
+            profile TEXT NOT NULL,
+            built_at REAL NOT NULL
+        )
+    """)
+
+def _migrate_user_profiles_catalog_checksum(conn):
+    """
+    user_profiles.source_catalog: how many of the user's rated movies have details,
+    enrichment rows and LLM attributes. Existing profiles get -1, so they are rebuilt on next use.
+    """
+    if not _table_exists(conn, 'user_profiles'):
+        return
+    if 'source_catalog' not in _table_columns(conn, 'user_profiles'):
+        conn.execute("ALTER TABLE user_profiles ADD COLUMN source_catalog INTEGER NOT NULL DEFAULT -1")
+
+def _migrate_movies_index(conn):
+    """Index movies.movieId unless it is already the table's primary key."""
+    if not _table_exists(conn, 'movies'):
+        return
+    if _primary_key_columns(conn, 'movies') != ['movieId']:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_movies_movieId ON movies (movieId)")
+
+def _migrate_movies_enriched_primary_key(conn):
+    """
+    Rebuilds movies_enriched with movieId as its primary key. Tables written by
+    DataFrame.to_sql have no key, so duplicates are collapsed keeping the latest row.
+    """
+    if not _table_exists(conn, 'movies_enriched'):
+        _create_movies_enriched_table(conn)
+        return
+    if _primary_key_columns(conn, 'movies_enriched') == ['movieId']:
+        return
+
+    existing_columns = set(_table_columns(conn, 'movies_enriched'))
+    columns = [c for c in ENRICHED_COLUMNS if c in existing_columns]
+    column_list = ', '.join(columns)
+
+    conn.execute("DROP TABLE IF EXISTS movies_enriched_new")
+    _create_movies_enriched_table(conn, 'movies_enriched_new')
+    conn.execute(f"""
+        INSERT OR REPLACE INTO movies_enriched_new ({column_list})
+        SELECT {column_list} FROM movies_enriched WHERE movieId IS NOT NULL ORDER BY rowid
+    """)
+    conn.execute("DROP TABLE movies_enriched")
+    conn.execute("ALTER TABLE movies_enriched_new RENAME TO movies_enriched")
+
+# movie_rating_stats keeps one row of running aggregates per movie. Ratings are
+# half stars from 0.5 to 5.0, so the histogram has one counter per half star.
+RATING_HISTOGRAM_COLUMNS = [f"hist_{int(step * 5):02d}" for step in range(1, 11)]
+
+def _histogram_values(rating_expr: str) -> List[str]:
+    """SQL expressions that are 1 in the histogram column matching the rating and 0 elsewhere."""
+    return [f"(CAST(ROUND({rating_expr} * 2) AS INTEGER) = {step})" for step in range(1, 11)]
+
+def _movie_rating_stats_add_sql(row: str) -> str:
+    """Upsert that adds one rating (NEW or OLD inside a trigger) to movie_rating_stats."""
+    columns = ['movieId', 'rating_count', 'rating_sum', 'rating_sum_sq'] + RATING_HISTOGRAM_COLUMNS
+    values = [f"{row}.movieId", "1", f"{row}.rating", f"{row}.rating * {row}.rating"] + _histogram_values(f"{row}.rating")
+    updates = ', '.join(f"{c} = {c} + excluded.{c}" for c in columns[1:])
+    return (f"INSERT INTO movie_rating_stats ({', '.join(columns)}) VALUES ({', '.join(values)}) "
+            f"ON CONFLICT(movieId) DO UPDATE SET {updates};")
+
+def _movie_rating_stats_remove_sql(row: str) -> str:
+    """Statements that remove one rating (OLD inside a trigger) from movie_rating_stats."""
+    hist_updates = [f"{c} = {c} - {v}" for c, v in zip(RATING_HISTOGRAM_COLUMNS, _histogram_values(f"{row}.rating"))]
+    updates = ', '.join([
+        "rating_count = rating_count - 1",
+        f"rating_sum = rating_sum - {row}.rating",
+        f"rating_sum_sq = rating_sum_sq - {row}.rating * {row}.rating",
+    ] + hist_updates)
+    return (f"UPDATE movie_rating_stats SET {updates} WHERE movieId = {row}.movieId; "
+            f"DELETE FROM movie_rating_stats WHERE movieId = {row}.movieId AND rating_count <= 0;")
+
+def rebuild_movie_rating_stats(conn):
+    """Recomputes movie_rating_stats from scratch with a single pass over ratings."""
+    histogram = ', '.join(f"SUM({v})" for v in _histogram_values('rating'))
+    conn.execute("DELETE FROM movie_rating_stats")
+    conn.execute(f"""
+        INSERT INTO movie_rating_stats (movieId, rating_count, rating_sum, rating_sum_sq, {', '.join(RATING_HISTOGRAM_COLUMNS)})
+        SELECT movieId, COUNT(*), SUM(rating), SUM(rating * rating), {histogram}
+        FROM ratings
+        GROUP BY movieId
+    """)
+
+def _migrate_movie_rating_stats(conn):
+    """
+    Materialized per-movie rating aggregates (count, sum, mean, variance, histogram),
+    kept current by triggers on ratings and backfilled once here.
+    """
+    if not _table_exists(conn, 'ratings'):
+        return
+    histogram_columns = ',\n'.join(f"            {c} INTEGER NOT NULL DEFAULT 0" for c in RATING_HISTOGRAM_COLUMNS)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS movie_rating_stats (
+            movieId INTEGER PRIMARY KEY,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum REAL NOT NULL DEFAULT 0,
+            rating_sum_sq REAL NOT NULL DEFAULT 0,
+{histogram_columns},
+            rating_mean REAL GENERATED ALWAYS AS (
+                CASE WHEN rating_count > 0 THEN rating_sum / rating_count END
+            ) VIRTUAL,
+            rating_variance REAL GENERATED ALWAYS AS (
+                CASE WHEN rating_count > 0
+                     THEN MAX(rating_sum_sq / rating_count - (rating_sum / rating_count) * (rating_sum / rating_count), 0)
+                END
+            ) VIRTUAL
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_stats_insert AFTER INSERT ON ratings
+        BEGIN {_movie_rating_stats_add_sql('NEW')} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_stats_delete AFTER DELETE ON ratings
+        BEGIN {_movie_rating_stats_remove_sql('OLD')} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_stats_update AFTER UPDATE OF movieId, rating ON ratings
+        BEGIN {_movie_rating_stats_remove_sql('OLD')} {_movie_rating_stats_add_sql('NEW')} END
+    """)
+    rebuild_movie_rating_stats(conn)
+
+def _migrate_retrieval_indexes(conn):
+    """Indexes backing the structured candidate filters used by the recommender."""
+    if _table_exists(conn, 'movies_enriched'):
+        for column in ['sentiment', 'budget_tier', 'revenue_tier', 'production_effectiveness', 'age_category']:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_movies_enriched_{column} ON movies_enriched ({column})")
+    if _table_exists(conn, 'movies'):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_movies_release_year ON movies ({RELEASE_YEAR_SQL.format(alias='')})")
+
+def _migrate_drop_error_rows(conn):
+    """Old runs saved placeholder 'error' rows for failed batches; remove them so those movies are retried."""
+    if _table_exists(conn, 'movies_enriched'):
+        conn.execute("DELETE FROM movies_enriched WHERE sentiment = 'error' OR age_category = 'error'")
+
+def _migrate_enrichment_jobs(conn):
+    """Durable queue of enrichment batches shared by enrich-worker processes (see job_queue.py)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS enrichment_jobs (
+            jobId INTEGER PRIMARY KEY AUTOINCREMENT,
+            runId TEXT NOT NULL,
+            movie_ids TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending'
+                CHECK (status IN ('pending', 'leased', 'done', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            heartbeat_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_enrichment_jobs_status ON enrichment_jobs (status, lease_expires_at)")
+
+def _migrate_rule_attribute_columns(conn):
+    """Columns for the attributes computed locally by attributes.py instead of by the LLM."""
+    if not _table_exists(conn, 'movies_enriched'):
+        return
+    existing_columns = set(_table_columns(conn, 'movies_enriched'))
+    for column in ['genre_diversity', 'release_era']:
+        if column not in existing_columns:
+            conn.execute(f"ALTER TABLE movies_enriched ADD COLUMN {column} TEXT")
+
+def _migrate_rule_thresholds(conn):
+    """Tier cut points fitted on the whole catalog by attributes.py, so enriching a few movies need not refit them."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rule_thresholds (
+            metric TEXT PRIMARY KEY,
+            low REAL NOT NULL,
+            high REAL NOT NULL,
+            fitted_at REAL NOT NULL
+        )
+    """)
+
+# Release year as an integer. Queries must use this exact expression for the index to apply.
+RELEASE_YEAR_SQL = "CAST(substr({alias}releaseDate, 1, 4) AS INTEGER)"
+
+# Ordered migrations per database: (version, description, function).
+SCHEMA_MIGRATIONS: Dict[str, List[Tuple[int, str, Callable]]] = {
+    'ratings': [
+        (1, "index ratings on (movieId, rating) and (userId, movieId)", _migrate_ratings_indexes),
+        (2, "movie_rating_stats table maintained by triggers", _migrate_movie_rating_stats),
+        (3, "user_profiles table", _migrate_user_profiles),
+        (4, "user_profiles.source_catalog staleness checksum", _migrate_user_profiles_catalog_checksum),
+    ],
+    'movies': [
+        (1, "index movies.movieId", _migrate_movies_index),
+        (2, "primary key on movies_enriched.movieId", _migrate_movies_enriched_primary_key),
+        (3, "indexes for structured recommendation filters", _migrate_retrieval_indexes),
+        (4, "remove placeholder 'error' rows from movies_enriched", _migrate_drop_error_rows),
+        (5, "enrichment_jobs queue table", _migrate_enrichment_jobs),
+        (6, "genre_diversity and release_era columns on movies_enriched", _migrate_rule_attribute_columns),
+        (7, "rule_thresholds table", _migrate_rule_thresholds),
+    ],
+}
+
+def _schema_db_paths() -> Dict[str, str]:
+    return {'ratings': RATINGS_DB_PATH, 'movies': MOVIES_DB_PATH}
+
+def ensure_schema(verbose: bool = True):
+    """
+    Brings every database up to the latest schema version. Cheap when nothing
+    is pending (one PRAGMA read per database), so it is safe to call on startup.
+    """
+    for name, db_path in _schema_db_paths().items():
+        if not os.path.exists(db_path):
+            if verbose:
+                print(f"Skipping schema check for missing database: {db_path}")
+            continue
+
+        current_version = get_read_connection(db_path).execute("PRAGMA user_version").fetchone()[0]
+        for version, description, migrate in SCHEMA_MIGRATIONS[name]:
+            if version <= current_version:
+                continue
+            if verbose:
+                print(f"Applying {name} schema migration {version}: {description}")
+            with write_connection(db_path) as conn:
+                # sqlite3 opens no implicit transaction for DDL, so table rebuilds (CREATE,
+                # INSERT ... SELECT, DROP, RENAME) and the version bump are made atomic here
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Another process may have applied it while this one waited for the lock
+                    if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                        migrate(conn)
+                        conn.execute(f"PRAGMA user_version = {int(version)}")
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+
+# Movie IDs bound per "movieId IN (...)" query, below SQLite's bound-parameter limit
+IN_QUERY_CHUNK = 900
+
+def _chunked_in_queries(query_template: str, movie_ids: List[int]) -> Iterator[Tuple[str, Tuple[int, ...]]]:
+    """
+    Yields (query, params) per chunk of movie_ids, with the chunk's placeholders
+    substituted for {} in query_template, e.g. "SELECT * FROM movies WHERE movieId IN ({})".
+    """
+    for i in range(0, len(movie_ids), IN_QUERY_CHUNK):
+        chunk = tuple(int(m) for m in movie_ids[i:i + IN_QUERY_CHUNK])
+        yield query_template.format(','.join('?' * len(chunk))), chunk
+
+@traced('db.get_movie_by_id', rows=len)
 def get_movie_by_id(movie_id: int):
     """Fetches a single movie by its ID."""
-    conn = get_db_connection(MOVIES_DB_PATH)
+    import pandas as pd
     query = "SELECT * FROM movies WHERE movieId = ?"
-    df = pd.read_sql_query(query, conn, params=(movie_id,))
-    conn.close()
-    return df
+    return pd.read_sql_query(query, get_read_connection(MOVIES_DB_PATH), params=(movie_id,))
+
+@traced('db.get_movies_by_ids', rows=len)
+def get_movies_by_ids(movie_ids: List[int]) -> 'pd.DataFrame':
+    """Fetches full movie rows for a list of movie IDs."""
+    import pandas as pd
+    if not movie_ids:
+        return pd.DataFrame()
+    conn = get_read_connection(MOVIES_DB_PATH)
+    frames = [pd.read_sql_query(query, conn, params=params)
+              for query, params in _chunked_in_queries("SELECT * FROM movies WHERE movieId IN ({})", movie_ids)]
+    return pd.concat(frames, ignore_index=True)
+
+@traced('db.get_movie_titles', rows=len)
+def get_movie_titles(movie_ids: List[int]) -> Dict[int, str]:
+    """Returns {movieId: title} for the given movies, without loading pandas."""
+    conn = get_read_connection(MOVIES_DB_PATH)
+    titles = {}
+    for query, params in _chunked_in_queries("SELECT movieId, title FROM movies WHERE movieId IN ({})", movie_ids):
+        titles.update((row[0], row[1]) for row in conn.execute(query, params))
+    return titles
 
+@traced('db.get_movie_sample', rows=len)
 def get_movie_sample(sample_size=50):
     """Fetches a random sample of movies from the movies database."""
-    conn = get_db_connection(MOVIES_DB_PATH)
+    import pandas as pd
     query = "SELECT * FROM movies ORDER BY RANDOM() LIMIT ?"
-    df = pd.read_sql_query(query, conn, params=(sample_size,))
-    conn.close()
-    return df
+    return pd.read_sql_query(query, get_read_connection(MOVIES_DB_PATH), params=(sample_size,))
 
+@traced('db.get_all_movies', rows=len)
 def get_all_movies():
     """Fetches all movies from the movies database."""
-    conn = get_db_connection(MOVIES_DB_PATH)
-    query = "SELECT * FROM movies"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    import pandas as pd
+    return pd.read_sql_query("SELECT * FROM movies", get_read_connection(MOVIES_DB_PATH))
+
+def iter_movie_chunks(chunk_size: int = 500) -> Iterator[List[Dict]]:
+    """Streams the movies table in movieId order as lists of up to chunk_size row dicts."""
+    cursor = get_read_connection(MOVIES_DB_PATH).execute("SELECT * FROM movies ORDER BY movieId")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [dict(row) for row in rows]
+
+# Which movies iter_pending_enrichment() considers: the whole catalog, or only movies with ratings
+PENDING_SCOPES = ('all', 'rated')
+
+def _pending_enrichment_filters(scope: str, exclude_queued: bool) -> List[str]:
+    if scope not in PENDING_SCOPES:
+        raise ValueError(f"Unknown scope '{scope}'. Expected one of {PENDING_SCOPES}")
+    # A row holding only the rule attributes (see attributes.py) still needs the LLM ones
+    filters = ["NOT EXISTS (SELECT 1 FROM movies_enriched AS me WHERE me.movieId = m.movieId AND me.sentiment IS NOT NULL)"]
+    if scope == 'rated':
+        filters.append(
+            "EXISTS (SELECT 1 FROM ratings_db.movie_rating_stats AS s WHERE s.movieId = m.movieId AND s.rating_count > 0)"
+        )
+    if exclude_queued:
+        # Movies already in a pending or leased job of the enrichment job queue
+        filters.append("""m.movieId NOT IN (
+            SELECT CAST(j.value AS INTEGER)
+            FROM enrichment_jobs AS ej, json_each(ej.movie_ids) AS j
+            WHERE ej.status IN ('pending', 'leased')
+        )""")
+    return filters
 
+def iter_pending_enrichment(
+    scope: str = 'all',
+    chunk_size: int = 500,
+    limit: int = None,
+    exclude_queued: bool = False
+) -> Iterator[List[Dict]]:
+    """
+    Streams the movies that still need enrichment, in movieId order, as lists of
+    up to chunk_size row dicts. The work set is an anti-join against
+    movies_enriched (and, for scope='rated', a semi-join against the attached
+    ratings database), so nothing is loaded into Python to diff. Each chunk is
+    its own keyset query on the primary key, so no read transaction is held
+    open between chunks while results are being written.
+    """
+    where_sql = ' AND '.join(_pending_enrichment_filters(scope, exclude_queued) + ["m.movieId > ?"])
+    query = f"SELECT m.* FROM movies AS m WHERE {where_sql} ORDER BY m.movieId LIMIT ?"
+    conn = get_catalog_connection()
+    last_id, remaining = -1, limit
+    while remaining is None or remaining > 0:
+        n = chunk_size if remaining is None else min(chunk_size, remaining)
+        with span('db.iter_pending_enrichment') as s:
+            rows = conn.execute(query, (last_id, n)).fetchall()
+            s.set(rows=len(rows))
+        if not rows:
+            break
+        yield [dict(row) for row in rows]
+        last_id = rows[-1]['movieId']
+        if remaining is not None:
+            remaining -= len(rows)
+
+@traced('db.count_pending_enrichment')
+def count_pending_enrichment(scope: str = 'all', exclude_queued: bool = False) -> int:
+    """Number of movies iter_pending_enrichment() would return."""
+    where_sql = ' AND '.join(_pending_enrichment_filters(scope, exclude_queued))
+    return get_catalog_connection().execute(f"SELECT COUNT(*) FROM movies AS m WHERE {where_sql}").fetchone()[0]
+
+@traced('db.count_enriched_movies')
+def count_enriched_movies() -> int:
+    """Number of movies that already have their LLM attributes in movies_enriched."""
+    conn = get_read_connection(MOVIES_DB_PATH)
+    if not _table_exists(conn, 'movies_enriched'):
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM movies_enriched WHERE sentiment IS NOT NULL").fetchone()[0]
+
+@traced('db.get_existing_enriched_movie_ids', rows=len)
 def get_existing_enriched_movie_ids() -> List[int]:
     """
     Fetches the IDs of all movies that are already present in the
     movies_enriched table to avoid reprocessing them.
     """
-    conn = get_db_connection(MOVIES_DB_PATH)
+    conn = get_read_connection(MOVIES_DB_PATH)
     try:
-        # Check if the table exists first
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='movies_enriched';")
-        if cursor.fetchone() is None:
-            conn.close()
-            return [] # Return empty list if table doesn't exist
-
-        # If table exists, fetch the movieIds
-        df = pd.read_sql_query("SELECT movieId FROM movies_enriched", conn)
-        conn.close()
-        return df['movieId'].tolist()
+        # Return an empty list if the table doesn't exist yet
+        if not _table_exists(conn, 'movies_enriched'):
+            return []
+        return [row[0] for row in conn.execute("SELECT movieId FROM movies_enriched WHERE sentiment IS NOT NULL")]
     except Exception as e:
         print(f"Error fetching existing enriched IDs: {e}")
-        conn.close()
         return []
 
+@traced('db.get_enriched_movie_ids_among', rows=len)
+def get_enriched_movie_ids_among(movie_ids: List[int]) -> Set[int]:
+    """Returns the subset of movie_ids that already have their LLM attributes in movies_enriched."""
+    conn = get_read_connection(MOVIES_DB_PATH)
+    found = set()
+    query_template = "SELECT movieId FROM movies_enriched WHERE sentiment IS NOT NULL AND movieId IN ({})"
+    for query, params in _chunked_in_queries(query_template, movie_ids):
+        found.update(row[0] for row in conn.execute(query, params))
+    return found
+
+@traced('db.upsert_enriched_rows', rows=int)
+def upsert_enriched_rows(rows: List[Dict], table_name: str = 'movies_enriched', columns: List[str] = None) -> int:
+    """
+    Inserts or updates enriched rows keyed on movieId in a single transaction.
+    Only `columns` (default: every movies_enriched column) are written, so a
+    partial update leaves the other columns of existing rows alone; missing
+    values are stored as NULL.
+    """
+    if not rows:
+        return 0
+    columns = columns or ENRICHED_COLUMNS
+    column_list = ', '.join(columns)
+    placeholders = ','.join(['?'] * len(columns))
+    updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != 'movieId')
+    values = [tuple(row.get(c) for c in columns) for row in rows]
+    with write_connection(MOVIES_DB_PATH) as conn:
+        _create_movies_enriched_table(conn, table_name)
+        conn.executemany(
+            f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders}) "
+            f"ON CONFLICT(movieId) DO UPDATE SET {updates}",
+            values
+        )
+    return len(values)
+
+def get_rule_thresholds() -> Dict[str, Tuple[float, float]]:
+    """The saved {metric: (low/medium, medium/high)} tier cut points (empty if none were saved)."""
+    conn = get_read_connection(MOVIES_DB_PATH)
+    if not _table_exists(conn, 'rule_thresholds'):
+        return {}
+    return {row['metric']: (row['low'], row['high']) for row in conn.execute("SELECT metric, low, high FROM rule_thresholds")}
+
+def save_rule_thresholds(thresholds: Dict[str, Tuple[float, float]]):
+    """Replaces the saved tier cut points."""
+    now = time.time()
+    with write_connection(MOVIES_DB_PATH) as conn:
+        _migrate_rule_thresholds(conn)
+        conn.execute("DELETE FROM rule_thresholds")
+        conn.executemany(
+            "INSERT INTO rule_thresholds (metric, low, high, fitted_at) VALUES (?, ?, ?, ?)",
+            [(metric, float(low), float(high), now) for metric, (low, high) in thresholds.items()]
+        )
+
 def save_enriched_data(df, table_name='movies_enriched'):
     """
-    Saves the enriched movie data to a new table using 'append' mode.
-    This adds new data without destroying existing data.
+    Saves the enriched movie data, updating any existing row for the same movieId.
+    """
+    if df.empty:
+        return
+    rows = df.reindex(columns=ENRICHED_COLUMNS)
+    rows = rows.astype(object).where(rows.notna(), None)
+    upsert_enriched_rows(rows.to_dict('records'), table_name)
+    print(f"Saved {len(df)} enriched records to table: {table_name} in {MOVIES_DB_PATH}")
+
+class EnrichedDataWriter:
+    """
+    The single writer for movies_enriched during an enrichment run. Any number of
+    worker threads hand rows to write(); one background thread drains the queue
+    and upserts them in groups of up to flush_size (or whatever has arrived
+    after flush_interval seconds), one transaction per flush, so workers never
+    contend for the database write lock.
+
+    Use it as a context manager; leaving the block flushes the remaining rows
+    and re-raises any error the writer thread hit.
+    """
+
+    _CLOSE = object()
+
+    def __init__(
+        self,
+        flush_size: int = 500,
+        flush_interval: float = 2.0,
+        max_pending: int = 64,
+        on_flush: Callable[[int], None] = None,
+        table_name: str = 'movies_enriched',
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.table_name = table_name
+        self.written = 0
+        self.error: BaseException = None
+        # Bounded, so fast producers block instead of buffering a whole run in memory
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='enriched-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, rows: List[Dict]):
+        """Queues rows for writing. Raises if the writer thread has failed."""
+        if self.error is not None:
+            raise self.error
+        if rows:
+            self._queue.put(list(rows))
+
+    def _flush(self, pending: List[Dict]):
+        self.written += upsert_enriched_rows(pending, self.table_name)
+        if self.on_flush:
+            self.on_flush(self.written)
+
+    def _run(self):
+        pending: List[Dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is self._CLOSE:
+                break
+            if item and self.error is None:
+                pending.extend(item)
+            if pending and (len(pending) >= self.flush_size or time.monotonic() >= deadline):
+                try:
+                    self._flush(pending)
+                except BaseException as e:
+                    # Keep draining so producers blocked on put() are released
+                    self.error = e
+                pending = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+        if pending and self.error is None:
+            try:
+                self._flush(pending)
+            except BaseException as e:
+                self.error = e
+
+    def close(self):
+        """Flushes everything queued so far, stops the writer thread and re-raises its error."""
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except BaseException:
+            # Don't mask the error that ended the with-block
+            if exc_type is None:
+                raise
+
+@traced('db.get_user_ratings_with_details', rows=len)
+def get_user_ratings_with_details(user_id: int) -> 'pd.DataFrame':
+    """
+    Fetches a user's ratings joined to the rated movies' details, enrichment
+    attributes and community average rating in one query across both databases.
+    has_details is 0 for ratings whose movie is missing from the movies table.
     """
-    conn = get_db_connection(MOVIES_DB_PATH)
-    df.to_sql(table_name, conn, if_exists='append', index=False)
-    conn.close()
-    print(f"Appended {len(df)} new records to table: {table_name} in {MOVIES_DB_PATH}")
+    import pandas as pd
+    query = """
+        SELECT
+            r.userId,
+            r.movieId,
+            r.rating,
+            r.timestamp,
+            m.movieId IS NOT NULL AS has_details,
+            m.title,
+            m.overview,
+            m.genres,
+            m.releaseDate,
+            m.budget,
+            m.revenue,
+            m.runtime,
+            me.sentiment,
+            me.budget_tier,
+            me.revenue_tier,
+            me.production_effectiveness,
+            me.age_category,
+            COALESCE(s.rating_mean, 0) AS community_avg_rating
+        FROM ratings_db.ratings AS r
+        LEFT JOIN movies AS m ON m.movieId = r.movieId
+        LEFT JOIN movies_enriched AS me ON me.movieId = r.movieId
+        LEFT JOIN ratings_db.movie_rating_stats AS s ON s.movieId = r.movieId
+        WHERE r.userId = ?
+    """
+    return pd.read_sql_query(query, get_catalog_connection(), params=(int(user_id),))
+
+@traced('db.get_movie_rating_stats', rows=len)
+def get_movie_rating_stats(movie_ids: List[int]) -> 'pd.DataFrame':
+    """
+    Fetches the materialized rating statistics (count, mean, variance and
+    histogram) for a list of movie IDs from movie_rating_stats. The columns
+    are always numeric, even when none of the movies has ratings, so callers
+    can merge and compute on them directly.
+    """
+    import pandas as pd
+    columns = ['movieId', 'rating_count', 'rating_mean', 'rating_variance'] + RATING_HISTOGRAM_COLUMNS
+    frames = [pd.DataFrame(columns=columns)]
+    conn = get_read_connection(RATINGS_DB_PATH)
+    query_template = f"SELECT {', '.join(columns)} FROM movie_rating_stats WHERE movieId IN ({{}})"
+    for query, params in _chunked_in_queries(query_template, movie_ids):
+        frames.append(pd.read_sql_query(query, conn, params=params))
+    stats = pd.concat(frames, ignore_index=True)
+    return stats.astype({'movieId': 'int64', **{c: 'float64' for c in columns[1:]}})
+
+@traced('db.get_enriched_attributes', rows=len)
+def get_enriched_attributes(movie_ids: List[int]) -> 'pd.DataFrame':
+    """Fetches the movies_enriched rows for a list of movie IDs (movies not enriched yet are omitted)."""
+    import pandas as pd
+    if not movie_ids:
+        return pd.DataFrame(columns=ENRICHED_COLUMNS)
+    conn = get_read_connection(MOVIES_DB_PATH)
+    query_template = f"SELECT {', '.join(ENRICHED_COLUMNS)} FROM movies_enriched WHERE movieId IN ({{}})"
+    frames = [pd.read_sql_query(query, conn, params=params) for query, params in _chunked_in_queries(query_template, movie_ids)]
+    return pd.concat(frames, ignore_index=True)
+
+@traced('db.get_movie_avg_ratings', rows=len)
+def get_movie_avg_ratings(movie_ids: List[int]) -> Dict[int, float]:
+    """Returns {movieId: average rating} for the given movies. Movies without ratings are omitted."""
+    conn = get_read_connection(RATINGS_DB_PATH)
+    avg_ratings = {}
+    for query, params in _chunked_in_queries("SELECT movieId, rating_mean FROM movie_rating_stats WHERE movieId IN ({})", movie_ids):
+        avg_ratings.update((row[0], row[1]) for row in conn.execute(query, params))
+    return avg_ratings
 
 def get_movie_avg_rating(movie_id: int) -> float:
     """Fetches the average rating for a given movie from the ratings database."""
-    conn = get_db_connection(RATINGS_DB_PATH)
-    query = "SELECT AVG(rating) as avg_rating FROM ratings WHERE movieId = ?"
-    cursor = conn.cursor()
-    result = cursor.execute(query, (movie_id,)).fetchone()
-    conn.close()
-    if result and result['avg_rating'] is not None:
-        return result['avg_rating']
-    return 0.0
+    return get_movie_avg_ratings([movie_id]).get(int(movie_id), 0.0)
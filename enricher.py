@@ -1,83 +1,170 @@
 import json
+import time
 import pandas as pd
-from typing import Dict, List, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 from llm_client import LLMClient
 from prompts import Prompts
+from batch_planner import TokenBatchPlanner
+from attributes import RuleAttributeEngine, RULE_COLUMNS
 import database as db
+from tracing import span, traced
+
+# Allowed values of each LLM-generated attribute. The rest (RULE_COLUMNS) are computed locally.
+ENRICHED_ATTRIBUTE_VALUES = {
+    'sentiment': {'positive', 'neutral', 'negative'},
+    'age_category': {'kid', 'teen', 'adult'},
+}
 
 class MovieEnricher:
-    def __init__(self, llm_client: LLMClient):
+    def __init__(self, llm_client: LLMClient, max_retries: int = 2, rule_engine: Optional[RuleAttributeEngine] = None):
         self.llm = llm_client
+        # How many times a group of movies may fail outright before it is given up on
+        self.max_retries = max_retries
+        # Tier cut points are loaded from the database on first use (fitted on the whole catalog only if none are saved)
+        self.rule_engine = rule_engine or RuleAttributeEngine()
+
+    def _request_batch(self, movies: List[Dict], retry: bool = False, prompt: Optional[str] = None) -> Dict[int, Dict]:
+        """
+        Sends one enrichment request and returns the valid results keyed by movieId.
+        Results for unknown ids, duplicates and invalid attribute values are dropped.
+        """
+        prompt = prompt or Prompts.build_batch_enrichment_prompt(movies)
+        system_msg = Prompts.get_batch_enrichment_system_message()
+        # A retry must not be answered from the response cache with the same bad output
+        response = self.llm.generate(prompt, system_msg, json_mode=True, cache_mode="refresh" if retry else None)
+        with span('enrich.parse', rows=len(movies)) as s:
+            items = json.loads(response).get("enriched_movies", [])
+
+            expected_ids = {m['movieId'] for m in movies}
+            valid = {}
+            for item in items if isinstance(items, list) else []:
+                result = self._validate_result(item)
+                if result and result['movieId'] in expected_ids and result['movieId'] not in valid:
+                    valid[result['movieId']] = result
+            s.set(valid=len(valid))
+        return valid
+
+    @staticmethod
+    def _validate_result(item) -> Optional[Dict]:
+        """Normalizes one LLM result, or returns None if its id or any attribute is missing or invalid."""
+        if not isinstance(item, dict):
+            return None
+        try:
+            result = {'movieId': int(item.get('movieId'))}
+        except (TypeError, ValueError):
+            return None
+        for attribute, allowed in ENRICHED_ATTRIBUTE_VALUES.items():
+            value = str(item.get(attribute, '')).strip().lower()
+            if value not in allowed:
+                return None
+            result[attribute] = value
+        return result
+
+    def _enrich_with_retries(self, movies: List[Dict], failures: int = 0, retry: bool = False, prompt: Optional[str] = None):
+        """
+        Enriches movies, re-requesting only the ones that came back missing or
+        invalid. A call that makes no progress counts as a failure; the group is
+        then bisected so one bad movie cannot keep sinking its neighbours.
+        Returns (results, movies given up on).
+        """
+        try:
+            valid = self._request_batch(movies, retry=retry, prompt=prompt)
+        except Exception as e:
+            print(f"Error processing batch of {len(movies)} movie(s): {e}")
+            valid = {}
+
+        results = [valid[m['movieId']] for m in movies if m['movieId'] in valid]
+        missing = [m for m in movies if m['movieId'] not in valid]
+        if not missing:
+            return results, []
+
+        if results:
+            # Partial success: retry just the missing movies as one smaller request
+            groups = [missing]
+        else:
+            failures += 1
+            if failures > self.max_retries:
+                return results, missing
+            groups = [missing] if len(missing) == 1 else [missing[:len(missing) // 2], missing[len(missing) // 2:]]
+
+        print(f"Retrying {len(missing)} missing or invalid movie(s) in {len(groups)} request(s)...")
+        gave_up = []
+        for group in groups:
+            group_results, group_gave_up = self._enrich_with_retries(group, failures, retry=True)
+            results.extend(group_results)
+            gave_up.extend(group_gave_up)
+        return results, gave_up
 
-    def _get_avg_ratings_for_batch(self, movie_ids: List[int]) -> Dict[int, float]:
-        """Fetches average ratings for a batch of movie IDs in a single query."""
-        conn = db.get_db_connection(db.RATINGS_DB_PATH)
-        query = f"""
-            SELECT movieId, AVG(rating) as avg_rating
-            FROM ratings
-            WHERE movieId IN ({','.join(['?']*len(movie_ids))})
-            GROUP BY movieId;
+    @traced('enrich.prepare_batch', prompt_chars=len)
+    def prepare_batch(self, movies_batch: List[Dict]) -> str:
+        """
+        Adds the locally computed rule attributes to each movie in the batch and
+        returns the prompt for the attributes only the LLM can judge.
         """
-        df = pd.read_sql_query(query, conn, params=tuple(movie_ids))
-        conn.close()
-        # Create a dictionary for quick lookups: {movieId: avg_rating}
-        return pd.Series(df.avg_rating.values, index=df.movieId).to_dict()
+        rule_attributes = self.rule_engine.compute_for_movies(movies_batch)
+        for movie in movies_batch:
+            movie.update(rule_attributes[movie['movieId']])
+        return Prompts.build_batch_enrichment_prompt(movies_batch)
 
-    def enrich_batch(self, movies_batch: List[Dict]) -> List[Dict]:
+    def enrich_batch(self, movies_batch: List[Dict], prompt: Optional[str] = None) -> List[Dict]:
         """
         Enriches a single batch of movie dictionaries using the LLM.
-        Returns a list of enriched movie dictionaries.
+        Returns only valid enriched movie dictionaries, matched to the input by
+        movieId. Movies that still fail after retries are left out (and so are
+        picked up again by the next run) rather than saved as error rows.
+        `prompt` is the batch's prompt from prepare_batch(), if already built.
         """
         if not movies_batch:
             return []
 
         batch_movie_ids = [m['movieId'] for m in movies_batch]
-        
-        # Get average ratings for the current batch
-        avg_ratings = self._get_avg_ratings_for_batch(batch_movie_ids)
-        
-        # Add the average rating to each movie dictionary in the batch
-        for movie in movies_batch:
-            movie['avg_rating'] = avg_ratings.get(movie['movieId'], 0.0)
+        with span('enrich.batch', rows=len(movies_batch)) as s:
+            if prompt is None:
+                prompt = self.prepare_batch(movies_batch)
+            results, gave_up = self._enrich_with_retries(movies_batch, prompt=prompt)
+            s.set(enriched=len(results), gave_up=len(gave_up))
+        if gave_up:
+            print(f"Could not enrich {len(gave_up)} movie(s) after retries: {[m['movieId'] for m in gave_up]}")
 
-        # Build the batch prompt
-        prompt = Prompts.build_batch_enrichment_prompt(movies_batch)
-        system_msg = Prompts.get_batch_enrichment_system_message()
-        
-        try:
-            # Make a single API call for the entire batch
-            response = self.llm.generate(prompt, system_msg, json_mode=True)
-            batch_enriched_data = json.loads(response).get("enriched_movies", [])
-            
-            # The LLM should return one enriched object for each movie, in order.
-            # We'll add the original movieId back to each enriched object.
-            for original_movie, enriched_result in zip(movies_batch, batch_enriched_data):
-                enriched_result['movieId'] = original_movie['movieId']
-            
-            return batch_enriched_data
-            
-        except Exception as e:
-            print(f"Error processing batch: {e}")
-            # Return default error data for each movie in the batch
-            error_data = []
-            for movie in movies_batch:
-                error_data.append({
-                    "movieId": movie['movieId'], 
-                    "sentiment": "error", 
-                    "budget_tier": "error", 
-                    "revenue_tier": "error", 
-                    "production_effectiveness": "error", 
-                    "age_category": "error"
-                })
-            return error_data
-
-    def enrich_movies(self, movies_df: pd.DataFrame, batch_size: int = 10) -> pd.DataFrame:
+        # Keep the input order, and add the rule attributes prepare_batch() computed
+        movies_by_id = {m['movieId']: m for m in movies_batch}
+        position = {movie_id: i for i, movie_id in enumerate(batch_movie_ids)}
+        return [
+            {**{c: movies_by_id[r['movieId']].get(c) for c in RULE_COLUMNS}, **r}
+            for r in sorted(results, key=lambda r: position[r['movieId']])
+        ]
+
+    def _timed_enrich_batch(self, batch: List[Dict]):
+        """Runs enrich_batch and returns (enriched rows, seconds taken)."""
+        start = time.perf_counter()
+        enriched_batch = self.enrich_batch(batch)
+        return enriched_batch, time.perf_counter() - start
+
+    def enrich_movies(
+        self,
+        movies_df: pd.DataFrame,
+        batch_size: int = 25,
+        concurrency: int = 1,
+        on_batch: Optional[Callable[[List[Dict]], None]] = None,
+        planner: Optional[TokenBatchPlanner] = None
+    ) -> pd.DataFrame:
         """
         Enrich a DataFrame of movies by processing them in batches.
+
+        Batches are packed by estimated tokens (see TokenBatchPlanner), so short
+        overviews share a call and long ones are split before they risk truncated
+        output. Up to `concurrency` batches are sent to the LLM at the same time.
+        Results are always consumed in submission order, so `on_batch` (e.g. a save
+        to the database) sees the batches in the same order as the sequential version.
         
         Args:
             movies_df: DataFrame containing movie data to enrich
-            batch_size: Number of movies to process in each batch
+            batch_size: Maximum number of movies in each batch
+            concurrency: Maximum number of LLM batches in flight at once
+            on_batch: Optional callback invoked with each enriched batch, in order
+            planner: Optional batch planner; defaults to one capped at batch_size
             
         Returns:
             DataFrame with enriched movie data
@@ -87,15 +174,42 @@ class MovieEnricher:
         
         # Convert DataFrame to list of dictionaries
         movies_list = movies_df.to_dict('records')
+        planner = planner or TokenBatchPlanner(max_batch_size=batch_size)
+        concurrency = max(1, concurrency)
         
         all_enriched = []
-        
-        # Process in batches
-        for i in range(0, len(movies_list), batch_size):
-            batch = movies_list[i:i + batch_size]
-            print(f"Processing batch {i//batch_size + 1} ({len(batch)} movies)...")
-            enriched_batch = self.enrich_batch(batch)
+        processed = 0
+        start = time.perf_counter()
+
+        def finish_batch(batch_num, batch, future):
+            nonlocal processed
+            enriched_batch, latency = future.result()
+            ok = len(enriched_batch) == len(batch)
+            planner.record(len(batch), latency, ok)
+            if on_batch and enriched_batch:
+                on_batch(enriched_batch)
             all_enriched.extend(enriched_batch)
+            processed += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"Finished batch {batch_num} ({processed}/{len(movies_list)} movies, "
+                  f"{latency:.1f}s, {processed / elapsed:.2f} movies/sec)")
+
+        print(f"Processing {len(movies_list)} movies in token-packed batches of up to {batch_size} with {concurrency} in flight...")
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Keep a bounded window of in-flight batches and drain it oldest first.
+            # Batches are planned lazily so feedback from finished batches shapes the next ones.
+            in_flight = deque()
+            for batch_num, batch in enumerate(planner.batches(movies_list), 1):
+                print(f"Processing batch {batch_num} ({len(batch)} movies)...")
+                in_flight.append((batch_num, batch, executor.submit(self._timed_enrich_batch, batch)))
+                if len(in_flight) >= concurrency:
+                    finish_batch(*in_flight.popleft())
+            while in_flight:
+                finish_batch(*in_flight.popleft())
+
+        elapsed = time.perf_counter() - start
+        print(f"Enriched {len(all_enriched)} movie(s) in {elapsed:.1f}s "
+              f"({len(movies_list) / elapsed if elapsed else 0.0:.2f} movies/sec)")
         
         # Convert back to DataFrame
         enriched_df = pd.DataFrame(all_enriched)
@@ -106,21 +220,30 @@ class MovieEnricher:
         movie_id: Optional[int] = None,
         size: Optional[int] = None,
         process_all: bool = False,
-        batch_size: int = 10,
-        skip_existing: bool = True
+        batch_size: int = 25,
+        skip_existing: bool = True,
+        concurrency: int = 1,
+        max_tokens: int = 4000,
+        scope: str = 'all'
     ) -> pd.DataFrame:
 
         # Validate arguments
         if sum([movie_id is not None, size is not None, process_all]) != 1:
             raise ValueError("Exactly one of movie_id, size, or process_all must be specified")
         
+        planner = TokenBatchPlanner(max_input_tokens=max_tokens, max_batch_size=batch_size)
+
+        # The full catalog is streamed through the pipeline instead of loaded at once.
+        # Rows are saved as they are enriched, so nothing is returned.
+        if process_all:
+            from pipeline import EnrichmentPipeline
+            EnrichmentPipeline(self, planner=planner, concurrency=concurrency, skip_existing=skip_existing, scope=scope).run()
+            return pd.DataFrame()
+
         # 1. Get the list of movies to potentially process
         if movie_id is not None:
             print(f"Fetching specific movie with ID: {movie_id}...")
             movies_df = db.get_movie_by_id(movie_id)
-        elif process_all:
-            print("Fetching all movies from the database...")
-            movies_df = db.get_all_movies()
         else:
             # Default to size if not specified
             size = size or 50
@@ -134,7 +257,7 @@ class MovieEnricher:
         # 2. Filter out already enriched movies if requested
         if skip_existing:
             print("Checking for already enriched movies to avoid re-processing...")
-            existing_ids = db.get_existing_enriched_movie_ids()
+            existing_ids = db.get_enriched_movie_ids_among(movies_df['movieId'].tolist())
             
             original_count = len(movies_df)
             movies_to_process_df = movies_df[~movies_df['movieId'].isin(existing_ids)]
@@ -148,14 +271,19 @@ class MovieEnricher:
             
             movies_df = movies_to_process_df
 
-        # 3. Enrich the movies
+        # 3. Enrich the movies, handing each batch to the writer as soon as it is ready
         print(f"Enriching {len(movies_df)} movie(s)...")
-        enriched_df = self.enrich_movies(movies_df, batch_size=batch_size)
+        with db.EnrichedDataWriter(on_flush=lambda n: print(f"Saved {n} enriched record(s) to movies_enriched")) as writer:
+            enriched_df = self.enrich_movies(
+                movies_df,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                on_batch=writer.write,
+                planner=planner
+            )
         
-        # 4. Save to database if we have results
+        # 4. Report what was saved
         if not enriched_df.empty:
-            print("Saving new enriched data to the database...")
-            db.save_enriched_data(enriched_df)
             print(f"Data enrichment complete. Enriched {len(enriched_df)} movie(s).")
         else:
             print("Enrichment process did not return any data to save.")
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+import database as db
+from batch_planner import TokenBatchPlanner
+
+# Job states: pending -> leased -> done, or back to pending on failure until
+# max_attempts is reached, then failed. A leased job whose lease expires (the
+# worker died or stopped heartbeating) can be claimed again by any worker.
+JOB_STATUSES = ('pending', 'leased', 'done', 'failed')
+
+@dataclass
+class EnrichmentJob:
+    job_id: int
+    run_id: str
+    movie_ids: List[int]
+    attempts: int
+
+def default_worker_id() -> str:
+    """host:pid:random, unique across the processes sharing the queue."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class EnrichmentJobQueue:
+    """
+    A durable queue of enrichment batches in the enrichment_jobs table (created
+    by schema migration), shared by every worker process pointed at the same
+    database file. Claims are single atomic UPDATE statements, so workers never
+    receive the same job while its lease is live. The database is in WAL mode
+    (see db.ConnectionManager), so all workers must run on the host that has the
+    file on a local disk; WAL does not work across hosts or network filesystems.
+    """
+
+    def __init__(self, db_path: str = None, lease_seconds: float = 300, max_attempts: int = 3):
+        self.db_path = db_path or db.MOVIES_DB_PATH
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, batches: Iterable[List[int]], run_id: Optional[str] = None) -> int:
+        """Adds one pending job per batch of movie IDs. Returns the number of jobs created."""
+        run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        now = time.time()
+        rows = [(run_id, json.dumps([int(m) for m in batch]), now, now) for batch in batches if batch]
+        with db.write_connection(self.db_path) as conn:
+            conn.executemany(
+                "INSERT INTO enrichment_jobs (runId, movie_ids, status, attempts, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', 0, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def plan(
+        self,
+        planner: Optional[TokenBatchPlanner] = None,
+        limit: Optional[int] = None,
+        run_id: Optional[str] = None,
+        scope: str = 'all'
+    ) -> int:
+        """
+        Enqueues every movie in scope that is neither enriched nor already in a
+        pending or leased job, packed into batches by the token planner.
+        """
+        planner = planner or TokenBatchPlanner()
+        movies = (
+            movie
+            for chunk in db.iter_pending_enrichment(scope, limit=limit, exclude_queued=True)
+            for movie in chunk
+        )
+        return self.enqueue(([m['movieId'] for m in batch] for batch in planner.batches(movies)), run_id)
+
+    def claim(self, worker_id: str) -> Optional[EnrichmentJob]:
+        """Leases the oldest available job to worker_id, or returns None if there is none."""
+        now = time.time()
+        with db.write_connection(self.db_path) as conn:
+            # Expired leases that have used up their attempts are failed rather than handed out again
+            conn.execute(
+                "UPDATE enrichment_jobs SET status = 'failed', lease_owner = NULL, updated_at = ?, "
+                "last_error = COALESCE(last_error, 'lease expired') "
+                "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                """
+                UPDATE enrichment_jobs
+                SET status = 'leased', lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE jobId = (
+                    SELECT jobId FROM enrichment_jobs
+                    WHERE status = 'pending' OR (status = 'leased' AND lease_expires_at < ?)
+                    ORDER BY jobId
+                    LIMIT 1
+                )
+                RETURNING jobId, runId, movie_ids, attempts
+                """,
+                (worker_id, now + self.lease_seconds, now, now, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return EnrichmentJob(row['jobId'], row['runId'], json.loads(row['movie_ids']), row['attempts'])
+
+    def heartbeat(self, job: EnrichmentJob, worker_id: str) -> bool:
+        """Extends the lease. Returns False if the lease was lost to another worker."""
+        now = time.time()
+        with db.write_connection(self.db_path) as conn:
+            cursor = conn.execute(
+                "UPDATE enrichment_jobs SET lease_expires_at = ?, heartbeat_at = ?, updated_at = ? "
+                "WHERE jobId = ? AND lease_owner = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, now, job.job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job: EnrichmentJob, worker_id: str):
+        with db.write_connection(self.db_path) as conn:
+            conn.execute(
+                "UPDATE enrichment_jobs SET status = 'done', lease_owner = NULL, updated_at = ? "
+                "WHERE jobId = ? AND lease_owner = ?",
+                (time.time(), job.job_id, worker_id)
+            )
+
+    def fail(self, job: EnrichmentJob, worker_id: str, error: str):
+        """Returns the job to pending, or marks it failed once it has used all its attempts."""
+        status = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        with db.write_connection(self.db_path) as conn:
+            conn.execute(
+                "UPDATE enrichment_jobs SET status = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                "last_error = ?, updated_at = ? WHERE jobId = ? AND lease_owner = ?",
+                (status, error[:1000], time.time(), job.job_id, worker_id)
+            )
+
+    def retry_failed(self) -> int:
+        """Moves failed jobs back to pending with a fresh attempt count."""
+        with db.write_connection(self.db_path) as conn:
+            cursor = conn.execute(
+                "UPDATE enrichment_jobs SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'",
+                (time.time(),)
+            )
+            return cursor.rowcount
+
+    def status_counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in JOB_STATUSES}
+        rows = db.get_read_connection(self.db_path).execute(
+            "SELECT status, COUNT(*) AS n FROM enrichment_jobs GROUP BY status"
+        )
+        for row in rows:
+            counts[row['status']] = row['n']
+        return counts
+
+class _Heartbeat:
+    """Background thread that keeps a job's lease alive while it is being processed."""
+
+    def __init__(self, queue: EnrichmentJobQueue, job: EnrichmentJob, worker_id: str):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            if not self.queue.heartbeat(self.job, self.worker_id):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def run_worker(
+    enricher,
+    queue: EnrichmentJobQueue,
+    worker_id: Optional[str] = None,
+    wait: bool = False,
+    poll_interval: float = 5.0
+) -> int:
+    """
+    Claims and processes jobs until the queue is empty (or forever with wait=True).
+    Each job's movies are enriched and saved, and the job is marked done once
+    all of them are. Errors, or movies the LLM could not enrich, put it back to
+    pending for another attempt, which only redoes the movies not saved yet.
+    Returns the number of movies saved.
+    """
+    worker_id = worker_id or default_worker_id()
+    saved = 0
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if not wait:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        print(f"[{worker_id}] Claimed job {job.job_id} ({len(job.movie_ids)} movies, attempt {job.attempts})")
+        try:
+            with _Heartbeat(queue, job, worker_id) as heartbeat:
+                # Another worker may already have saved some of these movies
+                done_ids = db.get_enriched_movie_ids_among(job.movie_ids)
+                movies = [m for m in db.get_movies_by_ids(job.movie_ids).to_dict('records') if m['movieId'] not in done_ids]
+                enriched = enricher.enrich_batch(movies)
+                if heartbeat.lost:
+                    print(f"[{worker_id}] Lost the lease on job {job.job_id}; discarding its results")
+                    continue
+                if enriched:
+                    db.upsert_enriched_rows(enriched)
+                    saved += len(enriched)
+            # enrich_batch leaves out movies it gave up on rather than raising
+            enriched_ids = {row['movieId'] for row in enriched}
+            missing_ids = [m['movieId'] for m in movies if m['movieId'] not in enriched_ids]
+            if missing_ids:
+                print(f"[{worker_id}] Job {job.job_id}: {len(missing_ids)} movie(s) not enriched")
+                queue.fail(job, worker_id, f"{len(missing_ids)} movie(s) not enriched: {missing_ids}")
+            else:
+                queue.complete(job, worker_id)
+        except Exception as e:
+            print(f"[{worker_id}] Job {job.job_id} failed: {e}")
+            queue.fail(job, worker_id, str(e))
+    return saved
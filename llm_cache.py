@@ -0,0 +1,116 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+# Defaults, overridden by LLM_CACHE_PATH / LLM_CACHE_TTL_SECONDS / LLM_CACHE_MAX_ENTRIES when a cache is created
+LLM_CACHE_DB_PATH = "db/llm_cache.db"
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 20000
+
+# Cache modes understood by LLMClient:
+#   use     - return cached responses when present, store new ones
+#   refresh - always call the LLM, then overwrite the cached response
+#   bypass  - never read or write the cache
+CACHE_MODES = ("use", "refresh", "bypass")
+
+class LLMCache:
+    """
+    A small persistent response cache for LLM calls, stored in SQLite.
+    Entries expire after `ttl_seconds` and the least recently used entries are
+    evicted once the cache holds more than `max_entries` responses.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ):
+        db_path = db_path or os.getenv("LLM_CACHE_PATH", LLM_CACHE_DB_PATH)
+        ttl_seconds = ttl_seconds or int(os.getenv("LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # One connection shared by all threads; access is serialized by self._lock.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, system_message: Optional[str], prompt: str, temperature: float, json_mode: bool) -> str:
+        """Builds the cache key from the model, system message, prompt hash, temperature and json_mode."""
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = "\x1f".join([model, system_message or "", prompt_hash, f"{temperature:.3f}", str(bool(json_mode))])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response for a key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_accessed = ? WHERE cache_key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, model: str, response: str):
+        """Stores a response and evicts expired and least recently used entries when over capacity."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (cache_key, model, response, created_at, last_accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._writes_since_evict += 1
+            # Eviction needs a COUNT(*), so only check every so often.
+            if self._writes_since_evict >= 100:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._writes_since_evict = 0
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE cache_key IN (SELECT cache_key FROM llm_cache ORDER BY last_accessed ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        """Removes every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit/miss counters for this process."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -1,40 +1,218 @@
 import os
 import json
-from typing import Dict, Optional
-from dotenv import load_dotenv
+import threading
+from typing import Dict, List, Optional
+from llm_cache import LLMCache, CACHE_MODES
+from tracing import span, traced
 
-load_dotenv()
+# Connection pool defaults. These can be overridden per client or through the environment
+# (LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY, LLM_TIMEOUT),
+# which is read when a client is created, after .env has been loaded.
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 16
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_TIMEOUT = 120.0
+
+# Response cache mode for new clients: use, refresh or bypass (see llm_cache.py).
+# None means LLM_CACHE_MODE from the environment, or "use".
+_default_cache_mode: Optional[str] = None
+
+_env_loaded = False
+
+def load_env():
+    """
+    Loads the .env file into the environment, once per process. Called by
+    main() after argument parsing and by LLMClient, so importing this module
+    (or running --help) does not pay for it.
+    """
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def set_default_cache_mode(mode: str):
+    """Sets the cache mode used by clients created after this call (e.g. from CLI flags)."""
+    global _default_cache_mode
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode '{mode}'. Expected one of {CACHE_MODES}")
+    _default_cache_mode = mode
+
+def _usage_attributes(response) -> Dict[str, int]:
+    """Prompt and completion token counts reported by the API, for the llm.generate span."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    return {"prompt_tokens": usage.prompt_tokens or 0, "completion_tokens": usage.completion_tokens or 0}
 
 class LLMClient:
     def __init__(
         self,
         openai_model: Optional[str] = None,
         openai_api_key: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+        cache: Optional[LLMCache] = None,
+        cache_mode: Optional[str] = None,
     ):
-        from openai import OpenAI
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+        load_env()
         openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY") or os.getenv("OPEN_API_KEY")
         if not openai_api_key:
             raise ValueError("OPENAI_API_KEY not found in environment or provided")
-        self.client = OpenAI(api_key=openai_api_key)
+        self.api_key = openai_api_key
         self.model = openai_model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    
-    def generate(self, prompt: str, system_message: Optional[str] = None, json_mode: bool = True, temperature: float = 0.3) -> str:
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", DEFAULT_TIMEOUT))
+        max_keepalive_connections = max_keepalive_connections or int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS))
+
+        # One keep-alive pool per client, shared by every call (and every thread) that uses it.
+        self.limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=min(max_keepalive_connections, self.max_connections),
+            keepalive_expiry=keepalive_expiry or float(os.getenv("LLM_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)),
+        )
+        self.client = OpenAI(
+            api_key=openai_api_key,
+            timeout=self.timeout,
+            http_client=DefaultHttpxClient(limits=self.limits, timeout=self.timeout),
+        )
+        self._async_client = None
+        self._async_lock = threading.Lock()
+
+        self.cache_mode = cache_mode or _default_cache_mode or os.getenv("LLM_CACHE_MODE", "use")
+        if self.cache_mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{self.cache_mode}'. Expected one of {CACHE_MODES}")
+        self.cache = None if self.cache_mode == "bypass" else (cache or LLMCache())
+
+    @property
+    def async_client(self):
+        """Lazily builds the AsyncOpenAI client, sharing the same pool limits as the sync client."""
+        if self._async_client is None:
+            with self._async_lock:
+                if self._async_client is None:
+                    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                    self._async_client = AsyncOpenAI(
+                        api_key=self.api_key,
+                        timeout=self.timeout,
+                        http_client=DefaultAsyncHttpxClient(limits=self.limits, timeout=self.timeout),
+                    )
+        return self._async_client
+
+    def _build_messages(self, prompt: str, system_message: Optional[str]) -> List[Dict]:
         messages = []
         if system_message:
             messages.append({"role": "system", "content": system_message})
         messages.append({"role": "user", "content": prompt})
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                response_format={"type": "json_object"} if json_mode else None
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"OpenAI API error: {e}")
-            raise
-    
+        return messages
+
+    def _request_kwargs(self, prompt: str, system_message: Optional[str], json_mode: bool, temperature: float) -> Dict:
+        kwargs = {
+            "model": self.model,
+            "messages": self._build_messages(prompt, system_message),
+            "temperature": temperature,
+        }
+        if json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    @traced('llm.cache_lookup')
+    def _cache_lookup(self, prompt: str, system_message: Optional[str], json_mode: bool, temperature: float, cache_mode: Optional[str] = None):
+        """Returns (cache_key, cached_response). The key is None when the cache is bypassed."""
+        cache_mode = cache_mode or self.cache_mode
+        if self.cache is None or cache_mode == "bypass":
+            return None, None
+        key = LLMCache.make_key(self.model, system_message, prompt, temperature, json_mode)
+        if cache_mode == "refresh":
+            return key, None
+        return key, self.cache.get(key)
+
+    @traced('llm.cache_store')
+    def _cache_store(self, key: Optional[str], content: Optional[str]):
+        if key is not None and content:
+            self.cache.set(key, self.model, content)
+
+    def generate(self, prompt: str, system_message: Optional[str] = None, json_mode: bool = True, temperature: float = 0.3, cache_mode: Optional[str] = None) -> str:
+        """`cache_mode` overrides the client's cache mode for this call only (e.g. "refresh" on a retry)."""
+        with span('llm.generate', prompt_chars=len(prompt) + len(system_message or '')) as s:
+            key, cached = self._cache_lookup(prompt, system_message, json_mode, temperature, cache_mode)
+            if cached is not None:
+                s.set(cache_hits=1, response_chars=len(cached))
+                return cached
+            try:
+                with span('llm.request'):
+                    response = self.client.chat.completions.create(
+                        **self._request_kwargs(prompt, system_message, json_mode, temperature)
+                    )
+                content = response.choices[0].message.content
+            except Exception as e:
+                print(f"OpenAI API error: {e}")
+                raise
+            s.set(response_chars=len(content or ''), **_usage_attributes(response))
+            self._cache_store(key, content)
+            return content
+
     def generate_text(self, prompt: str, system_message: Optional[str] = None, temperature: float = 0.7) -> str:
         return self.generate(prompt, system_message, json_mode=False, temperature=temperature)
+
+    async def agenerate(self, prompt: str, system_message: Optional[str] = None, json_mode: bool = True, temperature: float = 0.3, cache_mode: Optional[str] = None) -> str:
+        """Async version of generate(). The async pool is bound to the event loop that first uses it."""
+        with span('llm.agenerate', prompt_chars=len(prompt) + len(system_message or '')) as s:
+            key, cached = self._cache_lookup(prompt, system_message, json_mode, temperature, cache_mode)
+            if cached is not None:
+                s.set(cache_hits=1, response_chars=len(cached))
+                return cached
+            try:
+                with span('llm.request'):
+                    response = await self.async_client.chat.completions.create(
+                        **self._request_kwargs(prompt, system_message, json_mode, temperature)
+                    )
+                content = response.choices[0].message.content
+            except Exception as e:
+                print(f"OpenAI API error: {e}")
+                raise
+            s.set(response_chars=len(content or ''), **_usage_attributes(response))
+            self._cache_store(key, content)
+            return content
+
+    async def agenerate_text(self, prompt: str, system_message: Optional[str] = None, temperature: float = 0.7) -> str:
+        return await self.agenerate(prompt, system_message, json_mode=False, temperature=temperature)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Returns the response cache hit/miss counters for this client."""
+        if self.cache is None:
+            return {"hits": 0, "misses": 0}
+        return self.cache.stats()
+
+    def close(self):
+        """Closes the sync connection pool. The async pool is closed by its event loop."""
+        self.client.close()
+
+
+_shared_client: Optional[LLMClient] = None
+_shared_client_lock = threading.Lock()
+
+def get_llm_client(**kwargs) -> LLMClient:
+    """
+    Returns the process-wide LLMClient, creating it on first use.
+    Every command and worker thread should use this so they share one warm connection pool.
+    Keyword arguments are only applied when the shared client is first created.
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                with span('llm.client_init'):
+                    _shared_client = LLMClient(**kwargs)
+    return _shared_client
+
+def print_cache_stats():
+    """Prints the response cache counters of the shared client, if one was created."""
+    if _shared_client is None or _shared_client.cache is None:
+        return
+    stats = _shared_client.cache_stats()
+    if stats["hits"] or stats["misses"]:
+        print(f"LLM cache: {stats['hits']} hit(s), {stats['misses']} miss(es) [mode: {_shared_client.cache_mode}]")
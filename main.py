@@ -1,50 +1,252 @@
+import sys
+import time
+
+# Only the standard library is imported here. Each command imports what it needs
+# when it runs, so --help and the commands that never touch pandas or the OpenAI
+# SDK (similar, search, enrich-worker --status, ...) start in milliseconds.
+_STARTED_AT = time.perf_counter()
+
+class StartupProfiler:
+    """
+    Records how long each top-level import takes (for --startup-profile and --profile), by
+    wrapping builtins.__import__. Nested imports are counted in the module that
+    triggered them, as in `python -X importtime`.
+    """
+
+    def __init__(self):
+        import builtins
+        self._builtins = builtins
+        self._original_import = builtins.__import__
+        self.import_times = {}
+        self._depth = 0
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Relative, already loaded, or nested inside an import being timed: nothing new to attribute
+        if level or self._depth or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                top = name.split('.')[0]
+                self.import_times[top] = self.import_times.get(top, 0.0) + time.perf_counter() - start
+
+    def start(self):
+        self._builtins.__import__ = self._timed_import
+
+    def stop(self):
+        self._builtins.__import__ = self._original_import
+
+    def report(self, command_started_at: float, limit: int = 15):
+        now = time.perf_counter()
+        imports = sorted(self.import_times.items(), key=lambda item: item[1], reverse=True)
+        print(f"Startup profile: {(command_started_at - _STARTED_AT) * 1000:.1f} ms to start the command, "
+              f"{(now - _STARTED_AT) * 1000:.1f} ms in total, "
+              f"{sum(self.import_times.values()) * 1000:.1f} ms importing {len(imports)} top-level module(s):")
+        for name, seconds in imports[:limit]:
+            print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+# Installed before main.py's remaining imports, so the profile covers all of startup
+_startup_profiler = None
+if '--startup-profile' in sys.argv or '--profile' in sys.argv:
+    _startup_profiler = StartupProfiler()
+    _startup_profiler.start()
+
+import os
 import argparse
-import pandas as pd
-# Import the new get_existing_enriched_movie_ids function
-from database import get_movie_sample, save_enriched_data, get_all_movies, get_movie_by_id, get_existing_enriched_movie_ids
-from enricher import MovieEnricher
-from llm_client import LLMClient
-from recommender import Recommender
-from summarizer import Summarizer
-from comparator import Comparator
-
-def enrich_data(size, process_all, movie_id):
+
+def enrich_data(size, process_all, movie_id, batch_size=25, concurrency=8, max_tokens=4000, scope='all'):
     """Enrich movie data intelligently, avoiding re-processing."""
+    from enricher import MovieEnricher
+    from llm_client import get_llm_client
     print("Initializing LLM client and movie enricher...")
-    llm_client = LLMClient()
+    llm_client = get_llm_client()
     enricher = MovieEnricher(llm_client)
 
     enricher.enrich(
         movie_id=movie_id,
         size=size if not process_all and not movie_id else None,
-        process_all=process_all
+        process_all=process_all,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        max_tokens=max_tokens,
+        scope=scope
     )
+
+def enrich_worker(plan, status, retry_failed, concurrency, batch_size, max_tokens, lease_seconds, wait, worker_id, scope='all'):
+    """Run enrichment jobs from the shared job queue (optionally planning them first)."""
+    from job_queue import EnrichmentJobQueue
+
+    queue = EnrichmentJobQueue(lease_seconds=lease_seconds)
+    if retry_failed:
+        print(f"Moved {queue.retry_failed()} failed job(s) back to pending.")
+    if plan:
+        from batch_planner import TokenBatchPlanner
+        planner = TokenBatchPlanner(max_input_tokens=max_tokens, max_batch_size=batch_size)
+        print(f"Planned {queue.plan(planner, scope=scope)} new enrichment job(s).")
+    if status:
+        print(f"Enrichment jobs: {queue.status_counts()}")
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    from enricher import MovieEnricher
+    from job_queue import run_worker, default_worker_id
+    from llm_client import get_llm_client
+    enricher = MovieEnricher(get_llm_client())
+    worker_id = worker_id or default_worker_id()
+    start = time.perf_counter()
+    # Each thread is an independent worker with its own lease; they share one LLM client
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [
+            executor.submit(run_worker, enricher, queue, f"{worker_id}/{i}", wait)
+            for i in range(max(1, concurrency))
+        ]
+        saved = sum(f.result() for f in futures)
+    elapsed = time.perf_counter() - start
+    print(f"Worker {worker_id} saved {saved} movie(s) in {elapsed:.1f}s "
+          f"({saved / elapsed if elapsed else 0.0:.2f} movies/sec). Queue: {queue.status_counts()}")
+
 def recommend_movies(query):
     """Get movie recommendations based on a query."""
+    from recommender import Recommender
+    from database import NotFoundError
     print(f"Getting recommendations for query: '{query}'")
     recommender = Recommender()
-    recommendations = recommender.recommend(query)
+    try:
+        recommendations = recommender.recommend(query)
+    except NotFoundError as e:
+        print(e)
+        return
     print("Recommendations:")
     print(recommendations)
 
 def summarize_user(user_id):
     """Summarize a user's preferences."""
+    from summarizer import Summarizer
+    from database import NotFoundError
     print(f"Summarizing preferences for user ID: {user_id}")
     summarizer = Summarizer()
-    summary = summarizer.summarize(user_id)
+    try:
+        summary = summarizer.summarize(user_id)
+    except NotFoundError as e:
+        print(e)
+        return
     print("User Preference Summary:")
     print(summary)
 
-def compare_movies(movie_ids):
+def build_index(name):
+    """Builds one of the offline indexes."""
+    if name == "semantic":
+        from semantic_index import SemanticIndex
+        SemanticIndex.build()
+    elif name == "profiles":
+        from user_profiles import build_user_profiles
+        build_user_profiles()
+    elif name == "similarity":
+        from similarity import SimilarityIndex
+        SimilarityIndex.build()
+    elif name == "attributes":
+        from attributes import build_rule_attributes
+        build_rule_attributes()
+
+def search_movies(query, k):
+    """Semantic search over movie titles, overviews and genres."""
+    from semantic_index import get_semantic_index
+    from database import get_movie_titles
+    index = get_semantic_index()
+    if index is None:
+        print("Semantic index not found. Run 'python main.py build-index semantic' first.")
+        return
+    start = time.perf_counter()
+    results = index.search(query, k=k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not results:
+        print("No matching movies found.")
+        return
+    titles = get_movie_titles([movie_id for movie_id, _ in results])
+    print(f"Top {len(results)} matches for '{query}' ({elapsed_ms:.1f} ms):")
+    for movie_id, score in results:
+        print(f"  {score:.3f}  {movie_id:>7}  {titles.get(movie_id, '?')}")
+
+def similar_movies(movie_id, k):
+    """Movies most similar to movie_id by how users rated them (item-item collaborative filtering)."""
+    from similarity import get_similarity_index
+    from database import get_movie_titles
+    index = get_similarity_index()
+    if index is None:
+        print("Similarity index not found. Run 'python main.py build-index similarity' first.")
+        return
+    start = time.perf_counter()
+    results = index.similar(movie_id, k=k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not results:
+        print(f"No similar movies found for movie ID {movie_id} (it may have too few ratings).")
+        return
+    titles = get_movie_titles([movie_id] + [m for m, _ in results])
+    print(f"Movies most similar to {movie_id} ({titles.get(movie_id, '?')}) ({elapsed_ms:.1f} ms):")
+    for similar_id, score in results:
+        print(f"  {score:.3f}  {similar_id:>7}  {titles.get(similar_id, '?')}")
+
+def compare_movies(movie_ids, use_llm=True):
     """Compare two or more movies."""
+    from comparator import Comparator
+    from database import NotFoundError
     print(f"Comparing movies with IDs: {movie_ids}")
     comparator = Comparator()
-    comparison = comparator.compare(movie_ids)
+    try:
+        comparison = comparator.compare(movie_ids, use_llm=use_llm)
+    except (ValueError, NotFoundError) as e:
+        print(e)
+        return
     print("Movie Comparison:")
     print(comparison)
 
+def run_batch(input_path, output_path, parallel):
+    """Run recommend/summarize/compare tasks from a JSONL file in one process."""
+    from batch_runner import BatchRunner
+    BatchRunner(parallel=parallel).run(input_path, output_path)
+
+def serve(host, port, workers):
+    """Serve recommend/summarize/compare/enrich-status over HTTP from one warm process."""
+    from server import serve as run_server
+    run_server(host, port, workers)
+
+def run_command(args):
+    """Dispatches the parsed command to its handler."""
+    if args.command == "enrich":
+        enrich_data(args.size, args.all, args.movie_id, args.batch_size, args.concurrency, args.max_tokens, args.scope)
+    elif args.command == "enrich-worker":
+        enrich_worker(args.plan, args.status, args.retry_failed, args.concurrency, args.batch_size,
+                      args.max_tokens, args.lease_seconds, args.wait, args.worker_id, args.scope)
+    elif args.command == "recommend":
+        recommend_movies(args.query)
+    elif args.command == "summarize":
+        summarize_user(args.user_id)
+    elif args.command == "compare":
+        compare_movies(args.movie_ids, use_llm=not args.no_llm)
+    elif args.command == "build-index":
+        build_index(args.name)
+    elif args.command == "search":
+        search_movies(args.query, args.k)
+    elif args.command == "similar":
+        similar_movies(args.movie_id, args.k)
+    elif args.command == "batch":
+        output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+        run_batch(args.input, output, args.parallel)
+    elif args.command == "serve":
+        serve(args.host, args.port, args.workers)
+
 def main():
     parser = argparse.ArgumentParser(description="Movie System CLI")
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true", help="Bypass the LLM response cache entirely")
+    cache_group.add_argument("--refresh-cache", action="store_true", help="Ignore cached LLM responses and overwrite them with fresh ones")
+    parser.add_argument("--startup-profile", action="store_true", help="Report startup and per-module import time after the command")
+    parser.add_argument("--profile", action="store_true", help="Print a per-stage time breakdown (db, prompts, LLM, ...) and the import times after the command")
+    parser.add_argument("--profile-trace", type=str, metavar="PATH", help="Write the per-stage spans as Chrome trace JSON (chrome://tracing, Perfetto)")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Enrich data command
@@ -52,6 +254,23 @@ def main():
     enrich_parser.add_argument("--size", type=int, default=50, help="Number of movies to enrich")
     enrich_parser.add_argument("--all", action="store_true", help="Process all movies in the database")
     enrich_parser.add_argument("--movie_id", type=int, help="Process a single specific movie by its ID")
+    enrich_parser.add_argument("--batch_size", type=int, default=25, help="Maximum number of movies sent to the LLM per batch")
+    enrich_parser.add_argument("--max_tokens", type=int, default=4000, help="Estimated input token budget per batch")
+    enrich_parser.add_argument("--concurrency", type=int, default=8, help="Number of LLM batches in flight at once")
+    enrich_parser.add_argument("--scope", choices=["all", "rated"], default="all", help="With --all: every movie, or only movies that have ratings")
+
+    # Enrichment worker command (shared, resumable job queue)
+    worker_parser = subparsers.add_parser("enrich-worker", help="Process enrichment jobs from the shared job queue")
+    worker_parser.add_argument("--plan", action="store_true", help="Enqueue jobs for every movie not yet enriched or queued")
+    worker_parser.add_argument("--status", action="store_true", help="Print job counts by status and exit")
+    worker_parser.add_argument("--retry_failed", action="store_true", help="Move failed jobs back to pending")
+    worker_parser.add_argument("--concurrency", type=int, default=8, help="Number of jobs processed in parallel by this process")
+    worker_parser.add_argument("--batch_size", type=int, default=25, help="Maximum number of movies per planned job")
+    worker_parser.add_argument("--max_tokens", type=int, default=4000, help="Estimated input token budget per planned job")
+    worker_parser.add_argument("--scope", choices=["all", "rated"], default="all", help="Movies to plan: every movie, or only movies that have ratings")
+    worker_parser.add_argument("--lease_seconds", type=float, default=300, help="Lease duration; heartbeats renew it")
+    worker_parser.add_argument("--wait", action="store_true", help="Keep polling for new jobs instead of exiting when the queue is empty")
+    worker_parser.add_argument("--worker_id", type=str, help="Worker name (defaults to host:pid)")
 
     # Recommend movies command
     recommend_parser = subparsers.add_parser("recommend", help="Get movie recommendations")
@@ -64,17 +283,67 @@ def main():
     # Compare movies command
     compare_parser = subparsers.add_parser("compare", help="Compare movies")
     compare_parser.add_argument("movie_ids", type=int, nargs="+", help="List of movie IDs to compare")
+    compare_parser.add_argument("--no-llm", action="store_true", help="Only print the locally computed metrics and pairwise matrices")
+
+    # Offline index commands
+    build_index_parser = subparsers.add_parser("build-index", help="Build an offline index")
+    build_index_parser.add_argument("name", choices=["semantic", "profiles", "similarity", "attributes"], help="Which index to build")
+
+    search_parser = subparsers.add_parser("search", help="Semantic search over title, overview and genres")
+    search_parser.add_argument("query", type=str, help="Free text query, e.g. 'dark heist thriller'")
+    search_parser.add_argument("--k", type=int, default=10, help="Number of results")
+
+    similar_parser = subparsers.add_parser("similar", help="Movies rated similarly to a movie (needs build-index similarity)")
+    similar_parser.add_argument("movie_id", type=int, help="Movie ID")
+    similar_parser.add_argument("--k", type=int, default=10, help="Number of results")
+
+    # Bulk tasks command
+    batch_parser = subparsers.add_parser("batch", help="Run recommend/summarize/compare tasks from a JSONL file")
+    batch_parser.add_argument("input", type=str, help="JSONL file with one task per line")
+    batch_parser.add_argument("--output", type=str, help="JSONL results file (default: <input>.results.jsonl); rerunning skips tasks already ok in it")
+    batch_parser.add_argument("--parallel", type=int, default=8, help="Number of tasks run at once")
+
+    # Long-running HTTP/JSON server command
+    serve_parser = subparsers.add_parser("serve", help="Serve recommend/summarize/compare/enrich-status over HTTP/JSON")
+    serve_parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    serve_parser.add_argument("--workers", type=int, default=8, help="Number of requests handled at once")
 
     args = parser.parse_args()
 
-    if args.command == "enrich":
-        enrich_data(args.size, args.all, args.movie_id)
-    elif args.command == "recommend":
-        recommend_movies(args.query)
-    elif args.command == "summarize":
-        summarize_user(args.user_id)
-    elif args.command == "compare":
-        compare_movies(args.movie_ids)
+    profiler = _startup_profiler
+    if profiler is None and (args.startup_profile or args.profile):
+        # An abbreviated flag that the sys.argv check above did not see
+        profiler = StartupProfiler()
+        profiler.start()
+    command_started_at = time.perf_counter()
+
+    from llm_client import load_env, set_default_cache_mode, print_cache_stats
+    load_env()
+    if args.no_cache:
+        set_default_cache_mode("bypass")
+    elif args.refresh_cache:
+        set_default_cache_mode("refresh")
+
+    from tracing import tracer
+    if args.profile or args.profile_trace:
+        tracer.enable()
+
+    # Make sure indexes and keys are in place before any command touches the databases
+    from database import ensure_schema
+    ensure_schema()
+
+    with tracer.span(f"command.{args.command}"):
+        run_command(args)
+
+    print_cache_stats()
+    if args.profile:
+        tracer.print_report()
+    if args.profile_trace:
+        print(f"Wrote {tracer.write_chrome_trace(args.profile_trace)} span(s) to {args.profile_trace}")
+    if profiler:
+        profiler.stop()
+        profiler.report(command_started_at)
 
 if __name__ == "__main__":
     main()
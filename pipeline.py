@@ -0,0 +1,170 @@
+import time
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional
+import database as db
+from batch_planner import TokenBatchPlanner
+
+# Marks the end of a stage's output on its queue
+_DONE = object()
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when another stage has failed and the pipeline is shutting down."""
+
+class EnrichmentPipeline:
+    """
+    Streams the whole catalog through enrichment in stages connected by bounded
+    queues, so memory stays flat and every stage overlaps with the others:
+
+        reader  -> chunked reads of the pending work set (see db.iter_pending_enrichment)
+        prepare -> token-packed batches; MovieEnricher.prepare_batch adds the rule attributes
+                   (from each batch's rating stats) and builds the LLM prompt
+        llm     -> `concurrency` worker threads calling the LLM and validating results
+        writer  -> one EnrichedDataWriter thread upserting rows in groups of flush_size
+
+    Rows are saved as soon as they are enriched, so a crash only loses the
+    batches in flight; the next run skips everything already saved.
+    """
+
+    def __init__(
+        self,
+        enricher,
+        planner: Optional[TokenBatchPlanner] = None,
+        concurrency: int = 8,
+        chunk_size: int = 500,
+        flush_size: int = 200,
+        skip_existing: bool = True,
+        scope: str = 'all',
+    ):
+        self.enricher = enricher
+        self.planner = planner or TokenBatchPlanner()
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+        self.skip_existing = skip_existing
+        self.scope = scope
+
+        # Enough buffering to keep every LLM worker busy, and no more
+        self.movies_q = queue.Queue(maxsize=2)
+        self.batches_q = queue.Queue(maxsize=self.concurrency * 2)
+
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+        self._lock = threading.Lock()
+        self.stats = {'pending': 0, 'read': 0, 'batches': 0, 'enriched': 0, 'failed': 0}
+
+    def _count(self, key: str, n: int):
+        with self._lock:
+            self.stats[key] += n
+
+    def _put(self, q: queue.Queue, item):
+        """Blocking put that gives up when the pipeline is stopping, so no stage deadlocks."""
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def _stage(self, target, *args):
+        """Runs one stage, recording its error and stopping the others if it fails."""
+        def run():
+            try:
+                target(*args)
+            except PipelineStopped:
+                pass
+            except BaseException as e:
+                with self._lock:
+                    self._errors.append(e)
+                self._stop.set()
+        return threading.Thread(target=run, name=target.__name__, daemon=True)
+
+    def _read(self):
+        if self.skip_existing:
+            chunks = db.iter_pending_enrichment(self.scope, self.chunk_size)
+        else:
+            chunks = db.iter_movie_chunks(self.chunk_size)
+        for chunk in chunks:
+            self._count('read', len(chunk))
+            self._put(self.movies_q, chunk)
+        self._put(self.movies_q, _DONE)
+
+    def _iter_pending_movies(self) -> Iterator[Dict]:
+        while True:
+            chunk = self._get(self.movies_q)
+            if chunk is _DONE:
+                return
+            yield from chunk
+
+    def _prepare(self):
+        # The planner is consumed lazily, so feedback from finished batches shapes the next ones
+        for batch in self.planner.batches(self._iter_pending_movies()):
+            prompt = self.enricher.prepare_batch(batch)
+            self._put(self.batches_q, (batch, prompt))
+        for _ in range(self.concurrency):
+            self._put(self.batches_q, _DONE)
+
+    def _call_llm(self):
+        while True:
+            item = self._get(self.batches_q)
+            if item is _DONE:
+                break
+            batch, prompt = item
+            start = time.perf_counter()
+            enriched = self.enricher.enrich_batch(batch, prompt=prompt)
+            self.planner.record(len(batch), time.perf_counter() - start, ok=len(enriched) == len(batch))
+            self._count('batches', 1)
+            self._count('failed', len(batch) - len(enriched))
+            self.writer.write(enriched)
+
+    def run(self) -> Dict[str, int]:
+        """Runs the pipeline to completion and returns its counters. Re-raises the first stage error."""
+        start = time.perf_counter()
+        if self.skip_existing:
+            self.stats['pending'] = db.count_pending_enrichment(self.scope)
+            print(f"{self.stats['pending']} movie(s) need enrichment (scope: {self.scope}).")
+        print(f"Streaming movies through enrichment ({self.concurrency} LLM batches in flight)...")
+
+        def report(written: int):
+            elapsed = time.perf_counter() - start
+            print(f"Saved {written} movie(s) so far ({self.stats['read']} read, {written / elapsed:.2f} movies/sec)")
+
+        self.writer = db.EnrichedDataWriter(flush_size=self.flush_size, on_flush=report)
+        threads = [self._stage(self._read), self._stage(self._prepare)]
+        threads += [self._stage(self._call_llm) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            try:
+                self.writer.close()
+            except BaseException as e:
+                self._errors.append(e)
+        if self._errors:
+            raise self._errors[0]
+
+        self.stats['enriched'] = self.writer.written
+        elapsed = time.perf_counter() - start
+        self.stats['elapsed'] = round(elapsed, 1)
+        print(f"Enriched {self.stats['enriched']} movie(s) in {elapsed:.1f}s "
+              f"({self.stats['enriched'] / elapsed if elapsed else 0.0:.2f} movies/sec); "
+              f"{self.stats['failed']} could not be enriched")
+        return self.stats
@@ -1,5 +1,88 @@
-import json
-from typing import List, Dict
+import re
+from typing import Dict, List, Optional, Tuple
+from database import parse_genres
+from tracing import traced
+
+# --- Compact serialization ---
+# Movie rows are sent to the LLM as pipe-delimited tables with a single header
+# row (the format prompts/enrich_v2.txt describes) instead of indented JSON, so
+# keys are not repeated per row and no tokens are spent on whitespace.
+
+# Columns sent to the LLM for each prompt. Anything else (imdbId, productionCompanies, ...) is dropped.
+# Enrichment only asks for sentiment and age category, so budgets, revenue and ratings are not sent
+# (the attributes derived from them are computed locally, see attributes.py).
+ENRICHMENT_COLUMNS = ['movieId', 'title', 'overview', 'genres']
+RECOMMENDATION_COLUMNS = [
+    'movieId', 'title', 'overview', 'genres', 'releaseDate', 'sentiment', 'budget_tier',
+    'revenue_tier', 'production_effectiveness', 'age_category', 'avg_rating',
+]
+COMPARISON_COLUMNS = [
+    'movieId', 'title', 'year', 'genres', 'sentiment', 'budget', 'revenue', 'roi', 'runtime',
+    'runtime_delta', 'avg_rating', 'rating_count', 'pct_high', 'pct_low', 'weighted_rating', 'overall_rank',
+]
+
+# Longest overview (in characters) kept per prompt type
+OVERVIEW_CHARS = {'enrichment': 600, 'recommendation': 300}
+
+# Hard input budgets (estimated tokens) for the variable-size data section of each prompt
+TOKEN_BUDGETS = {'recommendation': 6000, 'comparison': 6000}
+
+# Approximates BPE tokenization: a word, a run of up to 3 digits, or one symbol per token
+_TOKEN_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+def estimate_tokens(text: str) -> int:
+    """Local token estimate for budgeting. Long words count as one token per 8 letters."""
+    count = 0
+    for piece in _TOKEN_RE.findall(text):
+        count += 1 + (len(piece) - 1) // 8 if piece.isalpha() else 1
+    return count
+
+def _truncate(text: str, max_chars: Optional[int]) -> str:
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(' ', 1)[0]
+    return cut.rstrip(' ,.;:') + '...'
+
+def _format_value(column: str, value, max_overview_chars: Optional[int]) -> str:
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if column == 'genres':
+        value = ','.join(parse_genres(value))
+    elif isinstance(value, float):
+        value = f"{value:.2f}".rstrip('0').rstrip('.') if not value.is_integer() else str(int(value))
+    text = str(value).replace('|', '/').replace('\r', ' ').replace('\n', ' ').strip()
+    if column == 'overview':
+        text = _truncate(text, max_overview_chars)
+    return text
+
+def format_table(rows: List[Dict], columns: List[str], max_overview_chars: Optional[int] = None) -> str:
+    """Serializes rows as a pipe-delimited table with a header row, keeping only `columns`."""
+    return '\n'.join(
+        ['|'.join(columns)] +
+        ['|'.join(_format_value(c, row.get(c), max_overview_chars) for c in columns) for row in rows]
+    )
+
+def format_table_within_budget(
+    rows: List[Dict],
+    columns: List[str],
+    max_tokens: int,
+    max_overview_chars: Optional[int] = None
+) -> Tuple[str, int]:
+    """
+    Like format_table(), but stops adding rows once the estimated token count
+    would exceed `max_tokens`. Rows should already be ordered most important
+    first. Returns the table and the number of rows included.
+    """
+    lines = ['|'.join(columns)]
+    used = estimate_tokens(lines[0])
+    for row in rows:
+        line = '|'.join(_format_value(c, row.get(c), max_overview_chars) for c in columns)
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens and len(lines) > 1:
+            break
+        lines.append(line)
+        used += cost
+    return '\n'.join(lines), len(lines) - 1
 
 class Prompts:
     # --- Single Enrichment (Original) ---
@@ -39,41 +122,35 @@ Return ONLY valid JSON:
     # --- Batch Enrichment (New) ---
     @staticmethod
     def get_batch_enrichment_system_message() -> str:
-        return """You are a highly efficient movie data analyst. You will be given a JSON array of movie objects.
-For each movie object in the input array, you must generate a corresponding JSON object with the 5 requested attributes.
+        return """You are a highly efficient movie data analyst. You will be given movies as a pipe-delimited table whose first line is the header row.
+For each movie row in the input table, you must generate a corresponding JSON object with the 2 requested attributes.
 Return a single JSON object with one key, "enriched_movies", which contains a JSON array of the results.
-The order of the movies in the output array MUST EXACTLY match the order of the movies in the input array."""
+Every result MUST include the "movieId" of the input row it describes, copied exactly. Return one result per input movie."""
 
     @staticmethod
+    @traced('prompts.batch_enrichment', prompt_chars=len, prompt_tokens_est=estimate_tokens)
     def build_batch_enrichment_prompt(movies: List[Dict]) -> str:
-        movies_json_string = json.dumps(movies, indent=2)
-        return f"""Analyze the following list of movies and generate 5 attributes for each.
+        movies_table = format_table(movies, ENRICHMENT_COLUMNS, OVERVIEW_CHARS['enrichment'])
+        return f"""Analyze the following list of movies and generate 2 attributes for each.
 
-Input Movies:
-{movies_json_string}
+Input Movies (pipe-delimited, header row first; genres are comma-separated):
+{movies_table}
 
 For each movie, generate these attributes:
 1. sentiment: positive/neutral/negative (based on overview tone)
-2. budget_tier: low/medium/high (reason about industry standards)
-3. revenue_tier: low/medium/high (reason about box office performance)
-4. production_effectiveness: low/medium/high (analyze rating, budget-to-revenue ratio, and overall success)
-5. age_category: kid/teen/adult (based on content and themes)
+2. age_category: kid/teen/adult (based on content and themes)
 
-Return ONLY a single valid JSON object in the following format, with one entry for each movie from the input list, in the same order:
+Return ONLY a single valid JSON object in the following format, with one entry for each movie from the input list, each echoing its movieId:
 {{
   "enriched_movies": [
     {{
+      "movieId": 123,
       "sentiment": "...",
-      "budget_tier": "...",
-      "revenue_tier": "...",
-      "production_effectiveness": "...",
       "age_category": "..."
     }},
     {{
+      "movieId": 456,
       "sentiment": "...",
-      "budget_tier": "...",
-      "revenue_tier": "...",
-      "production_effectiveness": "...",
       "age_category": "..."
     }}
   ]
@@ -85,14 +162,18 @@ Return ONLY a single valid JSON object in the following format, with one entry f
         return "You are a movie recommendation expert. Return valid JSON with movie recommendations."
     
     @staticmethod
+    @traced('prompts.recommendation', prompt_chars=len, prompt_tokens_est=estimate_tokens)
     def build_recommendation_prompt(query: str, movies_data: List[Dict]) -> str:
-        movies_json = json.dumps(movies_data, indent=2)
+        # Candidates arrive ordered by relevance, so the budget trims the weakest ones
+        movies_table, _ = format_table_within_budget(
+            movies_data, RECOMMENDATION_COLUMNS, TOKEN_BUDGETS['recommendation'], OVERVIEW_CHARS['recommendation']
+        )
         return f"""Given the following ENRICHED MOVIE DATASET, generate personalized recommendations.
 
 User Query: {query}
 
-Movie Dataset:
-{movies_json}
+Movie Dataset (pipe-delimited, header row first; avg_rating is out of 5):
+{movies_table}
 
 IMPORTANT RULES FOR RECOMMENDATIONS:
 1.  **ONLY recommend movies that are present in the provided "Movie Dataset" above.** Do NOT invent new movies or movie IDs.
@@ -122,24 +203,56 @@ Return JSON format:
         return "You are a user preference analyst. Return valid JSON with preference analysis."
     
     @staticmethod
-    def build_summary_prompt(user_id: int, ratings_data: List[Dict], movie_details: List[Dict]) -> str:
-        ratings_summary = json.dumps(ratings_data, indent=2)
-        movies_summary = json.dumps(movie_details, indent=2)
-        return f"""Analyze this user's movie rating history and preferences.
+    @traced('prompts.profile_summary', prompt_chars=len, prompt_tokens_est=estimate_tokens)
+    def build_profile_summary_prompt(user_id: int, profile: Dict, candidates: Optional[List[Dict]] = None) -> str:
+        """
+        Summary prompt from a precomputed taste profile (see user_profiles.py); its size does not grow with the
+        rating count. `candidates` are movies picked locally (e.g. by the similarity index) for the LLM to choose
+        recommendations from; without them it suggests movies on its own.
+        """
+        def preferences(values: Dict[str, Dict]) -> str:
+            ranked = sorted(values.items(), key=lambda item: item[1]['weight'], reverse=True)
+            return ', '.join(f"{value} {p['weight']:+.2f} ({p['count']})" for value, p in ranked) or 'n/a'
+
+        genre_rows = [{'genre': genre, **p} for genre, p in profile['genres'].items()]
+        movie_columns = ['movieId', 'title', 'year', 'rating']
+        if candidates:
+            candidate_section = f"""
+Candidate movies the user has not rated, scored from the ratings of similar movies (pipe-delimited, header row first):
+{format_table(candidates, ['movieId', 'title', 'genres', 'releaseDate', 'score'])}
+"""
+            recommend_instruction = "Choose the 3-5 candidate movies above that best fit their preferences (provide movieId and title)"
+        else:
+            candidate_section = ""
+            recommend_instruction = "Suggest 3-5 movies they might like based on their preferences (provide movieId and title)"
+        return f"""Analyze this user's movie taste profile, computed from their full rating history.
 
 User ID: {user_id}
+Ratings: {profile['rating_count']}, mean {profile['rating_mean']:.2f} out of 5, variance {profile['rating_variance']:.2f}, {profile['liked_share']:.0%} rated 4 or higher
+
+Preference weights below are how many stars above (+) or below (-) the user's own mean they rate movies with that value,
+shrunk towards 0 when backed by few ratings; the number of ratings is in parentheses.
 
-User's Ratings:
-{ratings_summary}
+Genre affinity (pipe-delimited, header row first):
+{format_table(genre_rows, ['genre', 'weight', 'count'])}
 
-Movie Details for Rated Movies:
-{movies_summary}
+Sentiment: {preferences(profile['sentiment'])}
+Budget tier: {preferences(profile['budget_tier'])}
+Revenue tier: {preferences(profile['revenue_tier'])}
+Age category: {preferences(profile['age_category'])}
+Release era: {preferences(profile['era'])}
 
+Favourite movies (pipe-delimited, header row first):
+{format_table(profile['top_movies'], movie_columns)}
+
+Least favourite movies (pipe-delimited, header row first):
+{format_table(profile['bottom_movies'], movie_columns)}
+{candidate_section}
 Generate:
 1. preference_summary: Natural language summary of user's preferences (genres, themes, movie types they like)
 2. top_preferred_genres: List of genres the user prefers most
 3. average_rating_tendency: Whether they rate high/low/neutral on average
-4. recommended_movies: Suggest 3-5 movies they might like based on their preferences (provide movieId and title)
+4. recommended_movies: {recommend_instruction}
 
 Return JSON:
 {{
@@ -150,26 +263,54 @@ Return JSON:
     {{"movieId": 123, "title": "Movie Title", "reasoning": "why recommended"}}
   ]
 }}"""
-    
+
     @staticmethod
     def get_comparison_system_message() -> str:
         return "You are a movie analyst. Return valid JSON with detailed movie comparisons."
     
     @staticmethod
-    def build_comparison_prompt(movies_data: List[Dict]) -> str:
-        movies_json = json.dumps(movies_data, indent=2)
-        return f"""Compare these movies across multiple dimensions.
-
-Movies to Compare:
-{movies_json}
-
+    @traced('prompts.comparison', prompt_chars=len, prompt_tokens_est=estimate_tokens)
+    def build_comparison_prompt(metrics_rows: List[Dict], leaders: Dict, genre_overlap=None) -> str:
+        """
+        Narrative prompt over metrics the Comparator already computed; the LLM
+        explains the numbers instead of working them out. `genre_overlap` is the
+        pairwise Jaccard matrix (a DataFrame indexed by movieId).
+        """
+        movies_table, _ = format_table_within_budget(metrics_rows, COMPARISON_COLUMNS, TOKEN_BUDGETS['comparison'])
+        leader_lines = '\n'.join(
+            f"- {label}: {leader['title']} ({leader['movieId']})" + (f" = {leader['value']}" if 'value' in leader else '')
+            for label, leader in leaders.items()
+        )
+        pairs_section = ''
+        if genre_overlap is not None and len(genre_overlap) > 2:
+            # Only the most and least similar pairs, so the prompt stays small for many movies
+            ids = list(genre_overlap.index)
+            pairs = sorted(
+                ((genre_overlap.iat[i, j], ids[i], ids[j]) for i in range(len(ids)) for j in range(i + 1, len(ids))),
+                reverse=True
+            )
+            shown = pairs[:5] + [p for p in pairs[-3:] if p not in pairs[:5]]
+            pairs_section = "\nGenre overlap (Jaccard, 1 = same genres) for the most and least similar pairs:\n" + '\n'.join(
+                f"- {a} vs {b}: {overlap:.2f}" for overlap, a, b in shown
+            ) + '\n'
+        return f"""Write a comparison of these movies from metrics that have already been computed. Use the numbers as given; do not recompute them.
+
+Movie metrics (pipe-delimited, header row first; budget, revenue in USD; roi = (revenue - budget) / budget;
+runtime in minutes, runtime_delta vs the group median; avg_rating out of 5 with pct_high / pct_low the share of 4+ / 2-or-less ratings;
+weighted_rating is the rating shrunk towards 3.5 for movies with few ratings; overall_rank averages the ROI, revenue and weighted rating ranks;
+empty cells are unknown):
+{movies_table}
+
+Leaders:
+{leader_lines}
+{pairs_section}
 Generate a comprehensive comparison covering:
 1. Budget comparison (which spent more, ROI analysis)
 2. Revenue comparison (box office performance)
 3. Runtime comparison (length differences)
-4. Sentiment/tone comparison (based on overviews)
+4. Sentiment/tone comparison (based on the sentiment column)
 5. Genre differences
-6. Overall assessment (which movie performed better overall and why)
+6. Overall assessment (explain why the movie ranked first overall performed best)
 
 Return JSON:
 {{
@@ -193,6 +334,7 @@ Return JSON:
         return "You are an expert SQL query generator. Your task is to convert natural language requests into SQL queries for a movie database. Always return only the SQL query, and nothing else."
 
     @staticmethod
+    @traced('prompts.query_generation', prompt_chars=len, prompt_tokens_est=estimate_tokens)
     def build_query_generation_prompt(user_query: str) -> str:
         return f"""Generate a SQLite SQL query based on the user's request.
 The database has three tables: `movies`, `ratings`, and `movies_enriched`.
@@ -218,6 +360,8 @@ Table `movies_enriched`:
 - `revenue_tier` (TEXT, 'low', 'medium', or 'high')
 - `production_effectiveness` (TEXT, 'low', 'medium', or 'high')
 - `age_category` (TEXT, 'kid', 'teen', or 'adult')
+- `genre_diversity` (TEXT, 'Single-Genre', 'Multi-Genre', 'Genre-Blend', or 'Unknown')
+- `release_era` (TEXT, 'Classic', '80s-90s', '2000s', 'Modern', or 'Unknown')
 
 Relationships:
 - `movies.movieId` is linked to `ratings.movieId`
@@ -1,60 +1,42 @@
 import pandas as pd
-from llm_client import LLMClient
-from prompts import Prompts
-# Import the specific path and the connection function
-from database import get_db_connection, MOVIES_DB_PATH
+from typing import Optional
+from llm_client import LLMClient, get_llm_client
+from prompts import Prompts, RECOMMENDATION_COLUMNS
+from database import NotFoundError
+from retrieval import CandidateRetriever
+from semantic_index import get_semantic_index
+from tracing import span, traced
 
 class Recommender:
-    def __init__(self):
-        self.llm_client = LLMClient()
+    def __init__(self, llm_client: Optional[LLMClient] = None, candidate_limit: int = 40, semantic_pool: int = 300):
+        self.llm_client = llm_client or get_llm_client()
         self.prompts = Prompts()
+        self.retriever = CandidateRetriever()
+        self.candidate_limit = candidate_limit
+        # Number of nearest movies taken from the semantic index (if built) before ranking
+        self.semantic_pool = semantic_pool
     
-    def get_enriched_movies(self):
-        """
-        Fetches all enriched movies and JOINS them with the original movie
-        data to create a complete dataset for the LLM.
-        """
-        conn = get_db_connection(MOVIES_DB_PATH)
-        
-        # This JOIN query is the key to fixing the recommendation logic.
-        query = """
-            SELECT
-                m.movieId,
-                m.title,
-                m.overview,
-                m.genres,
-                me.sentiment,
-                me.budget_tier,
-                me.revenue_tier,
-                me.production_effectiveness,
-                me.age_category
-            FROM
-                movies AS m
-            JOIN
-                movies_enriched AS me ON m.movieId = me.movieId;
-        """
-        
+    @traced('recommender.recommend')
+    def recommend(self, query):
+        """Generates movie recommendations based on a user query. Raises NotFoundError without enriched candidates."""
+        # Semantic neighbours of the free text query, when the offline index has been built
+        semantic_index = get_semantic_index()
+        semantic_scores = dict(semantic_index.search(query, k=self.semantic_pool)) if semantic_index else None
+
+        # Retrieve only the enriched movies that best match the query's structured constraints
         try:
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            return df
+            candidates, constraints = self.retriever.retrieve(
+                query, limit=self.candidate_limit, semantic_scores=semantic_scores
+            )
         except pd.io.sql.DatabaseError:
-            conn.close()
             print("Error: 'movies_enriched' table not found or query failed. Please run the 'enrich' command first.")
-            return pd.DataFrame()
-
-    def recommend(self, query):
-        """Generates movie recommendations based on a user query."""
-        # Now this function gets the complete, joined data.
-        enriched_movies = self.get_enriched_movies()
-        if enriched_movies.empty:
-            return "No enriched movie data available to generate recommendations."
-
-        # To avoid overwhelming the LLM, let's use a sample of the enriched data
-        if len(enriched_movies) > 200:
-            enriched_movies = enriched_movies.sample(n=200, random_state=1) # Using random_state for reproducibility
+            candidates = pd.DataFrame()
+        if candidates.empty:
+            raise NotFoundError("No enriched movie data available to generate recommendations.")
 
-        movies_data = enriched_movies.to_dict('records')
+        print(f"Retrieved {len(candidates)} candidate movies ({constraints.describe()})")
+        with span('recommender.candidate_records', rows=len(candidates)):
+            movies_data = candidates[RECOMMENDATION_COLUMNS].to_dict('records')
         
         prompt = self.prompts.build_recommendation_prompt(query, movies_data)
         system_message = self.prompts.get_recommendation_system_message()
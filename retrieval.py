@@ -0,0 +1,291 @@
+import re
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from database import get_catalog_connection, RELEASE_YEAR_SQL
+from tracing import traced
+
+# Keyword patterns (regex, matched on word boundaries) for each structured attribute.
+GENRE_KEYWORDS: Dict[str, List[str]] = {
+    "Action": [r"action"],
+    "Adventure": [r"adventures?"],
+    "Animation": [r"animat(ion|ed)", r"cartoons?", r"anime"],
+    "Comedy": [r"comed(y|ies)", r"comedic", r"funny", r"hilarious"],
+    "Crime": [r"crime", r"heists?", r"gangsters?", r"mafia", r"mobsters?"],
+    "Documentary": [r"documentar(y|ies)"],
+    "Drama": [r"dramas?", r"dramatic"],
+    "Family": [r"family"],
+    "Fantasy": [r"fantasy", r"magic(al)?"],
+    "History": [r"histor(y|ical)", r"period pieces?"],
+    "Horror": [r"horror", r"scary", r"slashers?"],
+    "Music": [r"music(al|als)?"],
+    "Mystery": [r"myster(y|ies)", r"whodunn?its?"],
+    "Romance": [r"romance", r"romantic", r"love stor(y|ies)"],
+    "Science Fiction": [r"sci-?fi", r"science fiction", r"space (operas?|movies?|films?|adventures?|epics?)", r"outer space"],
+    "Thriller": [r"thrillers?", r"suspense(ful)?"],
+    "War": [r"war (movies?|films?|dramas?|epics?|stor(y|ies))", r"wartime", r"world war (i|ii|one|two|1|2)"],
+    "Western": [r"westerns?", r"cowboys?"],
+}
+
+SENTIMENT_KEYWORDS: Dict[str, List[str]] = {
+    "positive": [r"positive", r"uplifting", r"feel[- ]good", r"heart-?warming", r"happy", r"optimistic"],
+    "negative": [r"negative", r"dark", r"bleak", r"grim", r"depressing", r"sad"],
+    "neutral": [r"neutral"],
+}
+
+BUDGET_KEYWORDS: Dict[str, List[str]] = {
+    "high": [r"(high|big|large|huge)[- ]budget", r"expensive"],
+    "medium": [r"(medium|mid|moderate)[- ]budget"],
+    "low": [r"(low|small|tiny|micro)[- ]budget", r"indie", r"independent"],
+}
+
+REVENUE_KEYWORDS: Dict[str, List[str]] = {
+    "high": [r"(high|big|huge)[- ](revenue|grossing|earning)", r"blockbusters?", r"box[- ]office (hits?|success(es)?)", r"(commercial|financial) success"],
+    "medium": [r"(medium|mid|moderate)[- ](revenue|grossing)"],
+    "low": [r"(low|small)[- ](revenue|grossing)", r"box[- ]office (flops?|bombs?)", r"flops?"],
+}
+
+EFFECTIVENESS_KEYWORDS: Dict[str, List[str]] = {
+    "high": [r"profitable", r"(cost[- ])?effective", r"efficient", r"good (roi|return)"],
+    "low": [r"unprofitable", r"(money[- ])?losing", r"ineffective"],
+}
+
+AGE_KEYWORDS: Dict[str, List[str]] = {
+    "kid": [r"kids?", r"child(ren)?", r"family[- ]friendly", r"young children"],
+    "teen": [r"teens?", r"teenagers?", r"young adults?"],
+    "adult": [r"adults?", r"mature", r"r-rated", r"grown[- ]ups?"],
+}
+
+# Words that make an era adjective refer to the movies ("old movies", not "a 10 year old")
+_FILM_NOUNS = r"(movies?|films?|releases?|pictures?|cinema)"
+
+# Named eras as inclusive (start_year, end_year) ranges; None means open-ended.
+# Single words such as "old" or "new" only count next to a film noun, so
+# "movies set in New York" or "for a 10 year old" do not become year filters.
+ERA_KEYWORDS: List[Tuple[str, Tuple[Optional[int], Optional[int]]]] = [
+    (r"(19)?50'?s|fifties", (1950, 1959)),
+    (r"(19)?60'?s|sixties", (1960, 1969)),
+    (r"(19)?70'?s|seventies", (1970, 1979)),
+    (r"(19)?80'?s|eighties", (1980, 1989)),
+    (r"(19)?90'?s|nineties", (1990, 1999)),
+    (r"2000'?s|noughties", (2000, 2009)),
+    (r"2010'?s", (2010, 2019)),
+    (rf"classics|(classic|old(er)?|vintage) {_FILM_NOUNS}|golden age", (None, 1979)),
+    (rf"(recent|modern|new(er)?|latest|contemporary) {_FILM_NOUNS}|recently released", (2010, None)),
+]
+
+def _matches(text: str, patterns: List[str]) -> bool:
+    return any(re.search(rf"\b{pattern}\b", text) for pattern in patterns)
+
+def _first_match(text: str, keyword_map: Dict[str, List[str]]) -> Optional[str]:
+    for value, patterns in keyword_map.items():
+        if _matches(text, patterns):
+            return value
+    return None
+
+@dataclass
+class QueryConstraints:
+    """Structured constraints extracted from a natural language recommendation query."""
+    genres: List[str] = field(default_factory=list)
+    sentiment: Optional[str] = None
+    budget_tier: Optional[str] = None
+    revenue_tier: Optional[str] = None
+    production_effectiveness: Optional[str] = None
+    age_category: Optional[str] = None
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        return not any([
+            self.genres, self.sentiment, self.budget_tier, self.revenue_tier,
+            self.production_effectiveness, self.age_category,
+            self.min_year is not None, self.max_year is not None,
+        ])
+
+    def describe(self) -> str:
+        parts = []
+        if self.genres:
+            parts.append(f"genres={'/'.join(self.genres)}")
+        for name in ['sentiment', 'budget_tier', 'revenue_tier', 'production_effectiveness', 'age_category']:
+            if getattr(self, name):
+                parts.append(f"{name}={getattr(self, name)}")
+        if self.min_year is not None or self.max_year is not None:
+            parts.append(f"years={self.min_year or ''}-{self.max_year or ''}")
+        return ', '.join(parts) if parts else 'no structured constraints'
+
+def parse_query(query: str) -> QueryConstraints:
+    """Extracts genre, sentiment, tier, age and era constraints from a free text query."""
+    text = query.lower()
+    constraints = QueryConstraints()
+    constraints.genres = [genre for genre, patterns in GENRE_KEYWORDS.items() if _matches(text, patterns)]
+    constraints.sentiment = _first_match(text, SENTIMENT_KEYWORDS)
+    constraints.budget_tier = _first_match(text, BUDGET_KEYWORDS)
+    constraints.revenue_tier = _first_match(text, REVENUE_KEYWORDS)
+    constraints.production_effectiveness = _first_match(text, EFFECTIVENESS_KEYWORDS)
+    constraints.age_category = _first_match(text, AGE_KEYWORDS)
+
+    # Explicit years take precedence over named eras
+    after = re.search(r"\b(after|since|from)\s+((?:19|20)\d{2})\b", text)
+    before = re.search(r"\b(before|until|prior to)\s+((?:19|20)\d{2})\b", text)
+    if after:
+        constraints.min_year = int(after.group(2)) + (1 if after.group(1) == 'after' else 0)
+    if before:
+        constraints.max_year = int(before.group(2)) - (1 if before.group(1) != 'until' else 0)
+    if not after and not before:
+        for pattern, (start, end) in ERA_KEYWORDS:
+            if re.search(rf"\b({pattern})\b", text):
+                constraints.min_year, constraints.max_year = start, end
+                break
+    return constraints
+
+class CandidateRetriever:
+    """
+    Turns query constraints into an indexed SQL filter over movies joined with
+    movies_enriched and ranks the matches, so only the most relevant movies
+    reach the LLM prompt.
+    """
+
+    # Prior for the Bayesian average: a movie is treated as having this many
+    # extra ratings at the global mean, so a handful of 5-star votes does not
+    # outrank a well-rated classic.
+    RATING_PRIOR_COUNT = 10
+    RATING_PRIOR_MEAN = 3.5
+
+    # How much a perfect semantic match counts relative to one satisfied constraint
+    SEMANTIC_WEIGHT = 2.0
+
+    def _conditions(self, constraints: QueryConstraints) -> List[Tuple[str, List]]:
+        """One (sql, params) pair per constraint, each testing a single attribute."""
+        conditions = []
+        if constraints.genres:
+            genre_sql = ' OR '.join(["m.genres LIKE ?"] * len(constraints.genres))
+            conditions.append((f"({genre_sql})", [f"%{genre}%" for genre in constraints.genres]))
+        for column in ['sentiment', 'budget_tier', 'revenue_tier', 'production_effectiveness', 'age_category']:
+            value = getattr(constraints, column)
+            if value:
+                conditions.append((f"me.{column} = ?", [value]))
+        release_year = RELEASE_YEAR_SQL.format(alias='m.')
+        if constraints.min_year is not None:
+            conditions.append((f"{release_year} >= ?", [constraints.min_year]))
+        if constraints.max_year is not None:
+            conditions.append((f"{release_year} <= ?", [constraints.max_year]))
+        return conditions
+
+    @traced('retrieval.query', rows=len)
+    def _query(
+        self,
+        conditions: List[Tuple[str, List]],
+        strict: Optional[bool],
+        limit: int,
+        movie_ids: Optional[List[int]] = None
+    ) -> pd.DataFrame:
+        """
+        strict=True requires every condition, strict=False any of them, and
+        strict=None only scores the conditions without filtering on them.
+        """
+        params: List = []
+        filters = []
+        if conditions:
+            score_sql = ' + '.join(f"(CASE WHEN {sql} THEN 1 ELSE 0 END)" for sql, _ in conditions)
+            for _, condition_params in conditions:
+                params.extend(condition_params)
+            if strict is not None:
+                joiner = ' AND ' if strict else ' OR '
+                filters.append('(' + joiner.join(sql for sql, _ in conditions) + ')')
+                for _, condition_params in conditions:
+                    params.extend(condition_params)
+        else:
+            score_sql = '0'
+        if movie_ids is not None:
+            filters.append(f"m.movieId IN ({','.join(['?'] * len(movie_ids))})")
+            params.extend(int(m) for m in movie_ids)
+        where_sql = ('WHERE ' + ' AND '.join(filters)) if filters else ''
+
+        query = f"""
+            SELECT
+                m.movieId,
+                m.title,
+                m.overview,
+                m.genres,
+                m.releaseDate,
+                me.sentiment,
+                me.budget_tier,
+                me.revenue_tier,
+                me.production_effectiveness,
+                me.age_category,
+                COALESCE(s.rating_mean, 0) AS avg_rating,
+                COALESCE(s.rating_count, 0) AS rating_count,
+                {score_sql} AS match_score,
+                (COALESCE(s.rating_sum, 0) + {self.RATING_PRIOR_MEAN * self.RATING_PRIOR_COUNT})
+                    / (COALESCE(s.rating_count, 0) + {self.RATING_PRIOR_COUNT}) AS weighted_rating
+            FROM movies_enriched AS me
+            JOIN movies AS m ON m.movieId = me.movieId
+            LEFT JOIN ratings_db.movie_rating_stats AS s ON s.movieId = m.movieId
+            {where_sql}
+            ORDER BY match_score DESC, weighted_rating DESC, m.revenue DESC
+            LIMIT ?
+        """
+        params.append(limit)
+        return pd.read_sql_query(query, get_catalog_connection(), params=tuple(params))
+
+    @traced('retrieval.retrieve', rows=lambda result: len(result[0]))
+    def retrieve(
+        self,
+        query: str,
+        limit: int = 40,
+        semantic_scores: Optional[Dict[int, float]] = None
+    ) -> Tuple[pd.DataFrame, QueryConstraints]:
+        """
+        Returns the top `limit` candidates for a query and the constraints used.
+        Movies matching every constraint come first; if there are not enough, the
+        filter is relaxed to movies matching any constraint, ranked by how many match.
+
+        When `semantic_scores` ({movieId: similarity} from the semantic index) are
+        given, those movies are ranked first by constraint matches plus weighted
+        similarity, and structured results fill any remaining slots.
+        """
+        constraints = parse_query(query)
+        conditions = self._conditions(constraints)
+
+        semantic_candidates = pd.DataFrame()
+        if semantic_scores:
+            semantic_candidates = self._query(conditions, strict=None, limit=len(semantic_scores), movie_ids=list(semantic_scores))
+            if not semantic_candidates.empty:
+                best = max(semantic_scores.values())
+                semantic_candidates['semantic_score'] = semantic_candidates['movieId'].map(semantic_scores) / best
+                semantic_candidates['relevance'] = semantic_candidates['match_score'] + self.SEMANTIC_WEIGHT * semantic_candidates['semantic_score']
+                semantic_candidates = semantic_candidates.sort_values(
+                    ['relevance', 'weighted_rating'], ascending=False
+                ).head(limit)
+                if len(semantic_candidates) >= limit:
+                    return semantic_candidates.reset_index(drop=True), constraints
+
+        candidates = self._query(conditions, strict=True, limit=limit)
+        if conditions and len(candidates) < limit:
+            candidates = self._query(conditions, strict=False, limit=limit)
+        if not semantic_candidates.empty:
+            extra = candidates[~candidates['movieId'].isin(semantic_candidates['movieId'])]
+            candidates = pd.concat([semantic_candidates, extra], ignore_index=True).head(limit)
+        return candidates, constraints
+
+if __name__ == '__main__':
+    # Quick checks of the query parser: ordinary words must not turn into hard filters
+    checks = [
+        ("movies set in New York", QueryConstraints()),
+        ("something for a 10 year old", QueryConstraints()),
+        ("a space heist", QueryConstraints(genres=['Crime'])),
+        ("mob comedy", QueryConstraints(genres=['Comedy'])),
+        ("a war of wits between two lawyers", QueryConstraints()),
+        ("old movies with a mobster", QueryConstraints(genres=['Crime'], max_year=1979)),
+        ("classic films", QueryConstraints(max_year=1979)),
+        ("recent releases about space opera", QueryConstraints(genres=['Science Fiction'], min_year=2010)),
+        ("a war movie from the 80s", QueryConstraints(genres=['War'], min_year=1980, max_year=1989)),
+        ("uplifting space adventure", QueryConstraints(genres=['Adventure', 'Science Fiction'], sentiment='positive')),
+    ]
+    failures = 0
+    for query, expected in checks:
+        parsed = parse_query(query)
+        failures += parsed != expected
+        print(f"{'ok  ' if parsed == expected else 'FAIL'} {query!r}: {parsed.describe()}")
+    if failures:
+        raise SystemExit(f"{failures} parse_query check(s) failed")
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import math
+import time
+import zlib
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+from database import get_read_connection, parse_genres, MOVIES_DB_PATH
+from tracing import traced
+
+SEMANTIC_INDEX_DIR = os.getenv("SEMANTIC_INDEX_DIR", "db/semantic_index")
+DEFAULT_DIM = 512
+
+# Fields are repeated to weight them: a title or genre hit counts more than an overview word.
+TITLE_WEIGHT = 2
+GENRE_WEIGHT = 2
+
+STOPWORDS = set("""
+a an and are as at be but by for from has have he her his in into is it its of on or
+she that the their them they this to was were who will with about after all also
+when where which while movie movies film films
+""".split())
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word unigrams and bigrams, without stopwords."""
+    words = [w for w in TOKEN_RE.findall(text.lower()) if w not in STOPWORDS]
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+def _movie_tokens(title, overview, genres) -> List[str]:
+    tokens = tokenize(title or '') * TITLE_WEIGHT
+    tokens += tokenize(overview or '')
+    genre_text = ' '.join(parse_genres(genres))
+    tokens += tokenize(genre_text) * GENRE_WEIGHT
+    return tokens
+
+def _hash_token(token: str, dim: int) -> Tuple[int, float]:
+    """Stable feature hashing: bucket from the low bits, sign from the next bit."""
+    h = zlib.crc32(token.encode('utf-8'))
+    return h % dim, (1.0 if (h // dim) & 1 else -1.0)
+
+def _bucket_counts(tokens: List[str], dim: int) -> Dict[int, float]:
+    """Signed term frequencies per hash bucket."""
+    counts: Dict[int, float] = {}
+    for token, tf in Counter(tokens).items():
+        bucket, sign = _hash_token(token, dim)
+        counts[bucket] = counts.get(bucket, 0.0) + sign * (1.0 + math.log(tf))
+    return counts
+
+class SemanticIndex:
+    """
+    An offline TF-IDF index over movie title, overview and genres using hashed
+    word n-grams. Vectors are L2-normalized rows of a float32 matrix saved as
+    .npy and memory-mapped at query time; a search is one matrix-vector product.
+    """
+
+    def __init__(self, vectors: np.ndarray, movie_ids: np.ndarray, idf: np.ndarray):
+        self.vectors = vectors
+        self.movie_ids = movie_ids
+        self.idf = idf
+        self.dim = vectors.shape[1]
+
+    @staticmethod
+    def _iter_movies() -> Iterator[Tuple]:
+        cursor = get_read_connection(MOVIES_DB_PATH).execute(
+            "SELECT movieId, title, overview, genres FROM movies ORDER BY movieId"
+        )
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            yield from rows
+
+    @classmethod
+    def build(cls, index_dir: str = SEMANTIC_INDEX_DIR, dim: int = DEFAULT_DIM) -> 'SemanticIndex':
+        """
+        Builds the index from the movies table in two streaming passes (document
+        frequencies, then vectors written straight into the memory-mapped matrix).
+        """
+        start = time.perf_counter()
+        os.makedirs(index_dir, exist_ok=True)
+
+        # Pass 1: document frequency of every hash bucket
+        doc_freq = np.zeros(dim, dtype=np.float64)
+        count = 0
+        for _, title, overview, genres in cls._iter_movies():
+            buckets = list(_bucket_counts(_movie_tokens(title, overview, genres), dim))
+            doc_freq[buckets] += 1
+            count += 1
+        idf = (np.log((count + 1) / (doc_freq + 1)) + 1.0).astype(np.float32)
+
+        # Pass 2: weighted, normalized vectors
+        vectors = np.lib.format.open_memmap(
+            os.path.join(index_dir, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(count, dim)
+        )
+        movie_ids = np.zeros(count, dtype=np.int64)
+        for row_num, (movie_id, title, overview, genres) in enumerate(cls._iter_movies()):
+            if row_num >= count:
+                break
+            counts = _bucket_counts(_movie_tokens(title, overview, genres), dim)
+            if counts:
+                buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+                weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * idf[buckets]
+                norm = np.linalg.norm(weights)
+                if norm > 0:
+                    vectors[row_num, buckets] = weights / norm
+            movie_ids[row_num] = movie_id
+        vectors.flush()
+        del vectors
+
+        np.save(os.path.join(index_dir, 'movie_ids.npy'), movie_ids)
+        np.save(os.path.join(index_dir, 'idf.npy'), idf)
+        with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+            json.dump({'dim': dim, 'count': count, 'built_at': time.time(), 'source': MOVIES_DB_PATH}, f)
+
+        print(f"Built semantic index over {count} movies ({dim} dims) in {time.perf_counter() - start:.1f}s -> {index_dir}")
+        return cls.load(index_dir)
+
+    @classmethod
+    def exists(cls, index_dir: str = SEMANTIC_INDEX_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, 'meta.json'))
+
+    @classmethod
+    def load(cls, index_dir: str = SEMANTIC_INDEX_DIR) -> 'SemanticIndex':
+        """Memory-maps a previously built index."""
+        vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r')
+        movie_ids = np.load(os.path.join(index_dir, 'movie_ids.npy'))
+        idf = np.load(os.path.join(index_dir, 'idf.npy'))
+        return cls(vectors, movie_ids, idf)
+
+    def vectorize(self, text: str) -> np.ndarray:
+        query = np.zeros(self.dim, dtype=np.float32)
+        for bucket, weight in _bucket_counts(tokenize(text), self.dim).items():
+            query[bucket] += weight * self.idf[bucket]
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    @traced('semantic.search', rows=len)
+    def search(self, text: str, k: int = 10) -> List[Tuple[int, float]]:
+        """Returns up to k (movieId, cosine score) pairs, best first."""
+        query = self.vectorize(text)
+        if not query.any() or len(self.movie_ids) == 0:
+            return []
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.movie_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+_loaded_index: Optional[SemanticIndex] = None
+
+def get_semantic_index() -> Optional[SemanticIndex]:
+    """Returns the on-disk index (loaded once per process), or None if it has not been built."""
+    global _loaded_index
+    if _loaded_index is None and SemanticIndex.exists():
+        _loaded_index = SemanticIndex.load()
+    return _loaded_index
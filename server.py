@@ -0,0 +1,163 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+import database as db
+
+# POST endpoints and the batch task type each one runs (see batch_runner.TASK_FIELDS), e.g.
+#   POST /recommend  {"query": "uplifting space adventure"}
+#   POST /summarize  {"user_id": 7}
+#   POST /compare    {"movie_ids": [1, 2, 3], "no_llm": true}
+TASK_ENDPOINTS = {'/recommend': 'recommend', '/summarize': 'summarize', '/compare': 'compare'}
+
+# HTTP status of a failed task result, by its error_type (anything else is a 500)
+ERROR_STATUS = {'invalid': 400, 'not_found': 404}
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1024 * 1024
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands each connection to a fixed pool of worker threads
+    instead of starting a thread per request. Worker threads live as long as
+    the server, so the per-thread SQLite read connections (and their statement
+    caches) stay open between requests, and at most `workers` requests run at once.
+    """
+
+    def __init__(self, address: Tuple[str, int], handler, workers: int = 8):
+        # Created first: a failed bind calls server_close() from inside HTTPServer.__init__
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='serve')
+        super().__init__(address, handler)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+class MovieService:
+    """
+    The warm state shared by every request: one BatchRunner (so one LLM client,
+    Recommender, Summarizer and Comparator), the semantic and similarity indexes,
+    and request counters.
+    """
+
+    def __init__(self):
+        from batch_runner import BatchRunner
+        from job_queue import EnrichmentJobQueue
+        from semantic_index import get_semantic_index
+        from similarity import get_similarity_index
+        start = time.perf_counter()
+        self.runner = BatchRunner()
+        self.job_queue = EnrichmentJobQueue()
+        self.indexes = {
+            'semantic': get_semantic_index() is not None,
+            'similarity': get_similarity_index() is not None,
+        }
+        self.started_at = time.time()
+        self.counts = {'ok': 0, 'error': 0}
+        self._lock = threading.Lock()
+        print(f"Service ready in {time.perf_counter() - start:.1f}s (indexes loaded: {self.indexes})")
+
+    def run_task(self, task: Dict) -> Dict:
+        result = self.runner.run_task(task)
+        with self._lock:
+            self.counts[result['status']] += 1
+        return result
+
+    def health(self) -> Dict:
+        with self._lock:
+            counts = dict(self.counts)
+        return {'status': 'ok', 'uptime': round(time.time() - self.started_at, 1), 'requests': counts, 'indexes': self.indexes}
+
+    def enrich_status(self) -> Dict:
+        """Enrichment progress: movies still pending LLM attributes and the job queue counts."""
+        return {
+            'pending': {scope: db.count_pending_enrichment(scope) for scope in db.PENDING_SCOPES},
+            'enriched': db.count_enriched_movies(),
+            'jobs': self.job_queue.status_counts(),
+        }
+
+class MovieRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over a MovieService; set `service` on the class before serving."""
+
+    service: Optional[MovieService] = None
+    # Keep-alive, but an idle connection is dropped after `timeout` seconds so it cannot hold a worker thread
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length < 0:
+            raise ValueError(f"Invalid Content-Length {length}")
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Request body over {MAX_BODY_BYTES} bytes")
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        try:
+            if path == '/health':
+                self._send_json(200, self.service.health())
+            elif path == '/enrich-status':
+                self._send_json(200, self.service.enrich_status())
+            else:
+                self._send_json(404, {'error': f"Unknown endpoint {path}"})
+        except Exception as e:
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def do_POST(self):
+        from batch_runner import validate_task
+        path = urlparse(self.path).path
+        if path not in TASK_ENDPOINTS:
+            self._send_json(404, {'error': f"Unknown endpoint {path}"})
+            return
+        try:
+            task = {**self._read_json(), 'type': TASK_ENDPOINTS[path]}
+            validate_task(task)
+        except ValueError as e:  # includes malformed JSON
+            self.close_connection = True
+            self._send_json(400, {'error': str(e)})
+            return
+        result = self.service.run_task(task)
+        status = 200 if result['status'] == 'ok' else ERROR_STATUS.get(result.get('error_type'), 500)
+        self._send_json(status, result)
+
+    def log_message(self, format, *args):
+        print(f"[{self.log_date_time_string()}] {self.address_string()} {format % args}")
+
+def serve(host: str = '127.0.0.1', port: int = 8000, workers: int = 8):
+    """Loads the service once and serves requests until interrupted."""
+    MovieRequestHandler.service = MovieService()
+    server = PooledHTTPServer((host, port), MovieRequestHandler, workers=workers)
+    print(f"Serving on http://{host}:{port} with {workers} worker thread(s) "
+          f"(POST {', '.join(TASK_ENDPOINTS)}; GET /enrich-status, /health). Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.server_close()
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from database import get_read_connection, RATINGS_DB_PATH
+from tracing import traced
+
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "db/similarity_index")
+DEFAULT_NEIGHBORS = 50
+
+# Similarities backed by few common raters are shrunk by common / (common + SHRINKAGE)
+SHRINKAGE = 10
+# Pairs with fewer common raters than this are not neighbours at all
+MIN_COMMON_RATERS = 3
+# Items per block when multiplying the rating matrix, at most BLOCK_SIZE and fewer when there are
+# many items, so a block's dense BLOCK_SIZE x items products stay under MAX_BLOCK_CELLS cells
+# (each float32 copy of a block is then at most 16 MB, e.g. 64 rows at 62k items)
+BLOCK_SIZE = 1000
+MAX_BLOCK_CELLS = 4_000_000
+
+def _load_ratings() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    cursor = get_read_connection(RATINGS_DB_PATH).execute("SELECT userId, movieId, rating FROM ratings")
+    users, movies, ratings = [], [], []
+    while True:
+        rows = cursor.fetchmany(50000)
+        if not rows:
+            break
+        for user_id, movie_id, rating in rows:
+            users.append(user_id)
+            movies.append(movie_id)
+            ratings.append(rating)
+    return np.array(users, dtype=np.int64), np.array(movies, dtype=np.int64), np.array(ratings, dtype=np.float32)
+
+class SimilarityIndex:
+    """
+    An offline item-item collaborative filtering index over the ratings table.
+    Similarity is the adjusted cosine (ratings centred on each user's mean) of
+    two movies' rating vectors, shrunk when few users rated both. Only the
+    top-K neighbours of each movie are kept, as two .npy matrices that are
+    memory-mapped at query time.
+    """
+
+    def __init__(self, movie_ids: np.ndarray, neighbors: np.ndarray, scores: np.ndarray):
+        self.movie_ids = movie_ids
+        self.neighbors = neighbors
+        self.scores = scores
+        self.position = {int(movie_id): i for i, movie_id in enumerate(movie_ids)}
+
+    @classmethod
+    def build(cls, index_dir: str = SIMILARITY_INDEX_DIR, k: int = DEFAULT_NEIGHBORS) -> 'SimilarityIndex':
+        """Builds the index from the ratings table, one block of movies at a time."""
+        from scipy import sparse
+        start = time.perf_counter()
+        os.makedirs(index_dir, exist_ok=True)
+
+        users, movies, ratings = _load_ratings()
+        movie_ids, item_idx = np.unique(movies, return_inverse=True)
+        _, user_idx = np.unique(users, return_inverse=True)
+        n_items, n_users = len(movie_ids), int(user_idx.max()) + 1 if len(user_idx) else 0
+
+        # Adjusted cosine: centre each rating on its user's mean, then L2-normalize each movie's row
+        user_means = np.bincount(user_idx, weights=ratings) / np.maximum(np.bincount(user_idx), 1)
+        centred = (ratings - user_means[user_idx]).astype(np.float32)
+        matrix = sparse.csr_matrix((centred, (item_idx, user_idx)), shape=(n_items, n_users))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        matrix = sparse.diags(1.0 / np.where(norms > 0, norms, 1.0)).astype(np.float32) @ matrix
+        raters = sparse.csr_matrix((np.ones_like(centred), (item_idx, user_idx)), shape=(n_items, n_users))
+
+        k = min(k, max(n_items - 1, 1))
+        neighbors = np.full((n_items, k), -1, dtype=np.int32)
+        scores = np.zeros((n_items, k), dtype=np.float32)
+        block_size = max(1, min(BLOCK_SIZE, MAX_BLOCK_CELLS // max(n_items, 1)))
+        # Transposed once, in the row format the products convert to
+        matrix_t, raters_t = matrix.T.tocsr(), raters.T.tocsr()
+        for block_start in range(0, n_items, block_size):
+            block = slice(block_start, min(block_start + block_size, n_items))
+            similarity = (matrix[block] @ matrix_t).toarray()
+            common = (raters[block] @ raters_t).toarray()
+            similarity *= common / (common + SHRINKAGE)
+            similarity[common < MIN_COMMON_RATERS] = 0
+            rows = np.arange(similarity.shape[0])
+            similarity[rows, rows + block_start] = 0  # a movie is not its own neighbour
+
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            neighbors[block] = np.where(top_scores > 0, top, -1)
+            scores[block] = np.maximum(top_scores, 0)
+
+        np.save(os.path.join(index_dir, 'movie_ids.npy'), movie_ids)
+        np.save(os.path.join(index_dir, 'neighbors.npy'), neighbors)
+        np.save(os.path.join(index_dir, 'scores.npy'), scores)
+        with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+            json.dump({'k': k, 'movies': n_items, 'users': n_users, 'ratings': len(ratings), 'built_at': time.time()}, f)
+
+        print(f"Built similarity index over {n_items} movies from {len(ratings)} ratings "
+              f"(top {k} neighbours) in {time.perf_counter() - start:.1f}s -> {index_dir}")
+        return cls.load(index_dir)
+
+    @classmethod
+    def exists(cls, index_dir: str = SIMILARITY_INDEX_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, 'meta.json'))
+
+    @classmethod
+    def load(cls, index_dir: str = SIMILARITY_INDEX_DIR) -> 'SimilarityIndex':
+        """Memory-maps a previously built index."""
+        movie_ids = np.load(os.path.join(index_dir, 'movie_ids.npy'))
+        neighbors = np.load(os.path.join(index_dir, 'neighbors.npy'), mmap_mode='r')
+        scores = np.load(os.path.join(index_dir, 'scores.npy'), mmap_mode='r')
+        return cls(movie_ids, neighbors, scores)
+
+    @traced('similarity.similar', rows=len)
+    def similar(self, movie_id: int, k: int = 10) -> List[Tuple[int, float]]:
+        """Returns up to k (movieId, similarity) pairs for the movie, most similar first."""
+        i = self.position.get(int(movie_id))
+        if i is None:
+            return []
+        neighbors, scores = self.neighbors[i], self.scores[i]
+        return [(int(self.movie_ids[n]), float(s)) for n, s in zip(neighbors[:k], scores[:k]) if n >= 0]
+
+    def recommend(self, user_ratings: Dict[int, float], k: int = 20) -> List[Tuple[int, float]]:
+        """
+        Scores unrated movies for a user from the neighbours of the movies they
+        rated: each neighbour gets similarity x (rating - the user's mean rating),
+        summed over the user's movies, so liked movies pull their neighbours up
+        and disliked ones push theirs down. Returns the top k (movieId, score).
+        """
+        rated = [(self.position[m], r) for m, r in user_ratings.items() if m in self.position]
+        if not rated:
+            return []
+        positions = np.array([p for p, _ in rated])
+        deviations = np.array([r for _, r in rated], dtype=np.float32)
+        deviations -= np.mean(list(user_ratings.values()))
+
+        neighbors = np.asarray(self.neighbors[positions])
+        weights = np.asarray(self.scores[positions]) * deviations[:, None]
+        valid = neighbors >= 0
+        totals = np.zeros(len(self.movie_ids), dtype=np.float32)
+        np.add.at(totals, neighbors[valid], weights[valid])
+        totals[positions] = 0  # already rated
+
+        k = min(k, int((totals > 0).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return [(int(self.movie_ids[i]), float(totals[i])) for i in top]
+
+_loaded_index: Optional[SimilarityIndex] = None
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """Returns the on-disk index (loaded once per process), or None if it has not been built."""
+    global _loaded_index
+    if _loaded_index is None and SimilarityIndex.exists():
+        _loaded_index = SimilarityIndex.load()
+    return _loaded_index
+
+@traced('similarity.candidates_for_user', rows=len)
+def candidates_for_user(user_id: int, k: int = 20) -> List[Tuple[int, float]]:
+    """Candidate movies for a user from the similarity index, or [] if it has not been built."""
+    index = get_similarity_index()
+    if index is None:
+        return []
+    rows = get_read_connection(RATINGS_DB_PATH).execute(
+        "SELECT movieId, rating FROM ratings WHERE userId = ?", (int(user_id),)
+    ).fetchall()
+    return index.recommend({row[0]: row[1] for row in rows}, k=k)
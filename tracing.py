@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import threading
+import functools
+import contextvars
+from typing import Callable, Dict, List, Optional
+
+# Lightweight per-stage spans for --profile. Code marks a stage with
+#
+#     with span('db.get_movies_by_ids', rows=len(ids)) as s:
+#         ...
+#         s.set(prompt_tokens=123)
+#
+# or decorates a function with @traced('prompts.recommendation', chars=len).
+# Tracing is off unless tracer.enable() is called; a disabled span costs one
+# attribute check. Spans nest per thread (and per asyncio task) through a
+# context variable, so a parent's self time excludes its children.
+
+# Spans kept per run; later ones are counted but dropped so a long `serve` cannot grow without bound
+MAX_SPANS = 200000
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'child_time', 'parent', 'thread_id', 'thread_name')
+
+    def __init__(self, name: str, attrs: Dict, parent: Optional['Span']):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.child_time = 0.0
+        thread = threading.current_thread()
+        self.thread_id, self.thread_name = thread.ident, thread.name
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+class _NullSpan:
+    """Returned by span() while tracing is off: accepts the same calls and records nothing."""
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _SpanContext:
+    __slots__ = ('tracer', 'name', 'attrs', 'span', 'token')
+
+    def __init__(self, tracer: 'Tracer', name: str, attrs: Dict):
+        self.tracer, self.name, self.attrs = tracer, name, attrs
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.name, self.attrs, _current_span.get())
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.end = time.perf_counter()
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            span.attrs['error'] = exc_type.__name__
+        if span.parent is not None:
+            span.parent.child_time += span.end - span.start
+        self.tracer._record(span)
+        return False
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.started_at = time.perf_counter()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Starts recording spans (and clears any recorded before)."""
+        with self._lock:
+            self.spans, self.dropped = [], 0
+        self.started_at = time.perf_counter()
+        self.enabled = True
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _SpanContext(self, name, attrs)
+
+    def _record(self, span: Span):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def summary(self) -> List[Dict]:
+        """
+        Per span name: calls, total/self/mean/max seconds and the sum of each
+        numeric attribute, largest total first.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        stats: Dict[str, Dict] = {}
+        for span in spans:
+            entry = stats.setdefault(span.name, {'name': span.name, 'calls': 0, 'total': 0.0, 'self': 0.0, 'max': 0.0, 'attrs': {}})
+            duration = span.end - span.start
+            entry['calls'] += 1
+            entry['total'] += duration
+            entry['self'] += max(0.0, duration - span.child_time)
+            entry['max'] = max(entry['max'], duration)
+            for key, value in span.attrs.items():
+                if key == 'error':
+                    entry['attrs']['errors'] = entry['attrs'].get('errors', 0) + 1
+                elif isinstance(value, (int, float)):
+                    entry['attrs'][key] = entry['attrs'].get(key, 0) + value
+        for entry in stats.values():
+            entry['mean'] = entry['total'] / entry['calls']
+        return sorted(stats.values(), key=lambda entry: entry['total'], reverse=True)
+
+    def print_report(self):
+        wall = time.perf_counter() - self.started_at
+        summary = self.summary()
+        print(f"\nProfile: {wall * 1000:.1f} ms wall, {sum(e['calls'] for e in summary)} span(s)"
+              f"{f' ({self.dropped} dropped)' if self.dropped else ''}. Times in ms; self excludes child spans "
+              f"(so a command's self time is mostly module imports, see --startup-profile). "
+              f"Spans on worker threads overlap, so totals can exceed the wall time.")
+        print(f"  {'span':<36} {'calls':>6} {'total':>10} {'self':>10} {'mean':>9} {'max':>9}  attributes")
+        for entry in summary:
+            attrs = ' '.join(f"{key}={value:,.0f}" for key, value in sorted(entry['attrs'].items()))
+            print(f"  {entry['name']:<36} {entry['calls']:>6} {entry['total'] * 1000:>10.1f} {entry['self'] * 1000:>10.1f} "
+                  f"{entry['mean'] * 1000:>9.1f} {entry['max'] * 1000:>9.1f}  {attrs}")
+
+    def write_chrome_trace(self, path: str) -> int:
+        """
+        Writes the spans in Chrome trace event format (open in chrome://tracing
+        or https://ui.perfetto.dev). Returns the number of spans written.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}}
+            for thread_id, thread_name in {(s.thread_id, s.thread_name) for s in spans}
+        ]
+        for span in spans:
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.')[0],
+                'ph': 'X',
+                'ts': round((span.start - self.started_at) * 1e6, 1),
+                'dur': round((span.end - span.start) * 1e6, 1),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': span.attrs,
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+        return len(spans)
+
+tracer = Tracer()
+
+def span(name: str, **attrs):
+    """Context manager timing one stage; see the module comment."""
+    return tracer.span(name, **attrs)
+
+def traced(name: str, **result_attrs: Callable):
+    """
+    Decorator running the function in a span. Each keyword maps an attribute
+    name to a function of the return value, e.g. @traced('db.get_movies_by_ids', rows=len).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name) as s:
+                result = func(*args, **kwargs)
+                for attr, measure in result_attrs.items():
+                    try:
+                        s.attrs[attr] = measure(result)
+                    except TypeError:  # e.g. len(None) for a "not found" result
+                        pass
+                return result
+        return wrapper
+    return decorator
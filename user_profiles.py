@@ -0,0 +1,203 @@
+import json
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+import database as db
+from tracing import traced
+
+# Number of favourite and least favourite movies kept per profile
+PROFILE_TOP_MOVIES = 8
+# Ratings-equivalent prior that shrinks preference weights backed by only a few ratings towards 0
+PREFERENCE_PRIOR = 2
+# Enrichment attributes summarized as preferences, plus the release decade ('era')
+PREFERENCE_COLUMNS = ['sentiment', 'budget_tier', 'revenue_tier', 'age_category', 'era']
+
+_ALL_RATINGS_QUERY = """
+    SELECT
+        r.userId,
+        r.movieId,
+        r.rating,
+        r.timestamp,
+        m.title,
+        m.genres,
+        m.releaseDate,
+        me.sentiment,
+        me.budget_tier,
+        me.revenue_tier,
+        me.age_category
+    FROM ratings_db.ratings AS r
+    JOIN movies AS m ON m.movieId = r.movieId
+    LEFT JOIN movies_enriched AS me ON me.movieId = r.movieId
+"""
+
+def _preference_weights(rows: pd.DataFrame, column: str) -> Dict[int, Dict[str, Dict]]:
+    """
+    Per user and value of `column`: how far above or below their own mean the
+    user rates movies with that value (shrunk by PREFERENCE_PRIOR), and how many
+    ratings back it.
+    """
+    grouped = rows.dropna(subset=[column]).groupby(['userId', column])['deviation'].agg(['sum', 'count'])
+    grouped['weight'] = grouped['sum'] / (grouped['count'] + PREFERENCE_PRIOR)
+    result: Dict[int, Dict[str, Dict]] = {}
+    for (user_id, value), weight, count in zip(grouped.index, grouped['weight'], grouped['count']):
+        result.setdefault(user_id, {})[str(value)] = {'weight': round(float(weight), 3), 'count': int(count)}
+    return result
+
+def _movie_list(rows: pd.DataFrame) -> Dict[int, List[Dict]]:
+    result: Dict[int, List[Dict]] = {}
+    for user_id, movie_id, title, rating, year in zip(rows['userId'], rows['movieId'], rows['title'], rows['rating'], rows['year']):
+        result.setdefault(user_id, []).append({
+            'movieId': int(movie_id),
+            'title': title,
+            'rating': float(rating),
+            'year': None if pd.isna(year) else int(year),
+        })
+    return result
+
+# Ratings whose movie is missing from the movies table, which profiles leave out
+_MISSING_MOVIES_QUERY = """
+    SELECT r.userId, r.movieId
+    FROM ratings_db.ratings AS r
+    LEFT JOIN movies AS m ON m.movieId = r.movieId
+    WHERE m.movieId IS NULL
+    ORDER BY r.userId, r.movieId
+"""
+
+def compute_profiles(rows: pd.DataFrame, missing_movie_ids: Optional[Dict[int, List[int]]] = None) -> Dict[int, Dict]:
+    """
+    Builds taste profiles for every user in `rows` (ratings joined to movie
+    details and enrichment attributes) with grouped, vectorized aggregations.
+    `missing_movie_ids` ({userId: [movieId]}) lists each user's ratings of
+    movies without details, kept in the profile. Returns {userId: profile}.
+    """
+    if rows.empty:
+        return {}
+    rows = rows.copy()
+    rows['year'] = pd.to_numeric(rows['releaseDate'].astype(str).str[:4], errors='coerce')
+    rows['era'] = (rows['year'] // 10 * 10).map(lambda decade: None if pd.isna(decade) else f"{int(decade)}s")
+    rows['deviation'] = rows['rating'] - rows.groupby('userId')['rating'].transform('mean')
+
+    stats = rows.groupby('userId')['rating'].agg(['count', 'mean'])
+    stats['variance'] = rows.groupby('userId')['rating'].var(ddof=0)
+    stats['liked_share'] = (rows['rating'] >= 4).groupby(rows['userId']).mean()
+
+    # Genres are parsed once per movie, then exploded to one row per (rating, genre)
+    movie_genres = rows.drop_duplicates('movieId').set_index('movieId')['genres'].map(db.parse_genres)
+    genre_rows = rows[['userId', 'movieId', 'deviation']].assign(genre=rows['movieId'].map(movie_genres)).explode('genre')
+    genres = _preference_weights(genre_rows, 'genre')
+    preferences = {column: _preference_weights(rows, column) for column in PREFERENCE_COLUMNS}
+
+    # Favourites and least favourites: highest and lowest rated, most recent first within a rating
+    ordered = rows.sort_values(['userId', 'rating', 'timestamp'], ascending=[True, False, False])
+    top_movies = _movie_list(ordered.groupby('userId').head(PROFILE_TOP_MOVIES))
+    ordered = rows.sort_values(['userId', 'rating', 'timestamp'], ascending=[True, True, False])
+    bottom_movies = _movie_list(ordered.groupby('userId').head(PROFILE_TOP_MOVIES))
+
+    profiles = {}
+    for user_id, count, mean, variance, liked_share in zip(
+        stats.index, stats['count'], stats['mean'], stats['variance'], stats['liked_share']
+    ):
+        user_genres = genres.get(user_id, {})
+        profiles[int(user_id)] = {
+            'rating_count': int(count),
+            'rating_mean': round(float(mean), 3),
+            'rating_variance': round(float(variance), 3),
+            'liked_share': round(float(liked_share), 3),
+            'genres': dict(sorted(user_genres.items(), key=lambda item: item[1]['weight'], reverse=True)),
+            **{column: preferences[column].get(user_id, {}) for column in PREFERENCE_COLUMNS},
+            'top_movies': top_movies.get(user_id, []),
+            'bottom_movies': bottom_movies.get(user_id, []),
+            'missing_movie_ids': (missing_movie_ids or {}).get(user_id, []),
+        }
+    return profiles
+
+def _source_checksums(user_id: Optional[int] = None) -> pd.DataFrame:
+    """
+    Per user, used to tell when a stored profile is stale: the rating count and
+    sum, and source_catalog, how many of the rated movies have details, enrichment
+    rows and LLM attributes (summed), which grows as the rated movies are enriched.
+    """
+    query = """
+        SELECT
+            r.userId,
+            COUNT(*) AS source_count,
+            COALESCE(SUM(r.rating), 0) AS source_sum,
+            COUNT(m.movieId) + COUNT(me.movieId) + COUNT(me.sentiment) AS source_catalog
+        FROM ratings_db.ratings AS r
+        LEFT JOIN movies AS m ON m.movieId = r.movieId
+        LEFT JOIN movies_enriched AS me ON me.movieId = r.movieId
+    """
+    params = ()
+    if user_id is not None:
+        query += " WHERE r.userId = ?"
+        params = (int(user_id),)
+    query += " GROUP BY r.userId"
+    return pd.read_sql_query(query, db.get_catalog_connection(), params=params)
+
+def save_profiles(profiles: Dict[int, Dict], checksums: pd.DataFrame):
+    checksums = checksums.set_index('userId')
+    now = time.time()
+    rows = [
+        (
+            user_id, profile['rating_count'], profile['rating_mean'], profile['rating_variance'],
+            int(checksums.at[user_id, 'source_count']), float(checksums.at[user_id, 'source_sum']),
+            int(checksums.at[user_id, 'source_catalog']), json.dumps(profile), now,
+        )
+        for user_id, profile in profiles.items()
+        if user_id in checksums.index
+    ]
+    with db.write_connection(db.RATINGS_DB_PATH) as conn:
+        conn.executemany(
+            "INSERT INTO user_profiles (userId, rating_count, rating_mean, rating_variance, source_count, source_sum, "
+            "source_catalog, profile, built_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(userId) DO UPDATE SET rating_count = excluded.rating_count, rating_mean = excluded.rating_mean, "
+            "rating_variance = excluded.rating_variance, source_count = excluded.source_count, "
+            "source_sum = excluded.source_sum, source_catalog = excluded.source_catalog, "
+            "profile = excluded.profile, built_at = excluded.built_at",
+            rows
+        )
+
+def build_user_profiles() -> int:
+    """Recomputes every user's profile in one pass over the ratings and stores them. Returns the number built."""
+    start = time.perf_counter()
+    conn = db.get_catalog_connection()
+    rows = pd.read_sql_query(_ALL_RATINGS_QUERY, conn)
+    missing = pd.read_sql_query(_MISSING_MOVIES_QUERY, conn)
+    profiles = compute_profiles(rows, {int(user_id): ids.tolist() for user_id, ids in missing.groupby('userId')['movieId']})
+    save_profiles(profiles, _source_checksums())
+    print(f"Built {len(profiles)} user profile(s) from {len(rows)} rating(s) in {time.perf_counter() - start:.1f}s")
+    return len(profiles)
+
+@traced('profiles.get_user_profile')
+def get_user_profile(user_id: int) -> Optional[Dict]:
+    """
+    Returns the user's taste profile. A stored profile is used while the user's
+    ratings, and the details and enrichment of the movies they rated, are
+    unchanged; otherwise it is recomputed from their ratings and stored. Tiers
+    recomputed in place by `build-index attributes` do not change the checksum,
+    so rebuild the profiles after it. Returns None if the user has no ratings.
+    """
+    checksums = _source_checksums(user_id)
+    if checksums.empty:
+        return None
+    row = db.get_read_connection(db.RATINGS_DB_PATH).execute(
+        "SELECT source_count, source_sum, source_catalog, profile FROM user_profiles WHERE userId = ?", (int(user_id),)
+    ).fetchone()
+    if (
+        row is not None
+        and row['source_count'] == checksums.at[0, 'source_count']
+        and np.isclose(row['source_sum'], checksums.at[0, 'source_sum'])
+        and row['source_catalog'] == checksums.at[0, 'source_catalog']
+    ):
+        return json.loads(row['profile'])
+
+    rows = db.get_user_ratings_with_details(user_id)
+    missing_movie_ids = sorted(rows.loc[rows['has_details'] == 0, 'movieId'].tolist())
+    profile = compute_profiles(rows[rows['has_details'] == 1], {int(user_id): missing_movie_ids}).get(int(user_id))
+    if profile is None:
+        # Rated, but none of the rated movies have details
+        return {'rating_count': 0, 'missing_movie_ids': missing_movie_ids}
+    save_profiles({int(user_id): profile}, checksums)
+    return profile
@@ -5,12 +5,13 @@ import os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-from llm_client import LLMClient
+from typing import Optional
+from llm_client import LLMClient, get_llm_client
 from prompts import Prompts
 
 class SQLQueryGenerator:
-    def __init__(self):
-        self.llm_client = LLMClient()
+    def __init__(self, llm_client: Optional[LLMClient] = None):
+        self.llm_client = llm_client or get_llm_client()
 
     def generate_sql_query(self, user_input: str) -> str:
         system_message = Prompts.get_query_generation_system_message()